@@ -1,7 +1,7 @@
-local function function_avg(group, value)
+local function function_avg(agg, group, value)
     -- A single null value means this group is now and forever null.
     if value == cjson.null or value == nil then
-        redis.call('HSET', 'agg', group, 'null')
+        agg[group] = cjson.null
         return
     end
 
@@ -9,16 +9,15 @@ local function function_avg(group, value)
         error('avg() can only be used with null or numbers.')
     end
 
-    if redis.call('HGET', 'agg', group) ~= 'null' then
-        redis.call('HINCRBY', 'agg', group, tostring(value))
+    if agg[group] ~= cjson.null then
+        agg[group] = (agg[group] or 0) + value
     end
 end
 
-local function function_avg_post(unique_group, group)
-    local total = tonumber(redis.call('HGET', 'agg', group))
-    local count = tonumber(redis.call('HGET', 'group', unique_group))
-    if total == nil then
+local function function_avg_post(agg, groups, unique_group, group)
+    local total = agg[group]
+    if total == nil or total == cjson.null then
         return cjson.null
     end
-    return total / count
+    return total / groups[unique_group]
 end
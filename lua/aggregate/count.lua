@@ -1,10 +1,10 @@
-local function function_count(group, value)
+local function function_count(agg, group, value)
     if value ~= cjson.null and value ~= nil then
-        redis.call('HINCRBY', 'agg', group, '1')
+        agg[group] = (agg[group] or 0) + 1
     end
 end
 
 --noinspection UnusedDef
-local function function_count_post(unique_group, group)
-    return redis.call('HGET', 'agg', group)
+local function function_count_post(agg, groups, unique_group, group)
+    return agg[group]
 end
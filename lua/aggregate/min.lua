@@ -1,7 +1,7 @@
-local function function_min(group, value)
+local function function_min(agg, group, value)
     -- A single null value means this group is now and forever null.
     if value == cjson.null or value == nil then
-        redis.call('HSET', 'agg', group, 'null')
+        agg[group] = cjson.null
         return
     end
 
@@ -9,19 +9,17 @@ local function function_min(group, value)
         error('min() can only be used with null or numbers.')
     end
 
-    local current_value = redis.call('HGET', 'agg', group)
-    if current_value == 'null' then
+    local current_value = agg[group]
+    if current_value == cjson.null then
         return
     end
 
-    if current_value == false then
-        redis.call('HSET', 'agg', group, tostring(value))
-    elseif value < tonumber(current_value) then
-        redis.call('HSET', 'agg', group, tostring(value))
+    if current_value == nil or value < current_value then
+        agg[group] = value
     end
 end
 
 --noinspection UnusedDef
-local function function_min_post(unique_group, group)
-    return redis.call('HGET', 'agg', group)
+local function function_min_post(agg, groups, unique_group, group)
+    return agg[group]
 end
@@ -1,7 +1,7 @@
-local function function_sum(group, value)
+local function function_sum(agg, group, value)
     -- A single null value means this group is now and forever null.
     if value == cjson.null or value == nil then
-        redis.call('HSET', 'agg', group, 'null')
+        agg[group] = cjson.null
         return
     end
 
@@ -9,12 +9,12 @@ local function function_sum(group, value)
         error('sum() can only be used with null or numbers.')
     end
 
-    if redis.call('HGET', 'agg', group) ~= 'null' then
-        redis.call('HINCRBY', 'agg', group, tostring(value))
+    if agg[group] ~= cjson.null then
+        agg[group] = (agg[group] or 0) + value
     end
 end
 
 --noinspection UnusedDef
-local function function_sum_post(unique_group, group)
-    return redis.call('HGET', 'agg', group)
+local function function_sum_post(agg, groups, unique_group, group)
+    return agg[group]
 end
@@ -63,3 +63,242 @@ local function row_is_locked(row, xid, xids)
     -- The record is expired and another transaction holds it.
     return row[':xex'] ~= 0 and xids[row[':xex']]
 end
+
+-- The rank of each type when sorting. Booleans come first, then numbers and
+-- then strings. A SQL NULL (or a missing value) is greater than everything.
+local order_type_rank = { boolean = 1, number = 2, string = 3 }
+
+local function order_rank(value)
+    if value == nil or value == cjson.null then
+        return 4
+    end
+
+    if type(value) == 'table' then
+        error('ORDER BY used on an array or object.')
+    end
+
+    return order_type_rank[type(value)]
+end
+
+-- Compare two values for ORDER BY. Returns -1, 0 or 1 for less than, equal and
+-- greater than.
+local function order_compare(a, b)
+    local rank_a, rank_b = order_rank(a), order_rank(b)
+    if rank_a ~= rank_b then
+        return rank_a < rank_b and -1 or 1
+    end
+
+    if rank_a == 4 or a == b then
+        return 0
+    end
+
+    -- false < true
+    if rank_a == 1 then
+        return b and -1 or 1
+    end
+
+    return a < b and -1 or 1
+end
+
+-- A binary heap where the item at the top is the one that comes last according
+-- to `before(a, b)`. Used to keep the first N items of a larger set.
+local function heap_sift_up(heap, before, i)
+    while i > 1 do
+        local parent = math.floor(i / 2)
+        if not before(heap[parent], heap[i]) then
+            break
+        end
+        heap[parent], heap[i] = heap[i], heap[parent]
+        i = parent
+    end
+end
+
+local function heap_sift_down(heap, before, i)
+    local size = #heap
+    while true do
+        local largest = i
+        local left, right = i * 2, i * 2 + 1
+        if left <= size and before(heap[largest], heap[left]) then
+            largest = left
+        end
+        if right <= size and before(heap[largest], heap[right]) then
+            largest = right
+        end
+        if largest == i then
+            break
+        end
+        heap[largest], heap[i] = heap[i], heap[largest]
+        i = largest
+    end
+end
+
+-- Offer an item to a heap that holds at most `size` items.
+local function heap_offer(heap, before, size, item)
+    if #heap < size then
+        heap[#heap + 1] = item
+        heap_sift_up(heap, before, #heap)
+    elseif size > 0 and before(item, heap[1]) then
+        heap[1] = item
+        heap_sift_down(heap, before, 1)
+    end
+end
+
+-- Append the record IDs from index entries (see index.py) to `ids`. An entry
+-- always ends with the record ID. Records already in `seen` are skipped so the
+-- results of several lookups can be combined.
+local function index_record_ids(entries, ids, seen)
+    for _, entry in ipairs(entries) do
+        local id = tonumber(string.match(entry, '%d+$'))
+        if not seen[id] then
+            seen[id] = true
+            ids[#ids + 1] = id
+        end
+    end
+end
+
+-- Find the entries in a nonnumber index that may have a string between `lower`
+-- and `upper` (either can be nil). The ':' that separates the string from the
+-- record ID sorts after some characters so a string that is a prefix of `upper`
+-- can be stored after `upper` itself. These are found with extra lookups. The
+-- result may contain strings outside of the range.
+local function index_string_range(key, lower, upper)
+    local min = '[S'
+    if lower ~= nil then
+        min = '[S' .. lower
+    end
+
+    if upper == nil then
+        return redis.call('ZRANGEBYLEX', key, min, '(T')
+    end
+
+    local entries = redis.call('ZRANGEBYLEX', key, min, '[S' .. upper .. '\255')
+    for i = 0, #upper - 1 do
+        if string.byte(upper, i + 1) <= 58 then
+            local prefix = '[S' .. string.sub(upper, 1, i) .. ':'
+            local found = redis.call('ZRANGEBYLEX', key, prefix, prefix .. '\255')
+            for _, entry in ipairs(found) do
+                entries[#entries + 1] = entry
+            end
+        end
+    end
+
+    return entries
+end
+
+-- Keep only the record IDs (see index_record_ids()) that are also in
+-- `other_seen`. Returns the new list and the table of IDs that are in it.
+local function index_intersect_ids(ids, other_seen)
+    local kept, seen = {}, {}
+    for _, id in ipairs(ids) do
+        if other_seen[id] then
+            kept[#kept + 1] = id
+            seen[id] = true
+        end
+    end
+
+    return kept, seen
+end
+
+-- Encode a value as JSON the same as cjson.encode() except that numbers keep
+-- their exact value. cjson only uses 14 significant digits, up to 17 are used
+-- when they are needed. This is much slower than cjson.encode() so it is only
+-- used to store records that have been changed by the Lua (see
+-- `Table.lua_add_lua_record()`).
+local function json_encode(value)
+    if type(value) == 'number' then
+        local text = string.format('%.14g', value)
+        if tonumber(text) == value or value ~= value or
+                value == math.huge or value == -math.huge then
+            return cjson.encode(value)
+        end
+
+        return string.format('%.17g', value)
+    end
+
+    if type(value) ~= 'table' then
+        return cjson.encode(value)
+    end
+
+    local count, size, is_array = 0, 0, true
+    for key in pairs(value) do
+        count = count + 1
+        if type(key) == 'number' and key >= 1 and key % 1 == 0 then
+            size = math.max(size, key)
+        else
+            is_array = false
+        end
+    end
+
+    local parts = {}
+    if is_array and count > 0 then
+        -- Leave sparse arrays to cjson.
+        if size ~= count then
+            return cjson.encode(value)
+        end
+
+        for i = 1, size do
+            parts[i] = json_encode(value[i])
+        end
+
+        return '[' .. table.concat(parts, ',') .. ']'
+    end
+
+    for key, item in pairs(value) do
+        parts[#parts + 1] = cjson.encode(tostring(key)) .. ':' ..
+            json_encode(item)
+    end
+
+    return '{' .. table.concat(parts, ',') .. '}'
+end
+
+-- Add a value to a batch of index entries (see index.py). The batch is a table
+-- with `numbers` and `nonnumbers` that are written with index_batch_flush(). A
+-- missing value is indexed as null.
+--
+-- Numbers are formatted with 17 significant digits. tostring() (and Redis when
+-- it is given a Lua number) only uses 14 so the score would not be the exact
+-- value.
+local function index_batch_add(batch, value, id)
+    if type(value) == 'number' then
+        batch.numbers[#batch.numbers + 1] = string.format('%.17g', value)
+        batch.numbers[#batch.numbers + 1] = tostring(id)
+        return
+    end
+
+    local entry
+    if value == nil or value == cjson.null then
+        entry = 'N:'
+    elseif value == true then
+        entry = 'T:'
+    elseif value == false then
+        entry = 'F:'
+    elseif type(value) == 'table' then
+        entry = 'S' .. cjson.encode(value) .. ':'
+    else
+        entry = 'S' .. value .. ':'
+    end
+
+    batch.nonnumbers[#batch.nonnumbers + 1] = 0
+    batch.nonnumbers[#batch.nonnumbers + 1] = entry .. tostring(id)
+end
+
+-- Write a batch of index entries with a single ZADD for each index key and
+-- empty the batch.
+local function index_batch_flush(batch, number_key, nonnumber_key)
+    if #batch.numbers > 0 then
+        redis.call('ZADD', number_key, unpack(batch.numbers))
+        batch.numbers = {}
+    end
+
+    if #batch.nonnumbers > 0 then
+        redis.call('ZADD', nonnumber_key, unpack(batch.nonnumbers))
+        batch.nonnumbers = {}
+    end
+end
+
+-- Add a single value to an index.
+local function index_add_value(number_key, nonnumber_key, value, id)
+    local batch = { numbers = {}, nonnumbers = {} }
+    index_batch_add(batch, value, id)
+    index_batch_flush(batch, number_key, nonnumber_key)
+end
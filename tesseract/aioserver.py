@@ -0,0 +1,240 @@
+"""The default server (see `server.Server`) handles each client connection in
+its own thread. That is simple but every idle connection still costs a thread.
+
+The ``AsyncServer`` uses ``asyncio`` instead. All of the sockets are handled by
+a single event loop so thousands of mostly idle connections are cheap. The
+statements themselves still need to talk to Redis and do CPU bound work
+(parsing, planning and compiling) so each request is executed on a bounded pool
+of worker threads. Requests from a single connection are always executed one
+at a time and in order.
+
+The responses are written by the event loop. A worker thread only produces the
+next response (like the next chunk of a streamed result) once the previous one
+has been drained to the socket, so a slow client holds up its own request but
+never a worker thread.
+
+A worker thread executing a request takes on the identity of the connection
+(see `connection.Connection.current_connection()`) for the duration of the
+request.
+
+This requires Python 3.7 or later. Start the server with::
+
+    bin/tesseract --async --workers=8
+"""
+
+import asyncio
+import concurrent.futures
+import struct
+from tesseract import connection
+from tesseract import instance
+from tesseract import protocol
+
+
+class AsyncConnection(connection.Connection):
+    """A client connection handled by the `AsyncServer`. It is never started as
+    a thread. Messages are read and written by the event loop and the requests
+    are executed on the worker threads.
+    """
+
+    def __init__(self, reader, writer, connection_id, tesseract, loop):
+        """Create the connection.
+
+        Arguments:
+          reader (asyncio.StreamReader): The incoming stream.
+          writer (asyncio.StreamWriter): The outgoing stream.
+          connection_id (int): The connection ID.
+          tesseract (Instance): The instance.
+          loop (asyncio.AbstractEventLoop): The event loop that owns the
+            streams.
+        """
+        connection.Connection.__init__(self, None, connection_id, tesseract)
+        self.__stream_reader = reader
+        self.__writer = writer
+        self.__loop = loop
+
+    async def write(self, data):
+        """Send a single message to the client and wait until it has been
+        drained to the socket, so that a large result cannot fill the memory of
+        the server.
+
+        Arguments:
+          data (str or bytes): The encoded JSON message.
+        """
+        self.__writer.write(
+            protocol.Protocol.encode_frame(self._reader.framing, data)
+        )
+        await self.__writer.drain()
+
+    async def read(self):
+        """Wait for the next request. See `protocol.FrameReader.read()`.
+
+        Returns:
+          The request as bytes. This will be empty if the client has
+          disconnected.
+        """
+        framing = self._reader.framing
+
+        try:
+            # Without framing whatever arrives in a single read is the message.
+            if framing is None:
+                return await self.__stream_reader.read(self._reader.buffer_size)
+
+            if framing == protocol.Protocol.FRAMING_NEWLINE:
+                message = await self.__stream_reader.readuntil(b'\n')
+                return message[:-1]
+
+            header = await self.__stream_reader.readexactly(4)
+            length = struct.unpack('>I', header)[0]
+            return await self.__stream_reader.readexactly(length)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return b''
+
+    def run_as_connection(self, method, *args):
+        """Run a method on the current (worker) thread as if it was the thread
+        for this connection.
+
+        Arguments:
+          method (callable): The method to run.
+          args: The arguments for the method.
+
+        Returns:
+          Whatever the method returns.
+        """
+        connection.Connection._current.connection = self
+        try:
+            return method(*args)
+        finally:
+            connection.Connection._current.connection = None
+
+
+class AsyncServer(object):
+    """A server that handles all of the client connections on a single event
+    loop.
+
+    Attributes:
+      MAX_MESSAGE_SIZE (int): The largest request that can be read.
+      is_ready (bool): Indicates is the server is ready and accepting
+        connections.
+      instance (Instance): The instance.
+    """
+
+    MAX_MESSAGE_SIZE = 1 << 30
+
+    def __init__(self, redis_host=None, port=3679, watch_lua=False, workers=8):
+        """Create the server.
+
+        Arguments:
+          redis_host (str): The host and optional port for the Redis server.
+          port (int): The port number to run the server on.
+          watch_lua (bool): Reload the Lua library when the files change. This
+            is only useful when developing the Lua library.
+          workers (int): The maximum number of requests that can be executed at
+            the same time.
+        """
+        assert redis_host is None or isinstance(redis_host, str)
+        assert isinstance(port, int)
+        assert isinstance(watch_lua, bool)
+        assert isinstance(workers, int) and workers > 0
+
+        self.instance = instance.Instance(self, redis_host, watch_lua)
+        self.is_ready = False
+        self.__port = port
+        self.__workers = workers
+        self.__next_connection_id = 0
+        self.__loop = None
+
+    def start(self):
+        """Start accepting connections. This will not return until exit() is
+        called.
+        """
+        self.__loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.__loop)
+        self.__executor = concurrent.futures.ThreadPoolExecutor(self.__workers)
+
+        server = self.__loop.run_until_complete(asyncio.start_server(
+            self.__handle_connection,
+            '0.0.0.0',
+            self.__port,
+            limit=self.MAX_MESSAGE_SIZE
+        ))
+
+        self.instance.log("Server ready and listening on port %d." % self.__port)
+        self.is_ready = True
+
+        try:
+            self.__loop.run_forever()
+        finally:
+            server.close()
+
+            # Any connections that are still open are abandoned.
+            tasks = asyncio.all_tasks(self.__loop)
+            for task in tasks:
+                task.cancel()
+            self.__loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True)
+            )
+
+            self.__executor.shutdown(wait=False)
+            self.__loop.close()
+
+    def exit(self):
+        """Stop the server. This is safe to call from any thread."""
+        self.instance.exit()
+        self.is_ready = False
+
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+
+    async def __handle_connection(self, reader, writer):
+        """Handle all of the requests for a single client connection."""
+        self.__next_connection_id += 1
+        connection_id = self.__next_connection_id
+
+        client = await self.__loop.run_in_executor(
+            self.__executor, AsyncConnection, reader, writer, connection_id,
+            self.instance, self.__loop
+        )
+        self.instance.log("Accepted connection (%d)." % connection_id)
+
+        try:
+            await self.__execute(client, client._setup_no_table)
+
+            while True:
+                data = await client.read()
+
+                # When data is blank it means the client has disconnected.
+                if len(data) == 0:
+                    break
+
+                await self.__handle_request(client, data)
+
+            await self.__execute(client, client._disconnect_client)
+        finally:
+            writer.close()
+
+    async def __handle_request(self, client, data):
+        """Process a single request. Each response is produced on a worker
+        thread and then written by the event loop (see
+        `connection.Connection.responses()`).
+        """
+        responses = client.responses(data)
+        try:
+            while True:
+                message = await self.__execute(client, next, responses, None)
+                if message is None:
+                    break
+
+                await client.write(message)
+        finally:
+            # The request is abandoned if the client goes away.
+            await self.__execute(client, responses.close)
+
+    def __execute(self, client, method, *args):
+        """Run a method of the connection on one of the worker threads.
+
+        Returns:
+          An awaitable.
+        """
+        return self.__loop.run_in_executor(self.__executor,
+                                           client.run_as_connection, method,
+                                           *args)
@@ -95,9 +95,17 @@ class Value(Expression):
     """A constant value of any type (numbers, strings, arrays, etc) like `3`,
     `"foo"`, `[1, 2]`, etc.
 
+    Attributes:
+      value: The raw value.
+      param (int): If this is set the value is not compiled into the Lua.
+        Instead it will be read from the arguments passed to the Lua program
+        where `param` is the position of the value (starting at 0) in the list
+        of parameters. See `parser.fingerprint()`.
+
     """
-    def __init__(self, value):
+    def __init__(self, value, param=None):
         self.value = value
+        self.param = param
 
     def __eq__(self, other):
         """This is more of a convenience method for testing. It allows us to
@@ -158,7 +166,13 @@ class Value(Expression):
         value for when you explicitly want a `null` in the JSON output - this is
         called `cjson.null`.
 
+        Parametrized values are read from the arguments instead. The arguments
+        start straight after the `offset` arguments that are not parameters.
+
         """
+        if self.param is not None:
+            return ('args[%d]' % (offset + self.param + 1), offset, [])
+
         value = str(self)
 
         if self.value is None:
@@ -170,6 +184,31 @@ class Value(Expression):
 
         return (value, offset, [])
 
+    def bind(self, params):
+        """Get the raw value (including any nested values) where parameters
+        are replaced with their values for this execution.
+
+        Arguments:
+          params (list): The values for the parameters. See
+            `parser.ParseResult.params`.
+
+        Returns:
+          The raw value.
+        """
+        assert isinstance(params, list)
+
+        if self.param is not None:
+            return params[self.param]
+
+        if isinstance(self.value, list):
+            return [value.bind(params) for value in self.value]
+
+        if isinstance(self.value, dict):
+            return dict((key, value.bind(params))
+                        for key, value in self.value.items())
+
+        return self.value
+
     def signature(self):
         """Values use a two 3 character signature:
 
@@ -340,7 +379,7 @@ class FunctionCall(Expression):
         lua_arg, offset, new_args = self.argument.compile_lua(offset)
 
         if self.is_aggregate():
-            lua = 'function_%s(group, %s)' % (self.function_name, lua_arg)
+            lua = 'function_%s(agg, group, %s)' % (self.function_name, lua_arg)
         else:
             lua = 'function_%s(%s)' % (self.function_name, lua_arg)
 
@@ -477,23 +516,37 @@ class GroupExpression(Expression):
 
 
 class OrderByClause:
-    """An `ORDER BY` to be used with `SELECT`."""
+    """An `ORDER BY` to be used with `SELECT`.
 
-    def __init__(self, field_name, ascending):
-        assert isinstance(field_name, Identifier)
-        assert ascending is None or isinstance(ascending, bool)
+    Attributes:
+      columns (list of tuple): Each of the columns to sort by as a pair of the
+        field name (Identifier) and the direction. The direction is True for
+        ASC, False for DESC or None if it was not specified (which is the same
+        as ASC). Each column is only used to order the rows that are equal for
+        all of the columns before it.
+    """
 
-        self.field_name = field_name
-        self.ascending = ascending
+    def __init__(self, columns):
+        assert isinstance(columns, list)
+        assert len(columns) > 0
+        for field_name, ascending in columns:
+            assert isinstance(field_name, Identifier)
+            assert ascending is None or isinstance(ascending, bool)
+
+        self.columns = columns
 
     def __str__(self):
-        direction = ''
-        if self.ascending is True:
-            direction = ' ASC'
-        elif self.ascending is False:
-            direction = ' DESC'
+        columns = []
+        for field_name, ascending in self.columns:
+            direction = ''
+            if ascending is True:
+                direction = ' ASC'
+            elif ascending is False:
+                direction = ' DESC'
+
+            columns.append('%s%s' % (field_name, direction))
 
-        return 'ORDER BY %s%s' % (self.field_name, direction)
+        return 'ORDER BY %s' % ', '.join(columns)
 
 
 class LimitClause:
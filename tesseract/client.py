@@ -4,6 +4,7 @@ tesseract server.
 
 import json
 import socket
+import threading
 from tesseract import protocol
 from tesseract import transaction
 
@@ -17,9 +18,11 @@ class Client:
       _socket (socket.socket): The socket between the client and server.
       _host (str): The server host - this should not include the port.
       _port (int): The server port.
+      _framing (str): The framing used for messages, see `protocol`.
+      _reader (protocol.FrameReader): Reads the responses from the socket.
     """
 
-    def __init__(self, host='127.0.0.1', port=3679):
+    def __init__(self, host='127.0.0.1', port=3679, framing=None):
         """Create a new client. The connection is made in the constructor.
 
         Arguments:
@@ -27,6 +30,9 @@ class Client:
             localhost is used.
           port (int, optional): The port the server is running on. If no
             specified the default port 3679 is used.
+          framing (str, optional): Use framed messages, either
+            `Protocol.FRAMING_LENGTH` or `Protocol.FRAMING_NEWLINE`. This is
+            required for large requests and for execute_many().
 
         Example:
           >>> client = Client()
@@ -36,8 +42,11 @@ class Client:
         assert isinstance(host, str)
         assert isinstance(port, int)
 
+        assert framing is None or isinstance(framing, str)
+
         self._host = host
         self._port = port
+        self._framing = framing
         self.warnings = []
         self._connect()
 
@@ -66,6 +75,193 @@ class Client:
         assert isinstance(sql, str)
         result = self._send(protocol.Protocol.sql_request(sql))
 
+        return self._process_result(result)
+
+    def execute_iter(self, sql):
+        """Execute a SQL statement and receive the rows as they are streamed
+        from the server. The client must have been created with framing.
+
+        The rows must all be consumed before the client can be used for another
+        statement.
+
+        Arguments:
+          sql (str): A single SQL statement.
+
+        Returns:
+          A generator that yields each row.
+
+        Raises:
+          ClientException if an error occurs.
+
+        Examples:
+          >>> client = Client(framing=Protocol.FRAMING_LENGTH)
+          >>> for row in client.execute_iter("SELECT * FROM people"):
+          ...     print(row)
+        """
+        assert isinstance(sql, str)
+        assert self._framing is not None, 'execute_iter() requires framing.'
+
+        self._send_request(protocol.Protocol.sql_request(sql, stream=True))
+
+        return self._read_rows()
+
+    def _read_rows(self):
+        """Read the streamed responses for a single request.
+
+        Returns:
+          A generator that yields each row.
+        """
+        while True:
+            response = self._read_response()
+            data = self._process_result(response)
+
+            for row in data or []:
+                yield row
+
+            if not response.get('more', False):
+                return
+
+    def execute_many(self, statements):
+        """Execute several SQL statements without waiting for the response of
+        each statement before sending the next one (pipelining). The client must
+        have been created with framing.
+
+        The requests are sent from another thread while the responses are
+        read. The server does not read the next request until it has sent the
+        response for the previous one so if all of the requests were sent
+        before reading any responses both sides would wait on each other once
+        the socket buffers are full.
+
+        Arguments:
+          statements (list of str): The SQL statements.
+
+        Returns:
+          A list containing the result of each statement.
+
+        Raises:
+          ClientException if any of the statements fail. All of the statements
+          will have been executed.
+        """
+        assert isinstance(statements, list)
+        assert self._framing is not None, 'execute_many() requires framing.'
+
+        requests = []
+        for sql in statements:
+            assert isinstance(sql, str)
+            requests.append(protocol.Protocol.sql_request(sql))
+
+        errors = []
+        sender = threading.Thread(target=self.__send_requests,
+                                  args=(requests, errors))
+        sender.daemon = True
+        sender.start()
+
+        try:
+            responses = [self._read_response() for _ in statements]
+        finally:
+            sender.join()
+
+            # A failed send is the reason for the failed read.
+            if errors:
+                raise errors[0]
+
+        results = []
+        error = None
+        for response in responses:
+            try:
+                results.append(self._process_result(response))
+            except ClientException as e:
+                results.append(None)
+                error = error or e
+
+        if error:
+            raise error
+
+        return results
+
+    def __send_requests(self, requests, errors):
+        """Send several requests. This is run on its own thread by
+        execute_many().
+
+        Arguments:
+          requests (list of dict): The requests.
+          errors (list): Any exception raised while sending is appended to
+            this.
+        """
+        try:
+            for request in requests:
+                self._send_request(request)
+        except socket.error as e:
+            errors.append(e)
+
+            # Wake up the reads that are waiting for responses that will never
+            # come.
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def prepare(self, sql):
+        """Prepare a SQL statement that can be executed many times with
+        execute_prepared(). Use a `?` as a placeholder for each value.
+
+        Arguments:
+          sql (str): A single SQL statement.
+
+        Returns:
+          int handle for the prepared statement. The handle can only be used
+          with this client.
+
+        Raises:
+          ClientException if an error occurs.
+
+        Examples:
+          >>> client = Client()
+          >>> insert = client.prepare('INSERT INTO people {"name": ?}')
+          >>> client.execute_prepared(insert, ["Bob"])
+        """
+        assert isinstance(sql, str)
+        result = self._send(protocol.Protocol.prepare_request(sql))
+
+        if result['success']:
+            return result['handle']
+
+        raise ClientException(result['error'])
+
+    def execute_prepared(self, handle, params):
+        """Execute a prepared statement and return the result.
+
+        Arguments:
+          handle (int): The handle returned from prepare().
+          params (list): The values for each of the placeholders. Each value
+            must be None, a bool, a number or a str.
+
+        Returns:
+          A mixed result for the query.
+
+        Raises:
+          ClientException if an error occurs.
+        """
+        assert isinstance(handle, int)
+        assert isinstance(params, list)
+        result = self._send(protocol.Protocol.execute_request(handle, params))
+
+        return self._process_result(result)
+
+    def _process_result(self, result):
+        """Retain the warnings and unpack the result from the server.
+
+        Arguments:
+          result (dict): The server response.
+
+        Returns:
+          A mixed result for the query.
+
+        Raises:
+          ClientException if the response is an error.
+        """
+        assert isinstance(result, dict)
+
         self.warnings = result['warnings'] if 'warnings' in result else []
 
         if result['success']:
@@ -97,6 +293,15 @@ class Client:
         """
         self._socket = socket.socket()
         self._socket.connect((self._host, self._port))
+        self._reader = protocol.FrameReader(self._socket, 1048576)
+
+        if self._framing is not None:
+            request = protocol.Protocol.framing_request(self._framing)
+            response = self._send(request)
+            if not response['success']:
+                raise ClientException(response['error'])
+
+            self._reader.framing = self._framing
 
     def _send_request(self, request):
         """Send a request to the server.
@@ -105,10 +310,10 @@ class Client:
           request (dict): The request.
         """
         assert isinstance(request, dict)
-        try:
-            self._socket.send(bytes(json.dumps(request), 'UTF-8'))
-        except TypeError:
-            self._socket.send(json.dumps(request))
+        self._socket.sendall(protocol.Protocol.encode_frame(
+            self._reader.framing,
+            json.dumps(request)
+        ))
 
     def _read_response(self):
         """Wait on the response from the server.
@@ -116,7 +321,7 @@ class Client:
         Returns:
           A dict containing the server response.
         """
-        response = self._socket.recv(1048576)
+        response = self._reader.read()
         return json.loads(response.decode())
 
     def close(self):
@@ -1,73 +1,214 @@
 import json
 import socket
 import threading
+from tesseract import index
 from tesseract import instance
 from tesseract import parser
+from tesseract import plan
 from tesseract import protocol
 from tesseract import select
+from tesseract import statement
 from tesseract import transaction
 
 
 class Connection(threading.Thread):
+    """A Connection handles all of the requests from a single client in its own
+    thread.
+
+    Attributes:
+      _reader (protocol.FrameReader): Reads the requests. Only the `framing` is
+        used outside of run().
+      _current (threading.local): The connection that the current thread is
+        executing a request for, when it is not the thread of the connection
+        itself. See current_connection().
+    """
+
+    _current = threading.local()
+
     def __init__(self, client_socket, connection_id, tesseract):
         threading.Thread.__init__(self)
-        assert isinstance(client_socket, socket.socket)
+        assert client_socket is None or \
+            isinstance(client_socket, socket.socket)
         assert isinstance(connection_id, int)
         assert isinstance(tesseract, instance.Instance)
         self.__client_socket = client_socket
+        self._reader = protocol.FrameReader(client_socket)
         self.connection_id = connection_id
         self.instance = tesseract
         manager = transaction.TransactionManager.get_instance(tesseract.redis)
         self.transaction_id = manager.next_transaction_id()
+        self.__transient_table_id = 0
+        self.__prepared_statements = []
         self.setName(connection_id)
 
-    def __send(self, data):
-        try:
-            self.__client_socket.send(data)
-        except:
-            self.__client_socket.send(bytes(data, 'UTF-8'))
+    def _send(self, data):
+        """Send a single message to the client.
+
+        Arguments:
+          data (str or bytes): The encoded JSON message.
+        """
+        frame = protocol.Protocol.encode_frame(self._reader.framing, data)
+        self.__client_socket.sendall(frame)
 
     def run(self):
-        self.__setup_no_table()
+        self._setup_no_table()
 
         while True:
             # Read the incoming request.
-            data = self.__client_socket.recv(1024)
+            data = self._reader.read()
 
             # When data is blank it means the client has disconnected.
             if len(data) == 0:
-                self.__disconnect_client()
+                self._disconnect_client()
                 break
 
-            # Decode the JSON.
-            try:
-                request = json.loads(data.decode())
+            self.handle_request(data)
+
+    def handle_request(self, data):
+        """Process a single request and send the response(s) for it.
+
+        Arguments:
+          data (bytes): The raw request.
+        """
+        for message in self.responses(data):
+            self._send(message)
+
+    def responses(self, data):
+        """Process a single request. The request is processed as the responses
+        are consumed, each response must be sent before the next one is
+        requested.
+
+        Arguments:
+          data (bytes): The raw request.
+
+        Returns:
+          A generator that yields each encoded JSON message to be sent.
+        """
+        # Decode the JSON.
+        try:
+            request = json.loads(data.decode())
+            if 'framing' in request:
+                self.instance.log("FRAMING (%d): %s" % (self.connection_id, request['framing']))
+                for message in self.__negotiate_framing(request['framing']):
+                    yield message
+                return
+            elif 'prepare' in request:
+                self.instance.log("PREPARE (%d): %s" % (self.connection_id, request['prepare']))
+            elif 'execute' in request:
+                self.instance.log("EXECUTE (%d): %s" % (self.connection_id, request['execute']))
+            else:
                 sql = request['sql'].strip()
 
                 if len(sql) == 0:
                     self.instance.log("Empty SQL request (%d): %s" % (self.connection_id, data))
-                    self.__send('{"success":false,"error":"Empty SQL request."}')
-                    continue
+                    yield '{"success":false,"error":"Empty SQL request."}'
+                    return
 
                 self.instance.log("SQL (%d): %s" % (self.connection_id, sql))
-            except ValueError:
-                self.instance.log("Bad request (%d): %s" % (self.connection_id, data))
+        except ValueError:
+            self.instance.log("Bad request (%d): %s" % (self.connection_id, data))
+
+            # The JSON could not be decoded, return an error.
+            yield '{"success":false,"error":"Not valid JSON"}'
+            return
 
-                # The JSON could not be decoded, return an error.
-                self.__send('{"success":false,"error":"Not valid JSON"}')
-                continue
+        # Results can only be streamed when the client knows where each
+        # message ends.
+        stream = bool(request.get('stream', False))
+        if stream and self._reader.framing is None:
+            yield '{"success":false,"error":"Streaming requires framing."}'
+            return
 
+        # The result is read from its transient table while it is sent so the
+        # vacuum must leave it alone until then.
+        manager = transaction.TransactionManager.get_instance(self.instance.redis)
+        manager.protect_results()
+
+        try:
             # Process the request.
-            result = self.execute(str(request['sql']))
+            self.__transient_table_id = 0
+            if 'prepare' in request:
+                result = self.prepare(str(request['prepare']))
+            elif 'execute' in request:
+                result = self.execute_prepared(request['execute'],
+                                               request.get('params', []),
+                                               lazy=True)
+            else:
+                result = self.execute(str(request['sql']), lazy=True)
 
             # Send the response.
-            self.__send(json.dumps(result))
+            for message in self.__encode_response(result, stream):
+                yield message
+        finally:
+            manager.release_results()
+
+        if not manager.in_transaction():
+            self.transaction_id = manager.next_transaction_id()
+
+    def __encode_response(self, result, stream):
+        """Encode the response for a request. The records (if any) are sent as
+        the raw JSON read from Redis rather than being decoded and encoded
+        again.
+
+        When streaming each chunk is sent as it is read from Redis and the
+        response itself (with the warnings) is sent last. See the Streaming
+        section in `protocol`.
+
+        Arguments:
+          result (dict): The response.
+          stream (bool): Send the records in chunks.
+
+        Returns:
+          A generator that yields each encoded JSON message.
+        """
+        records = result.get('data')
+        if not isinstance(records, statement.Records):
+            yield protocol.Protocol.encode_response(result)
+            return
+
+        raw_data = []
+        for chunk in records.raw_chunks():
+            if stream:
+                yield protocol.Protocol.encode_response(
+                    protocol.Protocol.chunk_response([]),
+                    chunk
+                )
+            else:
+                raw_data.extend(chunk)
+
+        yield protocol.Protocol.encode_response(result, raw_data)
+
+    def __negotiate_framing(self, framing):
+        """Switch to framed messages and send the response. The response is
+        sent before the framing is changed so the client receives it without
+        framing. See the Framing section in `protocol`.
+
+        Arguments:
+          framing (str): The type of framing.
+
+        Returns:
+          A generator that yields the response.
+        """
+        framings = (protocol.Protocol.FRAMING_LENGTH,
+                    protocol.Protocol.FRAMING_NEWLINE)
 
-            manager = transaction.TransactionManager.get_instance(self.instance.redis)
-            if not manager.in_transaction():
-                self.transaction_id = manager.next_transaction_id()
+        if self._reader.framing is not None:
+            response = protocol.Protocol.failed_response(
+                "Framing has already been negotiated."
+            )
+        elif framing not in framings:
+            response = protocol.Protocol.failed_response(
+                "Unknown framing %s." % json.dumps(framing)
+            )
+        else:
+            response = protocol.Protocol.successful_response()
 
-    def __disconnect_client(self):
+        yield json.dumps(response)
+
+        if response['success']:
+            self._reader.framing = framing
+
+    def _disconnect_client(self):
         manager = transaction.TransactionManager.get_instance(self.instance.redis)
         if manager.in_transaction():
             self.instance.log("ROLLBACK (%d)." % self.connection_id)
@@ -75,34 +216,130 @@ class Connection(threading.Thread):
 
         self.instance.log("Client disconnected (%d)." % self.connection_id)
 
-    def execute(self, sql):
+    def execute(self, sql, use_plan_cache=True, lazy=False):
         """Execute a SQL statement.
 
         Arguments:
           sql (str): The single SQL statement to execute.
+          use_plan_cache (bool): Statements that will never be seen again (like
+            those used internally on transient tables) should not be put into
+            the plan cache.
+          lazy (bool): If True the data in the response will be a
+            `statement.Records` that has not been read yet. Otherwise it is a
+            list of records.
         """
         assert isinstance(sql, str)
+        assert isinstance(use_plan_cache, bool)
+        assert isinstance(lazy, bool)
 
         self.instance.reset_warnings()
 
         try:
-            result = parser.parse(sql)
-            self.instance.warnings = result.warnings
+            if use_plan_cache:
+                self.__refresh_plans()
+                result = plan.PlanCache.get_instance().parse(sql)
+            else:
+                result = parser.parse(sql)
+            self.instance.warnings = list(result.warnings)
 
         # We could not parse the SQL, so return the error message in the
         # response.
         except RuntimeError as e:
             return protocol.Protocol.failed_response(str(e))
 
-        return self.__execute_statement(result)
+        return self.__execute_statement(result, lazy)
+
+    def prepare(self, sql):
+        """Prepare a SQL statement so that it can be executed many times with
+        execute_prepared(). The statement is only lexed once.
+
+        Arguments:
+          sql (str): The single SQL statement with placeholders (`?`).
+
+        Returns:
+          A response containing the handle for the prepared statement.
+        """
+        assert isinstance(sql, str)
+
+        try:
+            prepared = parser.prepare(sql)
+        except RuntimeError as e:
+            return protocol.Protocol.failed_response(str(e))
+
+        self.__prepared_statements.append(prepared)
+        return protocol.Protocol.prepared_response(
+            len(self.__prepared_statements)
+        )
+
+    def execute_prepared(self, handle, params, lazy=False):
+        """Execute a statement that was prepared on this connection. If an
+        equivalent statement is in the plan cache it will not be parsed or
+        compiled again.
+
+        Arguments:
+          handle (int): The handle returned by prepare().
+          params (list): The values for the placeholders.
+          lazy (bool): See execute().
+        """
+        assert isinstance(lazy, bool)
+
+        self.instance.reset_warnings()
+
+        if not isinstance(handle, int) or \
+                not 0 < handle <= len(self.__prepared_statements):
+            return protocol.Protocol.failed_response(
+                "No such prepared statement %s." % json.dumps(handle)
+            )
+
+        try:
+            prepared = self.__prepared_statements[handle - 1]
+            tokens = prepared.bind(params)
+            self.__refresh_plans()
+            result = plan.PlanCache.get_instance().parse_tokens(tokens)
+            self.instance.warnings = list(result.warnings)
+        except RuntimeError as e:
+            return protocol.Protocol.failed_response(str(e))
+
+        return self.__execute_statement(result, lazy)
+
+    def __refresh_plans(self):
+        """The cached plans depend on the indexes, which may have been changed
+        by another server since they were compiled."""
+        index.IndexCatalog.get_instance().refresh(self.instance.redis)
+
+    def next_transient_table_id(self):
+        """Transient tables are numbered from the start of each request rather
+        than being given random names. See `table.TransientTable`.
+
+        Returns:
+          int
+        """
+        self.__transient_table_id += 1
+        return self.__transient_table_id
 
     @staticmethod
     def current_connection():
+        """The connection that the current thread is executing a request for.
+        This is the thread itself unless another thread has taken over the
+        request (see `aioserver`).
+
+        Returns:
+          A Connection.
+        """
+        connection = getattr(Connection._current, 'connection', None)
+        if connection is not None:
+            return connection
+
         return threading.current_thread()
 
-    def __execute_statement(self, result):
-        return result.statement.execute(result, self.instance)
+    def __execute_statement(self, result, lazy):
+        response = result.statement.execute(result, self.instance)
+
+        if not lazy and isinstance(response.get('data'), statement.Records):
+            response['data'] = response['data'].all()
+
+        return response
 
-    def __setup_no_table(self):
+    def _setup_no_table(self):
         self.execute('DELETE FROM %s' % select.SelectStatement.NO_TABLE)
         self.execute('INSERT INTO %s {}' % select.SelectStatement.NO_TABLE)
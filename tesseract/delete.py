@@ -24,23 +24,34 @@ class DeleteStatement(statement.Statement):
 
         return sql
 
+    def is_parameterized(self):
+        return True
+
     def execute(self, result, tesseract):
         assert isinstance(result.statement, DeleteStatement)
         assert isinstance(tesseract, instance.Instance)
 
         stages = stage.StageManager(tesseract.redis)
         stages.add(DeleteStage, (result.statement.where,))
-        lua = stages.compile_lua(2, result.statement.table_name)
+        lua = self.compile(
+            result,
+            lambda: stages.compile_lua(2, result.statement.table_name)
+        )
 
         return self.run(tesseract.redis, result.statement.table_name, [], lua,
-                        [], result)
+                        result.params, result)
 
 
 class DeleteStage(select.WhereStage):
     """The `DeleteStage` works much like the `WhereStage` except when it comes
     across a matching record (or all records if no `WHERE` clause is provided)
     then the record will be removed.
+
+    The record is only marked as expired so the index entries for it must stay
+    until the vacuum removes the record (other transactions may still see it).
     """
 
+    pipelined = False
+
     def action_on_match(self):
         return self.input_table.lua_delete_record("row[':id']")
@@ -29,8 +29,14 @@ same thing.
 Grouping
 --------
 
-As we iterate the records we maintain a Redis hash called ``group`` which
-contains keys that represent JSON strings and a value of `1`.
+As we iterate the records we maintain a Lua table called ``groups`` which
+contains keys that represent JSON strings and the number of records in the
+group.
+
+All of the grouping and aggregate state is kept in Lua tables that only exist
+while the query is running. Nothing is written to Redis until the final rows
+are produced, so the cost of grouping does not depend on the number of Redis
+commands per record.
 
 Since a query does not need to have a `GROUP BY` clause this effectively means
 that all the rows in the set belong to the same group. So we give this master
@@ -53,9 +59,10 @@ Would be::
     "\"123\""
 
 A query could contain multiple aggregate expressions and we want to keep them
-independent. Our two possible solutions is to maintain a different hash for each
-expression, or use a single hash but have a prefix/suffix to the keys. I chose
-to use the latter separated by a colon. The hash in Redis will look like this:
+independent. Our two possible solutions is to maintain a different table for
+each expression, or use a single table but have a prefix/suffix to the keys. I
+chose to use the latter separated by a colon. The ``agg`` table will look like
+this:
 
 .. _redis-grouping-hash:
 
@@ -67,8 +74,10 @@ Key                     Value
 ``count(*):"\"123\""``  1
 ======================  =====
 
-The value is an integer that is incremented with each unique key. The number
-`123` appears twice.
+The value is the running value of the aggregate (in this case it is incremented
+with each record). The number `123` appears twice.
+
+The groups are returned in the order of their JSON strings.
 
 Lua Processing
 --------------
@@ -76,25 +85,25 @@ Lua Processing
 There are two Lua functions required to produce the final result. Lets take
 ``AVG()`` as an example. The two Lua functions would be::
 
-    function_avg(group, value)
-    function_avg_post(unique_group, group)
+    function_avg(agg, group, value)
+    function_avg_post(agg, groups, unique_group, group)
 
 ``function_avg`` is run with each value as it's encountered. This is an
 opportunity to track values that may be needed for post processing::
 
-    function_avg('count(*)', 123)
-    function_avg('count(*)', true)
-    function_avg('count(*)', "123")
-    function_avg('count(*)', 123)
+    function_avg(agg, 'count(*)', 123)
+    function_avg(agg, 'count(*)', true)
+    function_avg(agg, 'count(*)', "123")
+    function_avg(agg, 'count(*)', 123)
 
 Once the grouping is complete we use a post processing Lua function to calculate
 the final result::
 
-    function_avg_post('agg_key', 'count(*)')
+    function_avg_post(agg, groups, 'true', 'count(*)')
 
-The first argument is the Redis key that contains the
-:ref:`original grouping hash <redis-grouping-hash>` so you can lookup the
-original count if you need to.
+The ``groups`` table contains the
+:ref:`number of records in each group <redis-grouping-hash>` so you can lookup
+the original count if you need to.
 
 Ensure Single Row
 -----------------
@@ -198,20 +207,33 @@ class GroupStage(stage.Stage):
         lua = []
         for col in unique_aggregates.values():
             lua.append("local group = %s" % self.__group_name('unique_group', col))
-            lua.append(col.compile_lua(0)[0])
+            lua.append(col.compile_lua(self.offset)[0])
 
         return '\n'.join(lua)
 
     def __group_records(self):
         """Iterate the table and start grouping.
 
-        As we iterate the records we maintain a Redis hash called `group` which
-        contains keys that represent JSON strings and a value of `1`.
+        As we iterate the records we maintain a Lua table called `groups` which
+        contains keys that represent JSON strings and the number of records in
+        each group. The keys are also added to `group_names` the first time
+        they are seen.
         """
-        self.iterate_page([
+        window_size = stage.StageManager.SCAN_WINDOW_SIZE
+
+        self.lua.extend([
+            "local groups = {}",
+            "local group_names = {}",
+            "local agg = {}",
+            self.input_table.lua_iterate(window_size),
             self.__unique_group_value(),
-            "redis.call('HINCRBY', 'group', unique_group, 1)",
+            "if groups[unique_group] == nil then",
+            "    groups[unique_group] = 0",
+            "    group_names[#group_names + 1] = unique_group",
+            "end",
+            "groups[unique_group] = groups[unique_group] + 1",
             self.__lua_args(),
+            self.input_table.lua_end_iterate(window_size),
         ])
 
     def __ensure_single_row(self):
@@ -219,7 +241,7 @@ class GroupStage(stage.Stage):
         original set did not have any rows.
         """
         self.lua.extend([
-            "if %s == 1 then" % self.output_table.lua_get_next_record_id(),
+            "if #group_names == 0 then",
             "  local row = {}",
         ])
 
@@ -238,36 +260,6 @@ class GroupStage(stage.Stage):
             "end"
         ])
 
-    def iterate_hash_keys(self, page, lua):
-        """Iterate the keys of a hash.
-
-        The keys are not guaranteed to come out in any particular order this
-        method uses `HKEYS` to fetch the keys. For each key there will be
-        several Lua variables exposed:
-
-         * `rowid` - A simple counter (starting at 0) for each key.
-         * `data` - The raw JSON string that is the record.
-
-        Arguments:
-          page (string): The name of the page to iterate.
-          lua (list of str): Lua code to be executed for each page.
-        """
-        assert isinstance(page, str)
-        assert isinstance(lua, list)
-
-        self.lua.extend([
-            "local records = redis.call('HKEYS', '%s')" % page,
-            "local rowid = 0",
-            "for _, data in ipairs(records) do",
-        ])
-
-        self.lua.extend(lua)
-
-        self.lua.extend([
-            "    rowid = rowid + 1",
-            "end"
-        ])
-
     def __extract_expressions(self):
         """Request all the results of the parsed group expressions.
 
@@ -275,33 +267,31 @@ class GroupStage(stage.Stage):
         have been calculating their result along the way. Now we need to fetch
         back those results and put them into a result page.
         """
-        lua = [
+        self.lua.extend([
+            "table.sort(group_names)",
+            "for _, data in ipairs(group_names) do",
             "local row = {}",
             "row['%s'] = cjson.decode(data)" % self.field,
-        ]
+        ])
 
         for col in self.columns:
             if not col.is_aggregate():
                 continue
 
-            key = self.__group_name('tostring(data)', col)
-            line = "row['%s'] = function_%s_post(tostring(data), %s)" % (
+            key = self.__group_name('data', col)
+            line = "row['%s'] = function_%s_post(agg, groups, data, %s)" % (
                 str(col),
                 col.function_name,
                 key
             )
-            lua.append(line)
-
-        lua.append(self.output_table.lua_add_lua_record('row'))
-
-        self.iterate_hash_keys('group', lua)
+            self.lua.append(line)
 
-    def __clear_buffers(self):
-        """Reset (delete) any buffers we will need to carry out this stage."""
-        self.lua.append("redis.call('DEL', 'group')")
+        self.lua.extend([
+            self.output_table.lua_add_lua_record('row'),
+            "end",
+        ])
 
     def compile_lua(self):
-        self.__clear_buffers()
         self.__group_records()
         self.__extract_expressions()
         self.__ensure_single_row()
@@ -59,18 +59,185 @@ number or a non-number then use the appropriate index.
 
 In the case of a number we can use the Redis ZRANGEBYSCORE command, and for
 non-numbers we can use the ZRANGEBYLEX on the non-number index.
+
+Ranges (like ``x > 5`` or ``x BETWEEN 3 AND 7``) work the same way. Numbers are
+a ZRANGEBYSCORE between the bounds. Strings are a ZRANGEBYLEX on the non-number
+index, but because each string is followed by ``:`` and the record ID the order
+of the entries is not exactly the order of the strings (``"a:12"`` is stored
+after ``"a-b:13"`` even though ``"a"`` is less than ``"a-b"``). So a string
+range returns all of the entries that *could* be in the range and the records
+must always be checked against the original expression once they are fetched
+(see `IndexStage`).
 """
 
+import abc
 import json
 import redis
+import threading
 from tesseract import ast
 from tesseract import instance
 from tesseract import protocol
+from tesseract import script
 from tesseract import stage
 from tesseract import statement
 from tesseract import table
 
 
+class IndexCatalog(object):
+    """The IndexCatalog is an in-process copy of the definitions of all of the
+    indexes (the `IndexManager.INDEXES_KEY` hash). The indexes of each table are
+    found without reading the whole hash again.
+
+    Every time an index is created or dropped (including when a table is
+    dropped), or the indexes of a table are deferred or rebuilt, the version in
+    Redis is incremented. The catalog only needs a single GET to check that it
+    is up to date, it is read again when the version has changed. This works
+    for several servers sharing the same Redis.
+
+    Attributes:
+      VERSION_KEY (str): The Redis key of the version.
+    """
+
+    VERSION_KEY = 'indexes:version'
+
+    __instance = None
+
+    def __init__(self):
+        """This is for internal use only. See get_instance()."""
+        self.__lock = threading.Lock()
+        self.__loaded_version = None
+        self.__tables = {}
+        self.__indexes = {}
+        self.__deferred = set()
+
+    @staticmethod
+    def get_instance():
+        """This is the correct way to get the index catalog singleton instance.
+
+        Returns:
+          An IndexCatalog instance.
+        """
+        if not IndexCatalog.__instance:
+            IndexCatalog.__instance = IndexCatalog()
+
+        assert isinstance(IndexCatalog.__instance, IndexCatalog)
+        return IndexCatalog.__instance
+
+    def invalidate(self, redis_connection):
+        """The definitions of the indexes have changed so they must be read
+        again by every server.
+
+        Arguments:
+          redis_connection (redis.StrictRedis): The Redis connection.
+        """
+        assert isinstance(redis_connection, redis.StrictRedis)
+        redis_connection.incr(self.VERSION_KEY)
+
+    def refresh(self, redis_connection):
+        """Make sure the catalog is up to date. When the indexes have been
+        changed (by any server) the cached plans for the tables that have
+        different or newly deferred or rebuilt indexes are removed from the
+        plan cache.
+
+        Arguments:
+          redis_connection (redis.StrictRedis): The Redis connection.
+        """
+        assert isinstance(redis_connection, redis.StrictRedis)
+        self.__load(redis_connection)
+
+    def get_table(self, redis_connection, table_name):
+        """Fetch the indexes for a table.
+
+        Arguments:
+          redis_connection (redis.StrictRedis): The Redis connection.
+          table_name (str): The name of the table.
+
+        Returns:
+          A dictionary where the key is the index name and the value is the
+          field name.
+        """
+        assert isinstance(redis_connection, redis.StrictRedis)
+        assert isinstance(table_name, str)
+
+        tables, _ = self.__load(redis_connection)
+        return dict(tables.get(table_name, {}))
+
+    def get_index(self, redis_connection, index_name):
+        """Fetch the definition of a single index.
+
+        Arguments:
+          redis_connection (redis.StrictRedis): The Redis connection.
+          index_name (str): The name of the index.
+
+        Returns:
+          A tuple of the table name and field name, or None if the index does
+          not exist.
+        """
+        assert isinstance(redis_connection, redis.StrictRedis)
+        assert isinstance(index_name, str)
+
+        _, indexes = self.__load(redis_connection)
+        return indexes.get(index_name)
+
+    def __load(self, redis_connection):
+        """Read the definitions from Redis if they have changed since they were
+        last read.
+
+        Returns:
+          A tuple of the indexes by table and the indexes by name.
+        """
+        version = int(redis_connection.get(self.VERSION_KEY) or 0)
+        with self.__lock:
+            if self.__loaded_version == version:
+                return self.__tables, self.__indexes
+
+        # The version and the definitions are read together so they are always
+        # for the same version.
+        pipe = redis_connection.pipeline()
+        pipe.get(self.VERSION_KEY)
+        pipe.hgetall(IndexManager.INDEXES_KEY)
+        pipe.hkeys(IndexManager.DEFERRED_KEY)
+        version, definitions, deferred = pipe.execute()
+        version = int(version or 0)
+        deferred = set(str(table_name.decode()) for table_name in deferred)
+
+        tables = {}
+        indexes = {}
+        for index_name, definition in definitions.items():
+            index_name = str(index_name.decode())
+            table_name, field = str(definition.decode()).split('.', 1)
+            tables.setdefault(table_name, {})[index_name] = field
+            indexes[index_name] = (table_name, field)
+
+        with self.__lock:
+            loaded_version = self.__loaded_version
+            old_tables = self.__tables
+            old_deferred = self.__deferred
+            if loaded_version is None or version > loaded_version:
+                self.__tables = tables
+                self.__indexes = indexes
+                self.__deferred = deferred
+                self.__loaded_version = version
+
+        # Nothing could have been planned before the catalog was first read.
+        if loaded_version is not None:
+            self.__invalidate_plans(old_tables, tables)
+            for table_name in old_deferred ^ deferred:
+                self.__invalidate_table_plans(table_name)
+
+        return tables, indexes
+
+    def __invalidate_plans(self, old_tables, new_tables):
+        """Remove the cached plans for the tables that have different indexes."""
+        for table_name in set(old_tables) | set(new_tables):
+            if old_tables.get(table_name) != new_tables.get(table_name):
+                self.__invalidate_table_plans(table_name)
+
+    def __invalidate_table_plans(self, table_name):
+        from tesseract import plan
+        plan.PlanCache.get_instance().invalidate(table_name)
+
+
 class IndexManager(object):
     """The IndexManager handles the creation, deletion and fetching of indexes
     for tables.
@@ -79,8 +246,28 @@ class IndexManager(object):
       _redis (StrictRedis): This is the Redis connection.
       INDEXES_KEY (str): The Redis key that contains all the information about
         all indexes.
+      DEFERRED_KEY (str): The Redis hash of the tables that have their index
+        maintenance deferred (see `defer_indexes()`). The value is incremented
+        each time the indexes are deferred.
+      BUILD_BATCH_SIZE (int): The number of records that are read (and
+        written to each index) at a time when an index is built.
     """
     INDEXES_KEY = 'indexes'
+    DEFERRED_KEY = 'indexes:deferred'
+    BUILD_BATCH_SIZE = 1000
+
+    # Clear the deferral once the indexes have been rebuilt. This is only safe
+    # if no records were added after the last one that was indexed and nobody
+    # has deferred the indexes again since the rebuild started.
+    LUA_FINISH_REBUILD = """
+if redis.call('ZCOUNT', ARGV[1], '(' .. ARGV[2], '+inf') > 0 then
+    return 0
+end
+if redis.call('HGET', ARGV[3], ARGV[4]) == ARGV[5] then
+    redis.call('HDEL', ARGV[3], ARGV[4])
+end
+return 1
+"""
 
     @staticmethod
     def get_instance(redis_connection):
@@ -120,20 +307,31 @@ class IndexManager(object):
         """
         assert isinstance(table_name, str)
 
-        found_indexes = {}
-        for index_name in self._redis.hkeys(self.INDEXES_KEY):
-            field = str(self._redis.hget(self.INDEXES_KEY, index_name).decode())
-            if field.startswith('%s.' % table_name):
-                safe_index_name = str(index_name.decode())
-                parts = field.split('.')
-                found_indexes[safe_index_name] = Index(
-                    self._redis,
-                    table_name,
-                    safe_index_name,
-                    parts[1]
-                )
-
-        return found_indexes
+        catalog = IndexCatalog.get_instance()
+        fields = catalog.get_table(self._redis, table_name)
+
+        return dict(
+            (index_name, Index(self._redis, table_name, index_name, field))
+            for index_name, field in fields.items()
+        )
+
+    def get_usable_indexes_for_table(self, table_name):
+        """Fetch the indexes that can be used to find records. This is the
+        same as `get_indexes_for_table()` except that there are no usable
+        indexes while the indexes for the table are deferred.
+
+        Arguments:
+          table_name (str): The name of the table.
+
+        Returns:
+          An dictionary of Index objects where the key is the name of the index.
+        """
+        assert isinstance(table_name, str)
+
+        if self.is_deferred(table_name):
+            return {}
+
+        return self.get_indexes_for_table(table_name)
 
     def get_index(self, index_name):
         """Fetch a single index by name.
@@ -146,12 +344,139 @@ class IndexManager(object):
         """
         assert isinstance(index_name, str)
 
-        index = self._redis.hget(self.INDEXES_KEY, index_name)
-        if not index:
+        definition = IndexCatalog.get_instance().get_index(self._redis,
+                                                           index_name)
+        if definition is None:
             return False
 
-        parts = str(index.decode()).split('.')
-        return Index(self._redis, parts[0], index_name, parts[1])
+        table_name, field = definition
+        return Index(self._redis, table_name, index_name, field)
+
+    def lua_add_record(self, table_name, lua_row):
+        """Generate the Lua to add a record to all of the indexes for a table.
+
+        Arguments:
+          table_name (str): The name of the table.
+          lua_row (str): The Lua variable that holds the record (see
+            `Index.lua_add_record()`).
+
+        Returns:
+          A list of Lua lines. It is empty if the table has no indexes.
+        """
+        assert isinstance(table_name, str)
+        assert isinstance(lua_row, str)
+
+        indexes = self.get_indexes_for_table(table_name)
+        if not indexes:
+            return []
+
+        # The indexes are checked each time the Lua runs because they may be
+        # deferred after it was compiled.
+        lua = ["if not (%s) then" % self.lua_is_deferred(table_name)]
+        lua.extend(indexes[index_name].lua_add_record(lua_row)
+                   for index_name in sorted(indexes))
+        lua.append("end")
+
+        return lua
+
+    def is_deferred(self, table_name):
+        """Check if the index maintenance for a table is deferred.
+
+        Arguments:
+          table_name (str): The name of the table.
+
+        Returns:
+          bool
+        """
+        assert isinstance(table_name, str)
+        return self._redis.hexists(self.DEFERRED_KEY, table_name)
+
+    def lua_is_deferred(self, table_name):
+        """The same as `is_deferred()` but as a Lua expression.
+
+        Arguments:
+          table_name (str): The name of the table.
+
+        Returns:
+          str Lua code.
+        """
+        assert isinstance(table_name, str)
+        return "redis.call('HEXISTS', '%s', '%s') == 1" % (
+            self.DEFERRED_KEY,
+            table_name
+        )
+
+    def defer_indexes(self, table_name):
+        """Stop maintaining the indexes of a table. Records that are inserted or
+        updated are not added to the indexes and the query planner will not use
+        the indexes until they are rebuilt with `rebuild_indexes()`.
+
+        Arguments:
+          table_name (str): The name of the table.
+
+        Returns:
+          A token (int) that changes every time the indexes are deferred.
+        """
+        assert isinstance(table_name, str)
+
+        token = self._redis.hincrby(self.DEFERRED_KEY, table_name, 1)
+
+        # Only the first time, otherwise every bulk load would throw away the
+        # plans (of every server).
+        if token == 1:
+            IndexCatalog.get_instance().invalidate(self._redis)
+            self.__invalidate_plans(table_name)
+
+        return token
+
+    def rebuild_indexes(self, table_name):
+        """Rebuild all of the indexes for a table from scratch. The indexes are
+        deferred while they are rebuilt and are usable again once this returns.
+
+        Arguments:
+          table_name (str): The name of the table.
+        """
+        assert isinstance(table_name, str)
+
+        token = self.defer_indexes(table_name)
+        indexes = self.get_indexes_for_table(table_name)
+        indexes = [indexes[index_name] for index_name in sorted(indexes)]
+        for index in indexes:
+            index._drop()
+
+        the_table = table.PermanentTable(self._redis, table_name)
+        scripts = script.ScriptManager.get_instance(self._redis)
+        last_id = 0
+
+        # Records may be added while the indexes are being built so keep going
+        # until the last record has been indexed.
+        while True:
+            last_id = self.__build_indexes(table_name, indexes, last_id)
+            finished = scripts.evaluate(self.LUA_FINISH_REBUILD,
+                                        the_table.redis_key(), last_id,
+                                        self.DEFERRED_KEY, table_name, token)
+            if finished:
+                break
+
+        IndexCatalog.get_instance().invalidate(self._redis)
+        self.__invalidate_plans(table_name)
+
+    def remove_records(self, table_name, records):
+        """Remove records from all of the indexes for a table. This is used
+        when the records are permanently removed from the table (see
+        `vacuum`).
+
+        Arguments:
+          table_name (str): The name of the table.
+          records (list of dict): The records. Each must have its ':id'.
+        """
+        assert isinstance(table_name, str)
+        assert isinstance(records, list)
+
+        for index in self.get_indexes_for_table(table_name).values():
+            for record in records:
+                value = self.__indexed_value(record, index.field_name)
+                index.remove_record(value, record[':id'])
 
     def create_index(self, index_name, table_name, field):
         """Create an index on a table.
@@ -175,6 +500,7 @@ class IndexManager(object):
 
         index = self.__build_index(field, index_name, table_name)
         self.__register_index(field, index_name, table_name)
+        self.__invalidate_plans(table_name)
 
         return index
 
@@ -194,38 +520,97 @@ class IndexManager(object):
             index._drop()
 
         result = self._redis.hdel(self.INDEXES_KEY, index_name)
+        IndexCatalog.get_instance().invalidate(self._redis)
+
+        if index:
+            self.__invalidate_plans(index.table_name)
+
         return result == '1'
 
+    def drop_indexes_for_table(self, table_name):
+        """Drop all of the indexes for a table. This is used when the table is
+        dropped.
+
+        Arguments:
+          table_name (str): The name of the table.
+        """
+        assert isinstance(table_name, str)
+
+        indexes = self.get_indexes_for_table(table_name)
+        for index in indexes.values():
+            index._drop()
+
+        if indexes:
+            self._redis.hdel(self.INDEXES_KEY, *indexes.keys())
+            IndexCatalog.get_instance().invalidate(self._redis)
+
+        # A new table with the same name starts with its indexes maintained.
+        self._redis.hdel(self.DEFERRED_KEY, table_name)
+        self.__invalidate_plans(table_name)
+
+    def __invalidate_plans(self, table_name):
+        """Cached plans for the table may be using (or not using) an index that
+        has changed."""
+        from tesseract import plan
+        plan.PlanCache.get_instance().invalidate(table_name)
+
     def __register_index(self, field, index_name, table_name):
         """Make the index visible to the query planner."""
         value = '%s.%s' % (table_name, field)
         self._redis.hset(self.INDEXES_KEY, index_name, value)
+        IndexCatalog.get_instance().invalidate(self._redis)
 
     def __build_index(self, field, index_name, table_name):
         """Build the index now. This may take some time if there are a lot of
         values to index.
         """
         index = Index(self._redis, table_name, index_name, field)
+        self.__build_indexes(table_name, [index], 0)
+
+        return index
+
+    def __build_indexes(self, table_name, indexes, last_id):
+        """Add the records of a table to indexes. The table is read once in
+        batches and each batch is written to each index with a single ZADD.
+
+        Arguments:
+          table_name (str): The name of the table.
+          indexes (list of Index): The indexes to build.
+          last_id (int): Only records after this record ID are indexed.
+
+        Returns:
+          The ID of the last record that was indexed, or `last_id` if there
+          were no more records.
+        """
         the_table = table.PermanentTable(self._redis, table_name)
 
-        for data in self._redis.zrange(the_table.redis_key(), 0, -1):
-            self.__index_value(data, field, index)
+        while True:
+            batch = self._redis.zrangebyscore(the_table.redis_key(),
+                                              '(%s' % last_id, '+inf', 0,
+                                              self.BUILD_BATCH_SIZE)
+            if not batch:
+                return last_id
 
-        return index
+            rows = [json.loads(data.decode()) for data in batch]
+            for index in indexes:
+                index.add_records([
+                    (self.__indexed_value(row, index.field_name), row[':id'])
+                    for row in rows
+                ])
 
-    def __index_value(self, data, field, index):
-        row = json.loads(data.decode())
+            last_id = rows[-1][':id']
 
-        try:
-            row[field]
-        except KeyError:
-            # Missing values are to be treated as null.
-            row[field] = None
+    def __indexed_value(self, row, field):
+        """The value of a field as it is stored in an index."""
+        # Missing values are to be treated as null.
+        value = row.get(field)
 
-        if row[field] is None or isinstance(row[field], (int, float, bool)):
-            index.add_record(row[field], row[':id'])
-        else:
-            index.add_record(str(row[field]), row[':id'])
+        if value is None or isinstance(value, (int, float, bool, str)):
+            return value
+
+        # Arrays and objects are encoded the same way as the Lua does (see
+        # `Index.lua_add_record()`).
+        return json.dumps(value, separators=(',', ':'))
 
 
 class Index(object):
@@ -285,11 +670,127 @@ class Index(object):
         else:
             self.__add_nonnumber_value(value, record_id)
 
-    def lua_lookup_exact(self, value):
+    def add_records(self, records):
+        """Add many records to the index. This does the same as `add_record()`
+        for each record but there is only one ZADD for the numbers and one for
+        the non-numbers. The entries are sorted first so Redis inserts them in
+        order.
+
+        Arguments:
+          records (list of tuple): Each item is the value to be indexed and
+            the record ID.
+        """
+        assert isinstance(records, list)
+
+        numbers = []
+        nonnumbers = []
+        for value, record_id in records:
+            assert value is None or isinstance(value, (int, float, bool, str))
+            assert isinstance(record_id, int)
+
+            if self.__is_number(value):
+                numbers.append((value, record_id))
+            else:
+                nonnumbers.append(self.__nonnumber_entry(value, record_id))
+
+        if numbers:
+            args = []
+            for value, record_id in sorted(numbers):
+                args.extend((value, record_id))
+            self._redis.zadd(self.__number_index_key(), *args)
+
+        if nonnumbers:
+            args = []
+            for entry in sorted(nonnumbers):
+                args.extend((0, entry))
+            self._redis.zadd(self.__nonnumber_index_key(), *args)
+
+    def remove_record(self, value, record_id):
+        """Remove a record from the index. This is the opposite of
+        `add_record()`.
+
+        Arguments:
+          value (None, int, float, bool or str): The value that was indexed.
+          record_id (int): The record ID from the original record.
+        """
+        assert value is None or isinstance(value, (int, float, bool, str))
+        assert isinstance(record_id, int)
+
+        if self.__is_number(value):
+            self._redis.zrem(self.__number_index_key(), record_id)
+        else:
+            self._redis.zrem(self.__nonnumber_index_key(),
+                             self.__nonnumber_entry(value, record_id))
+
+    def lua_add_record(self, lua_row):
+        """Generate the Lua to add a record to the index. This does the same as
+        `add_record()` but for a record that only exists in Lua.
+
+        Arguments:
+          lua_row (str): The Lua variable that holds the record. It must have
+            its ':id'.
+
+        Returns:
+          str Lua code.
+        """
+        assert isinstance(lua_row, str)
+
+        return "index_add_value('%s', '%s', %s['%s'], %s[':id'])" % (
+            self.__number_index_key(),
+            self.__nonnumber_index_key(),
+            lua_row,
+            self.field_name,
+            lua_row,
+        )
+
+    def lua_batch_add(self, lua_batch, lua_row):
+        """Generate the Lua to add a record to a batch of index entries. The
+        batch must be written with `lua_batch_flush()`. This is much faster
+        than `lua_add_record()` when adding a lot of records.
+
+        Arguments:
+          lua_batch (str): The Lua variable of the batch. It must be created
+            with `{ numbers = {}, nonnumbers = {} }`.
+          lua_row (str): The Lua variable that holds the record. It must have
+            its ':id'.
+
+        Returns:
+          str Lua code.
+        """
+        assert isinstance(lua_batch, str)
+        assert isinstance(lua_row, str)
+
+        return "index_batch_add(%s, %s['%s'], %s[':id'])" % (
+            lua_batch,
+            lua_row,
+            self.field_name,
+            lua_row,
+        )
+
+    def lua_batch_flush(self, lua_batch):
+        """Generate the Lua to write (and empty) a batch of index entries. See
+        `lua_batch_add()`.
+
+        Returns:
+          str Lua code.
+        """
+        assert isinstance(lua_batch, str)
+
+        return "index_batch_flush(%s, '%s', '%s')" % (
+            lua_batch,
+            self.__number_index_key(),
+            self.__nonnumber_index_key(),
+        )
+
+    def lua_lookup_exact(self, value, lua_value=None):
         """Generate the Lua code to lookup record based on an exact value.
 
         Arguments:
           value (int, float, bool or str): The value to lookup.
+          lua_value (str): A Lua expression that provides the value when the
+            program is run (like a parameter). The `value` is still needed to
+            know which index to use. If this is not provided the `value` is
+            compiled into the Lua.
 
         Returns:
           Lua code that should be assigned to a variable and iterated like:
@@ -298,11 +799,58 @@ class Index(object):
           >>> lua = "local records = %s" % index.lua_lookup_exact()
         """
         assert value is None or isinstance(value, (int, float, bool, str))
+        assert lua_value is None or isinstance(lua_value, str)
 
         if self.__is_number(value):
-            return self.__lua_lookup_number_exact(value)
+            return self.__lua_lookup_number_exact(value, lua_value)
+
+        return self.__lua_lookup_nonnumber_exact(value, lua_value)
+
+    def lua_lookup_range(self, lower=None, upper=None):
+        """Generate the Lua code to lookup records with a value between two
+        bounds. The bounds must both be numbers or both be strings.
+
+        The lookup for strings may find records that are not in the range (see
+        the module documentation) so the values must be checked again.
 
-        return self.__lua_lookup_nonnumber_exact(value)
+        Arguments:
+          lower (tuple): The value, the value as a Lua expression and True if
+            the value itself is included. None means there is no lower bound.
+          upper (tuple): The same as `lower` but for the upper bound.
+
+        Returns:
+          Lua code that evaluates to a table of index entries, the same as
+          `lua_lookup_exact()`.
+        """
+        assert lower is not None or upper is not None
+        values = [bound[0] for bound in (lower, upper) if bound is not None]
+
+        if all(self.__is_number(value) for value in values):
+            return "redis.call('ZRANGEBYSCORE', '%s', %s, %s)" % (
+                self.__number_index_key(),
+                self.__lua_score_bound(lower, '-inf'),
+                self.__lua_score_bound(upper, '+inf'),
+            )
+
+        assert all(isinstance(value, str) for value in values)
+
+        return "index_string_range('%s', %s, %s)" % (
+            self.__nonnumber_index_key(),
+            lower[1] if lower else 'nil',
+            upper[1] if upper else 'nil',
+        )
+
+    def __lua_score_bound(self, bound, unbounded):
+        """Render one bound of a ZRANGEBYSCORE."""
+        if bound is None:
+            return "'%s'" % unbounded
+
+        value, lua_value, inclusive = bound
+        if inclusive:
+            return lua_value
+
+        # Concatenating a number would only keep 14 significant digits.
+        return "'(' .. string.format('%%.17g', %s)" % lua_value
 
     def _drop(self):
         """This is an internal method and should never be called.
@@ -323,23 +871,34 @@ class Index(object):
         """
         return isinstance(value, (int, float)) and not isinstance(value, bool)
 
-    def __lua_lookup_number_exact(self, value):
+    def __lua_lookup_number_exact(self, value, lua_value):
         assert isinstance(value, (int, float))
-        return "redis.call('ZRANGEBYSCORE', '%s', '%s', '%s')" % (
+        if lua_value is None:
+            lua_value = "'%s'" % value
+
+        return "redis.call('ZRANGEBYSCORE', '%s', %s, %s)" % (
             self.__number_index_key(),
-            value,
-            value,
+            lua_value,
+            lua_value,
         )
 
-    def __lua_lookup_nonnumber_exact(self, value):
+    def __lua_lookup_nonnumber_exact(self, value, lua_value):
         type = self.__get_type_character(value)
-        if type == self.TYPE_STRING:
-            type += value
+        if type != self.TYPE_STRING:
+            lua_value = None
+
+        prefix = "'[%s" % type
+        if lua_value is None:
+            if type == self.TYPE_STRING:
+                prefix += value
+            prefix += "'"
+        else:
+            prefix += "' .. %s" % lua_value
 
-        return "redis.call('ZRANGEBYLEX', '%s', '[%s:', '[%s:Z')" % (
+        return "redis.call('ZRANGEBYLEX', '%s', %s .. ':', %s .. ':Z')" % (
             self.__nonnumber_index_key(),
-            type,
-            type,
+            prefix,
+            prefix,
         )
 
     def __add_number_value(self, value, record_id):
@@ -354,13 +913,16 @@ class Index(object):
         of crazy things. Fortunately the score is no use to use as we get the
         record ID from the value.
         """
+        self._redis.zadd(self.__nonnumber_index_key(), 0,
+                         self.__nonnumber_entry(value, record_id))
+
+    def __nonnumber_entry(self, value, record_id):
+        """The member of the nonnumber index for a value."""
         type = self.__get_type_character(value)
         if isinstance(value, str):
-            redis_value = '%s%s:%s' % (type, value, record_id)
-        else:
-            redis_value = '%s:%s' % (type, record_id)
+            return '%s%s:%s' % (type, value, record_id)
 
-        self._redis.zadd(self.__nonnumber_index_key(), 0, redis_value)
+        return '%s:%s' % (type, record_id)
 
     def __number_index_key(self):
         """This is the redis key that contains the sorted set of numbers for the
@@ -446,42 +1008,282 @@ class DropIndexStatement(statement.Statement):
         manager.drop_index(str(result.statement.index_name))
         return protocol.Protocol.successful_response()
 
-class IndexStage(stage.Stage):
-    def __init__(self, input_table, offset, redis, index_name, value):
-        stage.Stage.__init__(self, input_table, offset, redis)
+class ReindexStatement(statement.Statement):
+    """`REINDEX TABLE` statement."""
+
+    def __init__(self, table_name):
+        assert isinstance(table_name, ast.Identifier)
+        self.table_name = table_name
+
+    def __str__(self):
+        return "REINDEX TABLE %s" % self.table_name
+
+    def execute(self, result, tesseract):
+        assert isinstance(result.statement, ReindexStatement)
+        assert isinstance(tesseract, instance.Instance)
+
+        manager = IndexManager(tesseract.redis)
+        manager.rebuild_indexes(str(result.statement.table_name))
+        return protocol.Protocol.successful_response()
+
+class IndexLookup(object):
+    """An IndexLookup describes how indexes are used to find the records for
+    (part of) a `WHERE` clause.
+
+    Attributes:
+      expression (Expression): The expression the records must match. The
+        indexes may find more records than match the expression so it is also
+        checked against every record.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, expression):
+        assert isinstance(expression, ast.Expression)
+        self.expression = expression
+
+    @abc.abstractmethod
+    def explain(self):
+        """Describe the lookup for `EXPLAIN`.
+
+        Returns:
+          str
+        """
+        pass
+
+    @abc.abstractmethod
+    def rank(self):
+        """A guess of how many records the lookup will find compared to other
+        lookups. There are no statistics about the values in an index so this
+        only depends on the kind of lookup.
+
+        Returns:
+          A tuple. Lookups with a lower rank are expected to find fewer
+          records.
+        """
+        pass
+
+    @abc.abstractmethod
+    def lua_record_ids(self, redis_connection, offset, ids, seen):
+        """Generate the Lua that finds the record IDs.
+
+        Arguments:
+          redis_connection (redis.StrictRedis): The Redis connection.
+          offset (int): The offset for the parameters.
+          ids (str): The Lua variable of the list to append the record IDs to.
+          seen (str): The Lua variable of the table that has a `true` for every
+            record ID in `ids`.
+
+        Returns:
+          A list of Lua lines.
+        """
+        pass
+
+
+class SingleIndexLookup(IndexLookup):
+    """A lookup that only uses one index.
+
+    Attributes:
+      index_name (str): The name of the index to use.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, index_name, expression):
+        IndexLookup.__init__(self, expression)
         assert isinstance(index_name, str)
-        assert isinstance(value, ast.Value)
 
         self.index_name = index_name
-        self.value = value
+
+    @abc.abstractmethod
+    def lua_lookup(self, index, offset):
+        """Generate the Lua to fetch the index entries.
+
+        Arguments:
+          index (Index): The index named by `index_name`.
+          offset (int): The offset for the parameters.
+
+        Returns:
+          A list of Lua expressions that each evaluate to a table of index
+          entries.
+        """
+        pass
+
+    def lua_record_ids(self, redis_connection, offset, ids, seen):
+        index = IndexManager(redis_connection).get_index(self.index_name)
+
+        # The same record may be found more than once.
+        return ["index_record_ids(%s, %s, %s)" % (lookup, ids, seen)
+                for lookup in self.lua_lookup(index, offset)]
+
+
+class ExactLookup(SingleIndexLookup):
+    """Find records that have exactly one of the values. When there is more
+    than one value (like for `IN`) each value is looked up separately and the
+    records found are combined.
+
+    Attributes:
+      values (list of Value): The values to find.
+    """
+
+    def __init__(self, index_name, expression, values):
+        SingleIndexLookup.__init__(self, index_name, expression)
+        assert isinstance(values, list) and len(values) > 0
+        for value in values:
+            assert isinstance(value, ast.Value)
+
+        self.values = values
 
     def explain(self):
-        if self.value.value is None:
+        if len(self.values) > 1:
+            description = 'values %s' % \
+                          ', '.join(str(value) for value in self.values)
+        elif self.values[0].value is None:
             description = 'null'
         else:
-            description = 'value %s' % self.value
+            description = 'value %s' % self.values[0]
+
+        return "Index lookup using %s for %s" % (self.index_name, description)
+
+    def rank(self):
+        return (0, len(self.values))
+
+    def lua_lookup(self, index, offset):
+        return [index.lua_lookup_exact(value.value,
+                                       value.compile_lua(offset)[0])
+                for value in self.values]
+
+
+class RangeLookup(SingleIndexLookup):
+    """Find records that have a value between two bounds.
+
+    Attributes:
+      lower (tuple): The lower bound as a Value and True if the bound is
+        included in the range, or None for no lower bound.
+      upper (tuple): The upper bound the same as `lower`.
+    """
+
+    def __init__(self, index_name, expression, lower=None, upper=None):
+        SingleIndexLookup.__init__(self, index_name, expression)
+        assert lower is not None or upper is not None
+        self.lower = lower
+        self.upper = upper
+
+    def explain(self):
+        return "Index range scan using %s for %s" % (
+            self.index_name,
+            self.expression
+        )
+
+    def rank(self):
+        # A range with both bounds is usually smaller than one that is open on
+        # one side.
+        if self.lower is not None and self.upper is not None:
+            return (1, 0)
+
+        return (1, 1)
+
+    def __lua_bound(self, bound, offset):
+        if bound is None:
+            return None
+
+        value, inclusive = bound
+        return (value.value, value.compile_lua(offset)[0], inclusive)
+
+    def lua_lookup(self, index, offset):
+        return [index.lua_lookup_range(
+            self.__lua_bound(self.lower, offset),
+            self.__lua_bound(self.upper, offset)
+        )]
 
+
+class IntersectLookup(IndexLookup):
+    """Find the records that are found by every one of several lookups (each
+    using a different index). This is used for conditions joined with `AND`,
+    like `a = 1 AND b = 2`, when both fields have an index.
+
+    Attributes:
+      lookups (list of IndexLookup): The lookups to intersect.
+    """
+
+    def __init__(self, lookups):
+        assert isinstance(lookups, list) and len(lookups) > 1
+        for lookup in lookups:
+            assert isinstance(lookup, IndexLookup)
+
+        expression = lookups[0].expression
+        for lookup in lookups[1:]:
+            expression = ast.AndExpression(expression, lookup.expression)
+
+        IndexLookup.__init__(self, expression)
+        self.lookups = lookups
+
+    def explain(self):
+        return "Index intersection: %s" % \
+               '; '.join(lookup.explain() for lookup in self.lookups)
+
+    def rank(self):
+        return min(lookup.rank() for lookup in self.lookups)
+
+    def lua_record_ids(self, redis_connection, offset, ids, seen):
+        lua = self.lookups[0].lua_record_ids(redis_connection, offset, ids,
+                                             seen)
+
+        # There is no need to look any further once nothing is left.
+        for lookup in self.lookups[1:]:
+            lua.append("if #%s > 0 then" % ids)
+            lua.append("local other_ids, other_seen = {}, {}")
+            lua.extend(lookup.lua_record_ids(redis_connection, offset,
+                                             'other_ids', 'other_seen'))
+            lua.append("%s, %s = index_intersect_ids(%s, other_seen)" % (
+                ids, seen, ids
+            ))
+            lua.append("end")
+
+        return lua
+
+
+class IndexStage(stage.PipelinedStage):
+    """Read the records found by an index (see `IndexLookup`) instead of
+    scanning the whole table. Like `table.FullTableScan` only the visible
+    records are produced.
+    """
+
+    def __init__(self, input_table, offset, redis, lookup):
+        stage.Stage.__init__(self, input_table, offset, redis)
+        assert isinstance(lookup, IndexLookup)
+
+        self.lookup = lookup
+
+    def explain(self):
         return {
-            "description": "Index lookup using %s for %s" % (
-                self.index_name,
-                description
-            )
+            "description": self.lookup.explain()
         }
 
-    def compile_lua(self):
-        lua = []
-        output_table = table.TransientTable(self.redis)
-        index_manager = IndexManager(self.redis)
-        index = index_manager.get_index(self.index_name)
-        the_table = table.PermanentTable(self.redis, index.table_name)
+    def lua_pipeline_source(self):
+        lua = ["local index_ids, index_seen = {}, {}"]
+        lua.extend(self.lookup.lua_record_ids(self.redis, self.offset,
+                                              'index_ids', 'index_seen'))
 
         lua.extend([
-            "local records = %s" % index.lua_lookup_exact(self.value.value),
-            "for _, data in ipairs(records) do",
-            the_table.lua_get_lua_record('data'),
-            "local row = cjson.decode(irecords[1])",
-            output_table.lua_add_lua_record('row'),
-            "end",
+            "local scan_complete = false",
+            "for _, id in ipairs(index_ids) do",
+            "local records = redis.call('ZRANGEBYSCORE', %s, id, id)" %
+            self.input_table.lua_redis_key(),
+
+            # The index may still contain records that have been removed from
+            # the table.
+            "if records[1] ~= nil then",
+            "local row = cjson.decode(records[1])",
         ])
 
-        return (output_table, '\n'.join(lua), self.offset)
+        return (lua, ["end", "end"])
+
+    def compile_pipelined_lua(self):
+        where = self.lookup.expression.compile_lua(self.offset)[0]
+        before = [
+            "if row_is_visible(row, xid, xids) then",
+            "row[':xid'] = nil",
+            "row[':xex'] = nil",
+            "if %s then" % where,
+        ]
+
+        return (before, ["end", "end"], self.offset)
@@ -1,4 +1,5 @@
 import json
+import redis
 from tesseract import ast
 from tesseract import protocol
 from tesseract import index
@@ -9,55 +10,207 @@ from tesseract import transaction
 
 
 class InsertStatement(statement.Statement):
-    """`INSERT` statement."""
-
-    def __init__(self, table_name, fields):
+    """`INSERT` statement. This can insert a single record or an array of
+    records.
+
+    Attributes:
+      BATCH_SIZE (int): The maximum number of records (and index entries) that
+        are written with a single ZADD.
+      table_name (Identifier): The table to insert into.
+      fields (dict or list): The fields of the record, or a list of the fields
+        for each record when an array is inserted.
+      defer_indexes (bool): Stop maintaining the indexes of the table until
+        they are rebuilt with `REINDEX TABLE` (see
+        `index.IndexManager.defer_indexes()`).
+    """
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, table_name, fields, defer_indexes=False):
         assert isinstance(table_name, ast.Identifier)
-        assert isinstance(fields, dict)
+        assert isinstance(fields, (dict, list))
+        assert isinstance(defer_indexes, bool)
 
         self.table_name = table_name
         self.fields = fields
+        self.defer_indexes = defer_indexes
 
     def __str__(self):
-        return "INSERT INTO %s %s" % (
-            self.table_name,
-            ast.Expression.to_sql(self.fields)
-        )
+        if isinstance(self.fields, list):
+            values = '[%s]' % ', '.join(ast.Expression.to_sql(fields)
+                                        for fields in self.fields)
+        else:
+            values = ast.Expression.to_sql(self.fields)
+
+        sql = "INSERT INTO %s %s" % (self.table_name, values)
+        if self.defer_indexes:
+            sql += " DEFER INDEXES"
+
+        return sql
+
+    def is_cacheable(self):
+        """The fingerprint of an array changes with the number of records (and
+        the types of their values) so the plan for a bulk load would almost
+        never be used again, it would only fill the cache with large
+        statements.
+        """
+        return not isinstance(self.fields, list)
+
+    def records(self):
+        """The fields of each of the records to insert.
+
+        Returns:
+          A list of dict.
+        """
+        if isinstance(self.fields, list):
+            return self.fields
+
+        return [self.fields]
+
+    def is_parameterized(self):
+        """The record is built by binding the parameters to the values (see
+        `ast.Value.bind()`), this requires all of the fields to be values."""
+        for fields in self.records():
+            for value in fields.values():
+                if not isinstance(value, ast.Value):
+                    return False
+
+        return True
 
     def execute(self, result, tesseract):
         assert isinstance(tesseract, instance.Instance)
 
-        output_table = table.PermanentTable(tesseract.redis, str(result.statement.table_name))
-        data = ast.Expression.to_sql(result.statement.fields)
-
-        record_id = output_table.add_record(json.loads(data))
+        # This checks every record so it must only be done once.
+        is_parameterized = self.is_parameterized()
+
+        records = []
+        for fields in result.statement.records():
+            if is_parameterized:
+                records.append(dict((key, value.bind(result.params))
+                                    for key, value in fields.items()))
+            else:
+                records.append(json.loads(ast.Expression.to_sql(fields)))
+
+        # The fields are sent without the surrounding braces so that the Lua
+        # can add the record ID (see compile_lua()).
+        args = [json.dumps(record, separators=(',', ':'))[1:-1]
+                for record in records]
+
+        # The indexes must be deferred before the records are added, the Lua
+        # checks if they are deferred when it runs.
+        if result.statement.defer_indexes:
+            manager = index.IndexManager.get_instance(tesseract.redis)
+            manager.defer_indexes(str(result.statement.table_name))
+
+        lua = self.compile(result, lambda: self.compile_lua(tesseract.redis))
+        try:
+            first_id = self.evaluate(tesseract.redis,
+                                     result.statement.table_name, lua, args)
+        except Exception as e:
+            return self._lua_error(e)
 
         manager = transaction.TransactionManager.get_instance(tesseract.redis)
-        if manager.in_transaction():
+        if manager.in_transaction() and records:
+            output_table = table.PermanentTable(
+                tesseract.redis,
+                str(result.statement.table_name)
+            )
             rollback_action = "ZREMRANGEBYSCORE %s %s %s" % (
                 output_table.redis_key(),
-                record_id,
-                record_id,
+                first_id,
+                first_id + len(records) - 1,
             )
             manager.record(rollback_action)
 
-        manager = index.IndexManager.get_instance(tesseract.redis)
-        indexes = manager.get_indexes_for_table(
-            str(result.statement.table_name)
-        )
-        for i in indexes.values():
-            i.add_record(result.statement.fields[i.field_name].value, record_id)
-
-        self.__publish_notifications(
-            tesseract.redis,
-            tesseract.notifications,
-            tesseract.publish,
-            data,
-            result
-        )
+        for record in records:
+            self.__publish_notifications(
+                tesseract.redis,
+                tesseract.notifications,
+                tesseract.publish,
+                json.dumps(record),
+                result
+            )
 
         return protocol.Protocol.successful_response()
 
+    def compile_lua(self, redis_connection):
+        """Compile the Lua program that inserts the records. The record IDs are
+        reserved all at once, then the records are written and added to every
+        index of the table in batches of `BATCH_SIZE`. This is all done in a
+        single round trip. Nothing is added to the indexes while they are
+        deferred.
+
+        Each record is passed in (from the third argument) as its JSON fields
+        without the surrounding braces. The JSON is not decoded and encoded
+        again by the Lua so the values are stored exactly as they were
+        provided.
+
+        Arguments:
+          redis_connection (redis.StrictRedis): The Redis connection.
+
+        Returns:
+          str Lua code. The program returns the ID of the first record, the
+          rest of the records have the IDs that follow it.
+        """
+        assert isinstance(redis_connection, redis.StrictRedis)
+
+        table_name = str(self.table_name)
+        output_table = table.PermanentTable(redis_connection, table_name)
+        transactions = transaction.TransactionManager.get_instance(
+            redis_connection
+        )
+        manager = index.IndexManager.get_instance(redis_connection)
+        indexes = manager.get_indexes_for_table(table_name)
+        indexes = [indexes[index_name] for index_name in sorted(indexes)]
+
+        lua = [
+            transactions.lua_transaction_info(),
+            "local count = #ARGV - 2",
+            "local first_id = %s - count + 1" %
+            output_table.lua_reserve_record_ids('count'),
+            "local records = {}",
+        ]
+        if indexes:
+            lua.append("local indexes_deferred = %s" %
+                       manager.lua_is_deferred(table_name))
+        for i in range(len(indexes)):
+            lua.append("local index_batch_%d = { numbers = {}, nonnumbers = {} }"
+                       % i)
+
+        lua.extend([
+            "for i = 1, count do",
+            "local id = first_id + i - 1",
+            "local data = '{\":id\":' .. id .. ',\":xid\":' .. xid .. "
+            "',\":xex\":0'",
+            "if ARGV[i + 2] ~= '' then",
+            "    data = data .. ',' .. ARGV[i + 2]",
+            "end",
+            "records[#records + 1] = id",
+            "records[#records + 1] = data .. '}'",
+        ])
+
+        if indexes:
+            lua.append("if not indexes_deferred then")
+            lua.append("local row = cjson.decode(records[#records])")
+            for i, the_index in enumerate(indexes):
+                lua.append(the_index.lua_batch_add('index_batch_%d' % i, 'row'))
+            lua.append("end")
+
+        # Write a full batch. The last batch is written after the loop.
+        lua.append("if i %% %d == 0 or i == count then" % self.BATCH_SIZE)
+        lua.append("redis.call('ZADD', %s, unpack(records))" %
+                   output_table.lua_redis_key())
+        lua.append("records = {}")
+        for i, the_index in enumerate(indexes):
+            lua.append(the_index.lua_batch_flush('index_batch_%d' % i))
+        lua.extend([
+            "end",
+            "end",
+            "return first_id",
+        ])
+
+        return '\n'.join(lua) + '\n'
+
     def __publish_notification(self, data, notification, publish, redis):
         notification_name = str(notification.notification_name)
         if notification.where is None:
@@ -75,7 +228,8 @@ class InsertStatement(statement.Statement):
             from tesseract import connection
 
             c = connection.Connection.current_connection()
-            select_result = c.execute(select_sql)
+            select_result = c.execute(select_sql, use_plan_cache=False)
+            outout_table.drop()
 
             assert select_result['success']
 
@@ -1,4 +1,5 @@
 import redis
+from tesseract import script
 from tesseract import vacuum
 
 class Instance:
@@ -8,8 +9,9 @@ class Instance:
     sharding against multiple Redis nodes - but for now lets keep it simple.
     """
 
-    def __init__(self, server, redis_host=None):
+    def __init__(self, server, redis_host=None, watch_lua=False):
         assert redis_host is None or isinstance(redis_host, str)
+        assert isinstance(watch_lua, bool)
 
         self.server = server
 
@@ -24,9 +26,17 @@ class Instance:
         self.redis = redis.StrictRedis(host=redis_host, port=6379, db=0)
         self.redis.set('tesseract_server', 1)
 
-        # Start vacuum
+        # Load the Lua library. Statements will not read the files again unless
+        # we are asked to watch them for changes.
+        self.lua = script.LuaLibrary.get_instance()
+        if watch_lua:
+            self.lua.watch()
+
+        # Start vacuum. There is only one vacuum thread for the process no
+        # matter how many servers are created.
         vacuum.vacuum.redis = self.redis
-        vacuum.thread.start()
+        if vacuum.thread.ident is None:
+            vacuum.thread.start()
 
         self.notifications = {}
         self.reset_warnings()
@@ -42,4 +52,5 @@ class Instance:
 
     def exit(self):
         vacuum.vacuum.stay_alive = False
+        self.lua.watching = False
         self.log("Server shutting down.")
@@ -14,6 +14,7 @@ sql_keywords = (
     'BY',
     'COMMIT',
     'CREATE',
+    'DEFER',
     'DELETE',
     'DESC',
     'DROP',
@@ -22,6 +23,7 @@ sql_keywords = (
     'GROUP',
     'IN',
     'INDEX',
+    'INDEXES',
     'INSERT',
     'INTO',
     'IS',
@@ -34,6 +36,7 @@ sql_keywords = (
     'ON',
     'OR',
     'ORDER',
+    'REINDEX',
     'ROLLBACK',
     'SELECT',
     'SET',
@@ -63,6 +66,7 @@ operators = (
     'NOT_EQUAL',
     'PARAM_CLOSE',
     'PARAM_OPEN',
+    'PLACEHOLDER',
     'PLUS',
     'SQUARE_CLOSE',
     'SQUARE_OPEN',
@@ -99,6 +103,7 @@ t_MODULO = '%'
 t_NOT_EQUAL = '(<>)|(!=)'
 t_PARAM_CLOSE = r'\)'
 t_PARAM_OPEN = r'\('
+t_PLACEHOLDER = r'\?'
 t_PLUS = r'\+'
 t_SQUARE_CLOSE = r'\]'
 t_SQUARE_OPEN = r'\['
@@ -162,5 +167,6 @@ def t_error(token):
     assert isinstance(token, lex.LexToken)
     raise RuntimeError("Unexpected token %s." % token.value)
 
-# Build the lexer.
-lex.lex()
+# Build the lexer. This lexer is not used directly because it can only lex one
+# string at a time. The parser takes a clone of it for each thread.
+lexer = lex.lex()
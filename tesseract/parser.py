@@ -2,8 +2,14 @@
 to have all the rules listed in alphabetical order. Each of the parser rules has
 a doc tag that explain the rule - this is ingested by Ply but it is important
 that 4 spaces prefix so that it is formatted correctly in docs.
+
+The Ply parser is only built once (which may require the LALR tables to be
+generated) no matter how many statements are parsed. Ply parsers and lexers are
+not re-entrant so each thread gets its own copy of them.
 """
 
+import copy
+import threading
 import ply.yacc as yacc
 from tesseract import ast
 from tesseract import delete
@@ -47,6 +53,7 @@ def p_statement(p):
                   | create_index_statement
                   | drop_table_statement
                   | drop_index_statement
+                  | reindex_statement
                   | transaction_statement
     """
 
@@ -54,7 +61,7 @@ def p_statement(p):
     # entry rule and being the first is how Ply determined the entry rule.
 
     # Which ever statement matches can be passed straight through.
-    p.parser.statement = p[1]
+    p.parser.result.statement = p[1]
 
 
 def p_arithmetic_expression(p):
@@ -309,6 +316,9 @@ def p_is_expression(p):
 def p_insert_statement(p):
     """
         insert_statement : INSERT INTO IDENTIFIER json_object
+                         | INSERT INTO IDENTIFIER json_array
+                         | INSERT INTO IDENTIFIER json_object DEFER INDEXES
+                         | INSERT INTO IDENTIFIER json_array DEFER INDEXES
                          | INSERT INTO IDENTIFIER
                          | INSERT INTO
                          | INSERT
@@ -326,9 +336,24 @@ def p_insert_statement(p):
     elif len(p) == 2:
         raise RuntimeError("Expected table name after INSERT.")
 
+    #     INSERT INTO IDENTIFIER json_object|json_array DEFER INDEXES
+    defer_indexes = len(p) == 7
+
+    #     INSERT INTO IDENTIFIER json_array
+    # Each item must be an object that is a record.
+    if isinstance(p[4].value, list):
+        for item in p[4].value:
+            if not isinstance(item, ast.Value) or \
+                    not isinstance(item.value, dict):
+                raise RuntimeError("Expected array of JSON objects.")
+
+        p[0] = insert.InsertStatement(p[3], [item.value for item in p[4].value],
+                                      defer_indexes)
+        return
+
     #     INSERT INTO IDENTIFIER json_object
     # We have a working `INSERT` statement.
-    p[0] = insert.InsertStatement(p[3], p[4].value)
+    p[0] = insert.InsertStatement(p[3], p[4].value, defer_indexes)
 
 
 def p_json_array(p):
@@ -391,7 +416,7 @@ def p_json_object_items(p):
     # Duplicate keys will raise warning, but are not a fatal error.
     for key in intersection:
         message = 'Duplicate key "%s", using last value.' % key
-        p.parser.warnings.append(message)
+        p.parser.result.warnings.append(message)
 
     # Regardless of duplicates, we will now combine the dictionaries.
     p[1].update(p[3])
@@ -475,12 +500,12 @@ def p_optional_group_clause(p):
 def p_optional_order_clause(p):
     """
         optional_order_clause : empty
-                              | ORDER BY IDENTIFIER optional_order_direction
+                              | ORDER BY order_list
     """
 
-    #     ORDER BY IDENTIFIER optional_order_direction
+    #     ORDER BY order_list
     if len(p) > 3:
-        p[0] = ast.OrderByClause(p[3], p[4])
+        p[0] = ast.OrderByClause(p[3])
     else:
         p[0] = None
 
@@ -513,6 +538,29 @@ def p_optional_where_clause(p):
         p[0] = None
 
 
+def p_order_column(p):
+    """
+        order_column : IDENTIFIER optional_order_direction
+    """
+
+    p[0] = (p[1], p[2])
+
+
+def p_order_list(p):
+    """
+        order_list : order_column
+                   | order_list COMMA order_column
+    """
+
+    #     order_column
+    if len(p) == 2:
+        p[0] = [ p[1] ]
+        return
+
+    #     order_list COMMA order_column
+    p[0] = p[1] + [ p[3] ]
+
+
 def p_optional_limit_clause(p):
     """
         optional_limit_clause : empty
@@ -548,6 +596,14 @@ def p_explain_select_statement(p):
         p[0] = p[1]
 
 
+def p_reindex_statement(p):
+    """
+        reindex_statement : REINDEX TABLE IDENTIFIER
+    """
+
+    p[0] = index.ReindexStatement(p[3])
+
+
 def p_select_statement(p):
     """
         select_statement : SELECT expression_list optional_from_clause optional_where_clause optional_group_clause optional_order_clause optional_limit_clause
@@ -633,14 +689,24 @@ def p_value(p):
               | MINUS NUMBER
               | PLUS NUMBER
               | IDENTIFIER
+              | PLACEHOLDER
     """
 
+    # Check the token type rather than the value, otherwise a string like '?'
+    # would be mistaken for the token.
+    token_type = p.slice[1].type
+
+    #     PLACEHOLDER
+    if token_type == 'PLACEHOLDER':
+        raise RuntimeError("Placeholders can only be used in prepared "
+                           "statements.")
+
     #     MINUS NUMBER
-    if p[1] == '-':
+    elif token_type == 'MINUS':
         p[0] = ast.Value(-p[2].value)
 
     #     PLUS NUMBER
-    elif p[1] == '+':
+    elif token_type == 'PLUS':
         p[0] = p[2]
 
     # All other conditions are single entity and can be passed through directly.
@@ -655,23 +721,285 @@ def p_error(p):
 
 def add_requirement(p, function_name):
     # Check if it already exists.
-    if function_name not in p.parser.lua_requirements:
+    if function_name not in p.parser.result.lua_requirements:
         # Add new unique operator.
-        p.parser.lua_requirements.append(function_name)
+        p.parser.result.lua_requirements.append(function_name)
+
+
+class ParseResult(object):
+    """The result of parsing a single SQL statement.
+
+    Attributes:
+      statement (Statement): The parsed statement.
+      warnings (list of str): Any warnings raised while parsing.
+      lua_requirements (list of str): The names of the Lua library files that
+        the statement needs. It might make sense to use a set() for unique
+        operators but we need to retain the order in which they are required.
+      params (list): The values for the parametrized literals in the
+        statement (see `fingerprint()`).
+    """
+
+    def __init__(self):
+        self.statement = None
+        self.warnings = []
+        self.lua_requirements = []
+        self.params = []
+
+    def bind(self, params):
+        """Create a result that shares the same statement but uses different
+        values for the parameters.
+
+        Arguments:
+          params (list): The values for the parameters.
+
+        Returns:
+          A new ParseResult.
+        """
+        assert isinstance(params, list)
+
+        result = ParseResult()
+        result.statement = self.statement
+        result.warnings = self.warnings
+        result.lua_requirements = self.lua_requirements
+        result.params = params
+
+        return result
+
+
+# The parser that is shared by all threads. Use get_parser() instead.
+parser = None
+parser_lock = threading.Lock()
+thread_parsers = threading.local()
 
 
-def parse(data):
-    # Build the parser.
-    parser = yacc.yacc()
-    parser.statement = None
-    parser.warnings = []
+def get_parser():
+    """Get the parser and lexer for the current thread.
 
-    # It might make sense to use a set() for unique operators but we need to
-    # retain the order in which they are required.
-    parser.lua_requirements = []
+    The parser is built the first time this is called. Each thread receives a
+    copy of the parser and a clone of the lexer the first time it asks for them.
+
+    Returns:
+      A tuple containing the parser and lexer.
+    """
+    global parser
+
+    if not hasattr(thread_parsers, 'parser'):
+        with parser_lock:
+            if parser is None:
+                # Building the tables is quick so nothing is written next to
+                # the sources. The warnings about the known conflicts in the
+                # grammar are not logged.
+                parser = yacc.yacc(debug=False, write_tables=False,
+                                   errorlog=yacc.NullLogger())
+
+        thread_parsers.parser = copy.copy(parser)
+        thread_parsers.lexer = lexer.lexer.clone()
+
+    return (thread_parsers.parser, thread_parsers.lexer)
+
+
+# The tokens that can end an operand. A + or - following one of these is a
+# binary operator rather than the sign of a number.
+operand_end_tokens = (
+    'CURLY_CLOSE',
+    'IDENTIFIER',
+    'NUMBER',
+    'PARAM_CLOSE',
+    'SQUARE_CLOSE',
+    'STRING_DOUBLE',
+    'STRING_SINGLE',
+)
+
+
+def lex(data):
+    """Convert a SQL statement into tokens.
+
+    Arguments:
+      data (str): The SQL statement.
+
+    Returns:
+      A list of tokens.
+    """
+    sql_parser, sql_lexer = get_parser()
+    sql_lexer.input(data)
+
+    return list(iter(sql_lexer.token, None))
+
+
+def fingerprint(data):
+    """Lex a SQL statement and create its fingerprint. See
+    fingerprint_tokens().
+
+    Arguments:
+      data (str): The SQL statement.
+
+    Returns:
+      A tuple containing the fingerprint (str), the values of the literals that
+      were replaced (list) and the tokens so that they do not need to be lexed
+      again by parse().
+    """
+    tokens = lex(data)
+    fingerprint, literals = fingerprint_tokens(tokens)
+
+    return (fingerprint, literals, tokens)
+
+
+def fingerprint_tokens(tokens):
+    """Reduce a SQL statement to a fingerprint. Statements that only differ by
+    whitespace, the case of keywords or the value of their literals will have
+    the same fingerprint.
+
+    Each literal number or string is replaced by its signature (see
+    `ast.Value.signature()`) so the fingerprint still knows the type of the
+    value. Some literals are part of the structure of the statement and are kept
+    in the fingerprint:
+
+      * Keys for JSON objects.
+      * Numbers following a unary + or -. These are folded into a single value
+        by the parser. A + or - that follows the end of an operand (like
+        `a - 1`) is a binary operator so the number is replaced as usual.
+
+    The values that are replaced are numbered (see `ast.Value.param`) in the
+    order they appear so that the compiled statement reads them from the
+    arguments of the Lua program rather than having them compiled in.
+
+    Arguments:
+      tokens (list): The tokens from lex().
+
+    Returns:
+      A tuple containing the fingerprint (str) and the values of the literals
+      that were replaced (list).
+    """
+    parts = []
+    literals = []
+    for i, token in enumerate(tokens):
+        if token.type not in ('NUMBER', 'STRING_SINGLE', 'STRING_DOUBLE'):
+            parts.append(str(token.value))
+            continue
+
+        is_key = i + 1 < len(tokens) and tokens[i + 1].type == 'COLON'
+        is_signed = i > 0 and tokens[i - 1].type in ('MINUS', 'PLUS') and \
+            (i < 2 or tokens[i - 2].type not in operand_end_tokens)
+        if is_key or is_signed:
+            parts.append(repr(token.value.value))
+        else:
+            parts.append(token.value.signature())
+            token.value.param = len(literals)
+            literals.append(token.value.value)
+
+    return (' '.join(parts), literals)
+
+
+class PreparedStatement(object):
+    """A SQL statement that has been lexed once so that it can be executed many
+    times with different values for its placeholders (`?`).
+
+    Attributes:
+      tokens (list): The tokens of the statement, including the placeholders.
+      placeholders (int): The number of placeholders.
+    """
+
+    def __init__(self, tokens):
+        assert isinstance(tokens, list)
+
+        self.tokens = tokens
+        self.placeholders = len([token for token in tokens
+                                 if token.type == 'PLACEHOLDER'])
+
+    def bind(self, params):
+        """Create the tokens for the statement by replacing each placeholder
+        with a value token.
+
+        Arguments:
+          params (list): The values for the placeholders, in order. Each value
+            must be null, a boolean, a number or a string.
+
+        Returns:
+          A list of tokens that can be passed to `fingerprint_tokens()` and
+          `parse()`.
+
+        Raises:
+          RuntimeError: If the parameters do not match the placeholders.
+        """
+        if not isinstance(params, list):
+            raise RuntimeError("Parameters must be an array.")
+
+        if len(params) != self.placeholders:
+            raise RuntimeError("Expected %d parameters, but received %d." % (
+                self.placeholders,
+                len(params)
+            ))
+
+        remaining_params = iter(params)
+        tokens = []
+        for token in self.tokens:
+            token = copy.copy(token)
+
+            if token.type == 'PLACEHOLDER':
+                self.__bind_token(token, next(remaining_params))
+
+            # Literal values will receive a parameter number when the tokens
+            # are fingerprinted so they cannot be shared between executions.
+            elif token.type in ('NUMBER', 'STRING_SINGLE', 'STRING_DOUBLE'):
+                token.value = ast.Value(token.value.value)
+
+            tokens.append(token)
+
+        return tokens
+
+    def __bind_token(self, token, param):
+        """Turn a placeholder token into the same token the lexer would have
+        produced for the value."""
+        if param is None or isinstance(param, bool):
+            token.type = 'IDENTIFIER'
+        elif isinstance(param, (int, float)):
+            token.type = 'NUMBER'
+        elif isinstance(param, str):
+            token.type = 'STRING_DOUBLE'
+        else:
+            raise RuntimeError("Parameters must be null, a boolean, a number "
+                               "or a string.")
+
+        token.value = ast.Value(param)
+
+
+def prepare(data):
+    """Prepare a SQL statement that may contain placeholders (`?`).
+
+    Arguments:
+      data (str): The SQL statement.
+
+    Returns:
+      A PreparedStatement.
+
+    Raises:
+      RuntimeError: If the SQL cannot be lexed.
+    """
+    return PreparedStatement(lex(data))
+
+
+def parse(data, tokens=None):
+    """Parse a single SQL statement.
+
+    Arguments:
+      data (str): The SQL statement.
+      tokens (list): The tokens returned from fingerprint() or
+        `PreparedStatement.bind()`. If these are not provided the statement will
+        be lexed.
+
+    Returns:
+      A ParseResult.
+    """
+    sql_parser, sql_lexer = get_parser()
+    sql_parser.result = ParseResult()
 
     # Run the parser.
-    parser.parse(data)
+    if tokens is None:
+        sql_parser.parse(data, lexer=sql_lexer)
+    else:
+        remaining_tokens = iter(tokens)
+        sql_parser.parse(lexer=sql_lexer,
+                         tokenfunc=lambda: next(remaining_tokens, None))
 
     # Return the base AST tree.
-    return parser
+    return sql_parser.result
@@ -0,0 +1,142 @@
+"""Most workloads run the same handful of statements over and over again, often
+only changing the values in them. Parsing and compiling a statement is the
+largest fixed cost for simple statements so the results are kept in a plan
+cache.
+
+Statements are looked up by their fingerprint (see
+``parser.fingerprint_tokens()``) which ignores whitespace, the case of keywords
+and the values of literals. The cached plan contains the parsed statement and
+the compiled Lua program.
+
+The literals are passed to the Lua program as arguments so the same plan (and
+the same script loaded into Redis) is used for any values. Some statements use
+their values outside of the Lua program (see `Statement.is_parameterized()`),
+these plans are only reused when the values of the literals also match. Some
+statements are never cached at all (see `Statement.is_cacheable()`), like
+inserting an array of records.
+
+The cache holds a limited number of plans. When it is full the least recently
+used plan is thrown away.
+
+The plan for a statement may depend on the indexes that exist on the table it
+uses. Any time an index is created or dropped (including when a table is
+dropped) all of the plans for that table are removed from the cache. This also
+happens when the indexes are changed by another server (see
+``index.IndexCatalog``).
+"""
+
+import collections
+import threading
+from tesseract import parser
+
+
+class PlanCache(object):
+    """The PlanCache holds the plans for recently executed statements.
+
+    Attributes:
+      MAX_PLANS (int): The maximum number of plans to keep.
+    """
+
+    MAX_PLANS = 1000
+
+    __instance = None
+
+    def __init__(self):
+        """This is for internal use only. See get_instance()."""
+        self.__plans = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def get_instance():
+        """This is the correct way to get the plan cache singleton instance.
+
+        Returns:
+          A PlanCache instance.
+        """
+        if not PlanCache.__instance:
+            PlanCache.__instance = PlanCache()
+
+        assert isinstance(PlanCache.__instance, PlanCache)
+        return PlanCache.__instance
+
+    def parse(self, sql):
+        """Parse a SQL statement, or return the plan for an equivalent statement
+        if one has been parsed before.
+
+        The statement in the returned ParseResult may be shared with other
+        threads so it must not be modified.
+
+        Arguments:
+          sql (str): The SQL statement.
+
+        Returns:
+          A ParseResult.
+
+        Raises:
+          RuntimeError: If the SQL cannot be parsed.
+        """
+        assert isinstance(sql, str)
+
+        return self.parse_tokens(parser.lex(sql))
+
+    def parse_tokens(self, tokens):
+        """The same as parse() for a statement that has already been lexed, like
+        a prepared statement (see `parser.PreparedStatement.bind()`).
+
+        Arguments:
+          tokens (list): The tokens of the SQL statement.
+
+        Returns:
+          A ParseResult.
+
+        Raises:
+          RuntimeError: If the SQL cannot be parsed.
+        """
+        assert isinstance(tokens, list)
+
+        fingerprint, literals = parser.fingerprint_tokens(tokens)
+
+        with self.__lock:
+            result = self.__plans.pop(fingerprint, None)
+            if result is not None:
+                self.__plans[fingerprint] = result
+
+        if result is not None and (result.statement.is_parameterized() or
+                                   result.params == literals):
+            return result.bind(literals)
+
+        result = parser.parse(None, tokens)
+        result.params = literals
+        if not result.statement.is_cacheable():
+            return result
+
+        with self.__lock:
+            if len(self.__plans) >= self.MAX_PLANS:
+                self.__plans.popitem(last=False)
+            self.__plans[fingerprint] = result
+
+        return result
+
+    def invalidate(self, table_name):
+        """Remove all of the plans that use a table.
+
+        Arguments:
+          table_name (str): The name of the table.
+        """
+        assert isinstance(table_name, str)
+
+        with self.__lock:
+            for key, result in list(self.__plans.items()):
+                statement_table = getattr(result.statement, 'table_name', None)
+                if str(statement_table) == table_name:
+                    del self.__plans[key]
+
+    def clear(self):
+        """Remove all of the plans."""
+        with self.__lock:
+            self.__plans.clear()
+
+    def __len__(self):
+        """The number of plans in the cache."""
+        with self.__lock:
+            return len(self.__plans)
@@ -12,6 +12,78 @@ the host and port is sufficient for making a connection.
 It is a plain TCP connection that normally runs on port 3679.
 
 
+Framing
+-------
+
+By default each request must arrive in a single read (up to 1024 bytes) and the
+client must wait for the response before sending the next request.
+
+A client can ask for framed messages by sending this as the first request:
+
+.. code-block:: json
+
+   {
+     "framing": "length"
+   }
+
+The server will respond (without framing) with:
+
+.. code-block:: json
+
+   {
+     "success": true
+   }
+
+From then on every request and response in both directions is framed. There
+are two types of framing:
+
+``length``
+  Each message is prefixed with its length in bytes as a 4 byte unsigned big
+  endian integer.
+
+``newline``
+  Each message is followed by a new line character (``\n``). The JSON itself
+  must not contain any new lines.
+
+With framing there is no limit to the size of the messages and the client does
+not have to wait for a response before sending the next request (pipelining).
+Requests are always processed, and responses are sent, in the order the
+requests were received.
+
+
+Streaming
+---------
+
+Large results can be streamed when framing is used. Add ``"stream": true`` to
+the request:
+
+.. code-block:: json
+
+   {
+     "sql": "SELECT * FROM people",
+     "stream": true
+   }
+
+The rows are sent in chunks, each chunk is a separate message that contains
+``"more": true``:
+
+.. code-block:: json
+
+   {
+     "success": true,
+     "data": [
+       {
+         "name": "Bob"
+       }
+     ],
+     "more": true
+   }
+
+The final message is a normal response (without ``more``) that contains the
+warnings. All of the rows have already been sent so its ``data`` is always
+empty.
+
+
 Request
 -------
 
@@ -24,6 +96,41 @@ The request is a JSON object:
    }
 
 
+Prepared Statements
+-------------------
+
+A statement that is executed many times with different values can be prepared
+once. Each ``?`` is a placeholder for a value:
+
+.. code-block:: json
+
+   {
+     "prepare": "INSERT INTO people {\"name\": ?, \"age\": ?}"
+   }
+
+The response contains a handle for the prepared statement. The handle can only
+be used on the same connection:
+
+.. code-block:: json
+
+   {
+     "success": true,
+     "handle": 1
+   }
+
+The prepared statement is executed by providing the handle and the values for
+the placeholders. The values can be ``null``, booleans, numbers or strings:
+
+.. code-block:: json
+
+   {
+     "execute": 1,
+     "params": ["Bob", 37]
+   }
+
+The response is the same as if the SQL was sent.
+
+
 Response
 --------
 
@@ -67,17 +174,30 @@ if the ``warnings`` is present in the response:
    }
 """
 
+import json
+import struct
+
+
 class Protocol:
     """This class handles the basic protocols that tesseract uses to communicate
     with the server. You can read how the protocol works in the documentation
     under Appendix > Server Protocol.
+
+    Attributes:
+      FRAMING_LENGTH (str): Messages are prefixed with their length.
+      FRAMING_NEWLINE (str): Messages are terminated with a new line.
     """
 
+    FRAMING_LENGTH = 'length'
+    FRAMING_NEWLINE = 'newline'
+
     @staticmethod
     def successful_response(data=None, warnings=None):
         # If there is no data to be returned (for instance a `DELETE` statement)
-        # then you should provide `None`.
-        assert data is None or isinstance(data, list), '%r' % data
+        # then you should provide `None`. The data may also be a
+        # `statement.Records` that will be read when the response is sent.
+        assert data is None or isinstance(data, list) or \
+            hasattr(data, 'chunks'), '%r' % data
 
         # Warning are of course optional.
         assert warnings is None or isinstance(warnings, list), '%r' % warnings
@@ -102,8 +222,167 @@ class Protocol:
         }
 
     @staticmethod
-    def sql_request(sql):
-        assert isinstance(sql, str)
+    def prepared_response(handle):
+        assert isinstance(handle, int)
         return {
+            "success": True,
+            "handle": handle
+        }
+
+    @staticmethod
+    def chunk_response(data):
+        assert isinstance(data, list)
+        return {
+            "success": True,
+            "data": data,
+            "more": True
+        }
+
+    @staticmethod
+    def sql_request(sql, stream=False):
+        assert isinstance(sql, str)
+        assert isinstance(stream, bool)
+
+        request = {
             "sql": sql,
         }
+        if stream:
+            request['stream'] = True
+
+        return request
+
+    @staticmethod
+    def framing_request(framing):
+        assert framing in (Protocol.FRAMING_LENGTH, Protocol.FRAMING_NEWLINE)
+        return {
+            "framing": framing,
+        }
+
+    @staticmethod
+    def encode_response(response, raw_data=None):
+        """JSON encode a response.
+
+        Arguments:
+          response (dict): The response.
+          raw_data (list of bytes): Records that are already JSON encoded. If
+            provided these are spliced into the response as the data without
+            being decoded. Any existing data in the response is replaced.
+
+        Returns:
+          bytes
+        """
+        assert isinstance(response, dict)
+        assert raw_data is None or isinstance(raw_data, list)
+
+        if raw_data is None:
+            return json.dumps(response).encode('UTF-8')
+
+        response = dict(response)
+        response.pop('data', None)
+        encoded = json.dumps(response).encode('UTF-8')
+
+        return encoded[:-1] + b', "data": [' + b', '.join(raw_data) + b']}'
+
+    @staticmethod
+    def encode_frame(framing, data):
+        """Frame a message so it can be sent.
+
+        Arguments:
+          framing (str): One of the FRAMING_ constants, or None for no framing.
+          data (str or bytes): The encoded JSON message.
+
+        Returns:
+          bytes
+        """
+        if not isinstance(data, bytes):
+            data = data.encode('UTF-8')
+
+        if framing == Protocol.FRAMING_LENGTH:
+            return struct.pack('>I', len(data)) + data
+
+        if framing == Protocol.FRAMING_NEWLINE:
+            return data + b'\n'
+
+        return data
+
+    @staticmethod
+    def prepare_request(sql):
+        assert isinstance(sql, str)
+        return {
+            "prepare": sql,
+        }
+
+    @staticmethod
+    def execute_request(handle, params):
+        assert isinstance(handle, int)
+        assert isinstance(params, list)
+        return {
+            "execute": handle,
+            "params": params,
+        }
+
+
+class FrameReader(object):
+    """Reads messages from a socket. Any data that is received after the end of
+    a message (the next pipelined message) is kept for the next read.
+
+    Attributes:
+      framing (str): One of the `Protocol.FRAMING_` constants, or None if
+        messages are not framed.
+      buffer_size (int): The maximum number of bytes to read from the socket at
+        a time. When there is no framing this is the maximum size of a message.
+    """
+
+    def __init__(self, sock, buffer_size=1024):
+        self.framing = None
+        self.buffer_size = buffer_size
+        self.__socket = sock
+        self.__buffer = bytearray()
+
+    def read(self):
+        """Wait for the next message.
+
+        Returns:
+          The message as bytes. This will be empty if the other side has
+          disconnected.
+        """
+        # Without framing whatever arrives in a single read is the message.
+        if self.framing is None:
+            return self.__socket.recv(self.buffer_size)
+
+        while True:
+            message = self.__next_message()
+            if message is not None:
+                return message
+
+            data = self.__socket.recv(self.buffer_size)
+            if len(data) == 0:
+                return b''
+
+            self.__buffer += data
+
+    def __next_message(self):
+        """Take the next complete message from the buffer.
+
+        Returns:
+          bytes, or None if the buffer does not contain a complete message.
+        """
+        if self.framing == Protocol.FRAMING_NEWLINE:
+            end = self.__buffer.find(b'\n')
+            if end < 0:
+                return None
+
+            message = bytes(self.__buffer[:end])
+            del self.__buffer[:end + 1]
+            return message
+
+        if len(self.__buffer) < 4:
+            return None
+
+        length = struct.unpack('>I', bytes(self.__buffer[:4]))[0]
+        if len(self.__buffer) < 4 + length:
+            return None
+
+        message = bytes(self.__buffer[4:4 + length])
+        del self.__buffer[:4 + length]
+        return message
@@ -0,0 +1,225 @@
+"""Every statement is compiled into a single Lua program that is run inside
+Redis. Sending the entire program with ``EVAL`` means Redis has to receive and
+compile kilobytes of Lua for every statement, even if it is exactly the same as
+the one it just ran.
+
+Instead each distinct program is sent once with ``SCRIPT LOAD`` and from then on
+it is executed by its SHA1 with ``EVALSHA``. For this to be effective the
+compiled Lua must be identical for identical statements, so anything that
+changes between executions (like the transaction ID) must be passed in as an
+argument rather than compiled into the program.
+
+Redis may forget the scripts it has loaded (it was restarted or someone ran
+``SCRIPT FLUSH``). When that happens Redis answers with ``NOSCRIPT`` and the
+program is loaded again before retrying.
+
+The Lua programs are built from the generated code for the statement and the
+Lua library (all the files in the ``lua/`` directory). The library is read from
+disk once when the server starts and kept in memory by the ``LuaLibrary``.
+While developing the Lua library you can ask the server to watch the files and
+reload them when they change with::
+
+    bin/tesseract --watch-lua
+"""
+
+import os
+import redis
+import threading
+import time
+
+
+class ScriptManager(object):
+    """The ScriptManager keeps track of the Lua programs that have been loaded
+    into Redis.
+
+    Attributes:
+      MAX_SCRIPTS (int): The maximum number of SHA1s to remember. Once this is
+        reached the known scripts are forgotten and will be loaded again as they
+        are needed. This does not remove anything from Redis.
+    """
+
+    MAX_SCRIPTS = 1000
+
+    __instance = None
+
+    def __init__(self, redis_connection):
+        """This is for internal use only. See get_instance()."""
+        assert isinstance(redis_connection, redis.StrictRedis)
+        self.__redis = redis_connection
+        self.__scripts = {}
+
+    @staticmethod
+    def get_instance(redis_connection):
+        """This is the correct way to get the script manager singleton instance.
+
+        Arguments:
+          redis_connection (redis.StrictRedis): The Redis connection.
+
+        Returns:
+          A ScriptManager instance.
+        """
+        assert isinstance(redis_connection, redis.StrictRedis)
+        if not ScriptManager.__instance:
+            ScriptManager.__instance = ScriptManager(redis_connection)
+
+        assert isinstance(ScriptManager.__instance, ScriptManager)
+        return ScriptManager.__instance
+
+    def evaluate(self, lua, *args):
+        """Run a Lua program, loading it into Redis first if it has not been
+        seen before.
+
+        Arguments:
+          lua (str): The complete Lua program.
+          args: The values for ARGV.
+
+        Returns:
+          Whatever the Lua program returns.
+        """
+        assert isinstance(lua, str)
+
+        sha = self.__scripts.get(lua)
+        if sha is None:
+            sha = self.load(lua)
+
+        try:
+            return self.__redis.evalsha(sha, 0, *args)
+        except redis.exceptions.NoScriptError:
+            sha = self.load(lua)
+            return self.__redis.evalsha(sha, 0, *args)
+
+    def load(self, lua):
+        """Load a Lua program into Redis without running it.
+
+        Arguments:
+          lua (str): The complete Lua program.
+
+        Returns:
+          The SHA1 of the program.
+        """
+        assert isinstance(lua, str)
+
+        if len(self.__scripts) >= self.MAX_SCRIPTS:
+            self.__scripts = {}
+
+        sha = self.__redis.script_load(lua)
+        self.__scripts[lua] = sha
+
+        return sha
+
+
+class LuaLibrary(object):
+    """The LuaLibrary holds the contents of every file in the ``lua/``
+    directory. Each file is named by its path without the extension, like
+    ``base`` or ``operator/equal``.
+
+    The files are only read when the library is created (or reloaded). A reload
+    replaces all of the files at once so a statement will never see a mix of old
+    and new files.
+
+    Attributes:
+      path (str): The directory that contains the Lua files.
+      watching (bool): Set to ``False`` to stop the thread started by
+        ``watch()``.
+    """
+
+    __instance = None
+
+    def __init__(self, path):
+        """This is for internal use only. See get_instance().
+
+        Arguments:
+          path (str): The directory that contains the Lua files.
+        """
+        assert isinstance(path, str)
+        self.path = path
+        self.watching = False
+        self.__files = {}
+        self.__modified = {}
+        self.reload()
+
+    @staticmethod
+    def get_instance():
+        """This is the correct way to get the Lua library singleton instance.
+        The files will be loaded the first time this is called.
+
+        Returns:
+          A LuaLibrary instance.
+        """
+        if not LuaLibrary.__instance:
+            here = os.path.dirname(os.path.realpath(__file__))
+            LuaLibrary.__instance = LuaLibrary(os.path.join(here, '..', 'lua'))
+
+        assert isinstance(LuaLibrary.__instance, LuaLibrary)
+        return LuaLibrary.__instance
+
+    def get(self, name):
+        """Fetch the Lua code for a single file.
+
+        Arguments:
+          name (str): The name of the file, like ``operator/equal``.
+
+        Returns:
+          str Lua code.
+        """
+        assert isinstance(name, str)
+        return self.__files[name]
+
+    def reload(self):
+        """Read all of the Lua files from disk."""
+        files = {}
+        modified = {}
+
+        for name, file_path in self.__find_files():
+            with open(file_path) as lua_file:
+                files[name] = lua_file.read()
+            modified[name] = os.path.getmtime(file_path)
+
+        self.__files = files
+        self.__modified = modified
+
+    def watch(self, interval=1):
+        """Start a thread that will reload the files when any of them are
+        added, removed or modified. This is only intended to be used while
+        developing the Lua library.
+
+        Arguments:
+          interval (int): The number of seconds between each check.
+        """
+        assert isinstance(interval, int)
+
+        self.watching = True
+        thread = threading.Thread(target=self.__watch, args=(interval,))
+        thread.daemon = True
+        thread.start()
+
+    def __watch(self, interval):
+        while self.watching:
+            if self.__has_changed():
+                self.reload()
+            time.sleep(interval)
+
+    def __has_changed(self):
+        modified = {}
+        for name, file_path in self.__find_files():
+            modified[name] = os.path.getmtime(file_path)
+
+        return modified != self.__modified
+
+    def __find_files(self):
+        """Find all of the Lua files.
+
+        Returns:
+          A list of tuples containing the name and path of each file.
+        """
+        found = []
+        for directory, _, file_names in os.walk(self.path):
+            for file_name in file_names:
+                if not file_name.endswith('.lua'):
+                    continue
+
+                file_path = os.path.join(directory, file_name)
+                name = os.path.relpath(file_path, self.path)[:-4]
+                found.append((name.replace(os.sep, '/'), file_path))
+
+        return found
@@ -1,3 +1,4 @@
+import functools
 import re
 import redis
 from tesseract import ast
@@ -93,28 +94,33 @@ class SelectStatement(statement.Statement):
 
         return False
 
+    def is_parameterized(self):
+        """An `EXPLAIN` renders the values so it cannot be shared."""
+        return not self.explain
+
     def execute(self, result, tesseract):
         assert isinstance(result.statement, SelectStatement)
         assert isinstance(tesseract.redis, redis.StrictRedis)
 
-        tesseract.redis.delete('agg')
-
         select = result.statement
-        lua, args, manager = self.compile_select(result, tesseract.redis)
 
         if select.explain:
-            tesseract.redis.delete('explain')
+            lua, args, manager = self.compile_select(result, tesseract.redis)
             explain = manager.explain(select.table_name)
             return protocol.Protocol.successful_response(explain)
 
+        lua = self.compile(
+            result,
+            lambda: self.compile_select(result, tesseract.redis)[0]
+        )
+
         return self.run(
             tesseract.redis,
             select.table_name,
             tesseract.warnings,
             lua,
-            args,
-            result,
-            manager
+            result.params,
+            result
         )
 
     @staticmethod
@@ -128,56 +134,194 @@ class SelectStatement(statement.Statement):
 
         return []
 
-    def __index_matches(self, stages, rule, index_name, expression, redis):
-        # noinspection PyCallingNonCallable
-        looking_for = rule['index_name'](expression.where)
-        if redis.hget('indexes', index_name).decode() == looking_for:
-            # noinspection PyCallingNonCallable
-            args = rule['args'](expression.where)
-            if len(args) > 0:
-                args.insert(0, index_name)
-                stages.add(index.IndexStage, args)
-                return True
-
     def __find_index(self, expression, redis, result, stages):
         """Try and find an index that can be used for the WHERE expression. If
         and index is found it is added to the query plan.
 
+        When the WHERE is several conditions joined with AND only one of them
+        needs to use an index. The one expected to find the fewest records is
+        chosen (see `index.IndexLookup.rank()`) and the other conditions are
+        checked against the records it finds. However, if there are equality
+        conditions on fields that have different indexes the records found by
+        each of those indexes are intersected instead.
+
         Returns:
           If an index was found True is returned, else False.
         """
-        rules = self.__index_rules(result.statement.table_name)
-        signature = expression.where.signature()
-        rule = None
-        for r in rules.keys():
-            if re.match(r, signature):
-                rule = r
-                break
-
-        if rule:
-            index_manager = index.IndexManager.get_instance(redis)
-            indexes = index_manager.get_indexes_for_table(str(result.statement.table_name))
-            for index_name in indexes:
-                if self.__index_matches(stages, rules[rule], index_name, expression, redis):
-                    return True
+        conjuncts = self.__and_operands(expression.where)
+        indexes = None
+        candidates = []
+        for conjunct in conjuncts:
+            where = conjunct
+            while isinstance(where, ast.GroupExpression):
+                where = where.value
+
+            found = self.__match_index_rule(where)
+            if found is None:
+                continue
+
+            # Only fetch the indexes when there is something that could use
+            # one.
+            if indexes is None:
+                index_manager = index.IndexManager.get_instance(redis)
+                indexes = index_manager.get_usable_indexes_for_table(
+                    str(result.statement.table_name)
+                )
+
+            field, lookup_class, args = found
+            for index_name in sorted(indexes):
+                if indexes[index_name].field_name == str(field):
+                    lookup = lookup_class(index_name, where, *args)
+                    candidates.append((conjunct, lookup))
+                    break
+
+        if not candidates:
+            return False
+
+        exact = {}
+        for conjunct, lookup in candidates:
+            if isinstance(lookup, index.ExactLookup) and \
+                    lookup.index_name not in exact:
+                exact[lookup.index_name] = (conjunct, lookup)
+
+        if len(exact) > 1:
+            # Start with the lookup that is expected to find the fewest records.
+            used = sorted(exact.values(),
+                          key=lambda found: (found[1].rank(),
+                                             found[1].index_name))
+            lookup = index.IntersectLookup([found[1] for found in used])
+        else:
+            used = [min(candidates, key=lambda found: found[1].rank())]
+            lookup = used[0][1]
 
-        return False
+        stages.add(index.IndexStage, (lookup,))
 
-    def __index_rules(self, tn):
-        return {
-            '^@I = @V.$': {
-                'index_name': lambda e: '%s.%s' % (tn, e.left),
-                'args': lambda e: [e.right],
-            },
-            '^@V. = @I$': {
-                'index_name': lambda e: '%s.%s' % (tn, e.right),
-                'args': lambda e: [e.left],
-            },
-            '^@I IS @V.$': {
-                'index_name': lambda e: '%s.%s' % (tn, e.left),
-                'args': self.is_to_value,
-            },
-        }
+        used_conjuncts = [found[0] for found in used]
+        remaining = [conjunct for conjunct in conjuncts
+                     if not any(conjunct is used_conjunct
+                                for used_conjunct in used_conjuncts)]
+        if remaining:
+            stages.add(WhereStage, (functools.reduce(ast.AndExpression,
+                                                     remaining),))
+
+        return True
+
+    def __and_operands(self, e):
+        """Split `a AND (b AND c)` into `[a, b, c]`."""
+        if isinstance(e, ast.GroupExpression) and \
+                isinstance(e.value, ast.AndExpression):
+            return self.__and_operands(e.value)
+
+        if isinstance(e, ast.AndExpression):
+            return self.__and_operands(e.left) + self.__and_operands(e.right)
+
+        return [e]
+
+    def __match_index_rule(self, where):
+        """Find the first of the `__index_rules()` that fits the expression.
+
+        Returns:
+          The same as the function of the rule, or None.
+        """
+        signature = where.signature()
+        for rule, lookup in self.__index_rules():
+            if re.match(rule, signature):
+                found = lookup(where)
+                if found is not None:
+                    return found
+
+        return None
+
+    def __index_rules(self):
+        """Each rule is a regular expression for the signature of the WHERE
+        expression and a function that returns the field, the class of the
+        `index.IndexLookup` and its arguments (after the index name and
+        expression). The function may return None if the index cannot be used
+        after all.
+        """
+        return (
+            ('^@I = @V.$', lambda e: (e.left, index.ExactLookup, [[e.right]])),
+            ('^@V. = @I$', lambda e: (e.right, index.ExactLookup, [[e.left]])),
+            ('^@I IS @V.$', self.__is_lookup),
+            ('^@I IN @Vl$', self.__in_lookup),
+            ('^(@I = @V.|@V. = @I)( OR (@I = @V.|@V. = @I))+$',
+             self.__or_lookup),
+            ('^@I (<|<=|>|>=) @V[ifs]$', self.__range_lookup),
+            ('^@V[ifs] (<|<=|>|>=) @I$', self.__range_lookup),
+            ('^@I BETWEEN @Vl$', self.__between_lookup),
+        )
+
+    def __is_lookup(self, e):
+        values = self.is_to_value(e)
+        if not values:
+            return None
+
+        return (e.left, index.ExactLookup, [values])
+
+    def __is_lookup_value(self, value):
+        """Only single values can be looked up. A comparison with null is never
+        true so it cannot be found in the index either."""
+        return isinstance(value, ast.Value) and value.value is not None and \
+            not isinstance(value.value, (list, dict))
+
+    def __in_lookup(self, e):
+        """Each of the values in the list is looked up."""
+        if not all(self.__is_lookup_value(value) for value in e.right.value):
+            return None
+
+        return (e.left, index.ExactLookup, [e.right.value])
+
+    def __or_operands(self, e):
+        if isinstance(e, ast.OrExpression):
+            return self.__or_operands(e.left) + self.__or_operands(e.right)
+
+        return [e]
+
+    def __or_lookup(self, e):
+        """`x = 1 OR x = 2` is the same as `x IN (1, 2)` but only when every
+        comparison is on the same field."""
+        fields, values = set(), []
+        for comparison in self.__or_operands(e):
+            if isinstance(comparison.left, ast.Identifier):
+                field, value = comparison.left, comparison.right
+            else:
+                field, value = comparison.right, comparison.left
+
+            if not self.__is_lookup_value(value):
+                return None
+
+            fields.add(str(field))
+            values.append(value)
+
+        if len(fields) > 1:
+            return None
+
+        return (ast.Identifier(fields.pop()), index.ExactLookup, [values])
+
+    def __range_lookup(self, e):
+        """`x > 5` and `5 < x` are the same range."""
+        if isinstance(e.left, ast.Identifier):
+            field, value, operator = e.left, e.right, e.operator
+        else:
+            field, value = e.right, e.left
+            operator = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}[e.operator]
+
+        inclusive = operator in ('<=', '>=')
+        if operator in ('>', '>='):
+            return (field, index.RangeLookup, [(value, inclusive), None])
+
+        return (field, index.RangeLookup, [None, (value, inclusive)])
+
+    def __between_lookup(self, e):
+        """BETWEEN only works with numbers."""
+        lower, upper = e.right.value
+        for bound in (lower, upper):
+            if not isinstance(bound, ast.Value) or \
+                    not isinstance(bound.value, (int, float)) or \
+                    isinstance(bound.value, bool):
+                return None
+
+        return (e.left, index.RangeLookup, [(lower, True), (upper, True)])
 
     def __compile_from_and_where(self, expression, redis, result, stages):
         """When compiling the WHERE clause we need to do a few things:
@@ -208,7 +352,12 @@ class SelectStatement(statement.Statement):
             stages.add(group.GroupStage, (expression.group, expression.columns))
 
     def __compile_order(self, expression, stages):
-        if expression.order:
+        if not expression.order:
+            return
+
+        if expression.limit and expression.limit.limit is not None:
+            stages.add(TopNStage, (expression.order, expression.limit))
+        else:
             stages.add(OrderStage, (expression.order,))
 
     def __compile_columns(self, expression, stages):
@@ -236,20 +385,11 @@ class SelectStatement(statement.Statement):
         self.__compile_columns(expression, stages)
         self.__compile_limit(expression, stages)
 
-        lua = """
--- First thing is to convert all the incoming values from JSON to native.
--- Skipping the first two arguments that are not JSON and will always exist.
-local args = {}
-for i = 3, #ARGV do
-    args[i] = cjson.decode(ARGV[i])
-end
-"""
-
-        lua += stages.compile_lua(offset, expression.table_name)
+        lua = stages.compile_lua(offset, expression.table_name)
 
         return (lua, args, stages)
 
-class ExpressionStage(stage.Stage):
+class ExpressionStage(stage.PipelinedStage):
     def __init__(self, input_table, offset, redis, columns):
         stage.Stage.__init__(self, input_table, offset, redis)
         assert isinstance(columns, list)
@@ -261,15 +401,8 @@ class ExpressionStage(stage.Stage):
             "description": "Expressions: %s" % expressions
         }
 
-    def compile_lua(self):
-        lua = []
-        output_table = table.TransientTable(self.redis)
-
-        # Iterate the page.
-        lua.extend([
-            self.input_table.lua_iterate(),
-            "local tuple = {}",
-        ])
+    def compile_pipelined_lua(self):
+        lua = ["local tuple = {}"]
 
         index = 1
         offset = self.offset
@@ -294,13 +427,9 @@ class ExpressionStage(stage.Stage):
 
             index += 1
 
-        lua.extend([
-            output_table.lua_add_lua_record('tuple'),
-            self.input_table.lua_end_iterate()
-        ])
-
-        return (output_table, '\n'.join(lua), offset)
+        lua.append("row = tuple")
 
+        return (lua, [], offset)
 
 
 class ImpossibleWhereStage(stage.Stage):
@@ -313,7 +442,7 @@ class ImpossibleWhereStage(stage.Stage):
         return (table.TransientTable(self.redis), '', self.offset)
 
 
-class LimitStage(stage.Stage):
+class LimitStage(stage.PipelinedStage):
     def __init__(self, input_table, offset, redis, limit):
         stage.Stage.__init__(self, input_table, offset, redis)
         assert isinstance(limit, ast.LimitClause)
@@ -324,32 +453,44 @@ class LimitStage(stage.Stage):
             "description": str(self.limit)
         }
 
-    def compile_lua(self):
-        lua = []
-        output_table = table.TransientTable(self.redis)
+    def lua_pipeline_setup(self):
+        return "local counter = 0"
 
-        filter = "counter < %s" % self.limit.limit
+    def compile_pipelined_lua(self):
+        offset = '0'
         if self.limit.offset is not None:
-            filter = "counter >= %s and counter <= %s" % (
-                self.limit.offset,
-                self.limit.offset.value + self.limit.offset.value
-            )
-
-        # Iterate the page for the desired amount of rows.
-        lua.extend([
-            "local counter = 0",
-            self.input_table.lua_iterate(),
-            "   if %s then" % filter,
-            output_table.lua_add_lua_record('row'),
-            "   end",
-            "   counter = counter + 1",
-            self.input_table.lua_end_iterate(),
-        ])
+            offset = self.limit.offset.compile_lua(self.offset)[0]
+
+        # Only the rows that reach this stage are counted.
+        before = ["counter = counter + 1"]
+
+        if self.limit.limit is None:
+            before.append("if counter > %s then" % offset)
+            return (before, ["end"], self.offset)
+
+        # Once the last row has been produced there is no need to read the rest
+        # of the input.
+        last = "%s + %s" % (offset, self.limit.limit.compile_lua(self.offset)[0])
+        before.append("if counter > %s and counter <= %s then" % (offset, last))
+        after = [
+            "end",
+            "if counter >= %s then" % last,
+            "    scan_complete = true",
+            "    break",
+            "end",
+        ]
 
-        return (output_table, '\n'.join(lua), self.offset)
+        return (before, after, self.offset)
 
 class OrderStage(stage.Stage):
-    """This OrderStage represents the sorting of a set."""
+    """This OrderStage represents the sorting of a set.
+
+    The rows are decoded and sorted in Lua with a single `table.sort()`. The
+    values are compared by type first (booleans, numbers, strings and then
+    nulls) and then by value (see `order_compare()` in the Lua library). Each
+    row remembers the position it was read in so that rows with equal values
+    keep their original order.
+    """
 
     def __init__(self, input_table, offset, redis_connection, clause):
         stage.Stage.__init__(self, input_table, offset, redis_connection)
@@ -357,173 +498,187 @@ class OrderStage(stage.Stage):
         self.clause = clause
 
     def explain(self):
-        direction = 'ASC'
-        if self.clause.ascending is False:
-            direction = 'DESC'
         return {
-            'description': 'Sorting by %s (%s)' % (
-                self.clause.field_name,
-                direction
-            )
+            'description': 'Sorting by %s' % self.describe_columns()
         }
 
-    def compile_lua(self):
-        lua = []
-        output_table = table.TransientTable(self.redis)
+    def describe_columns(self):
+        columns = []
+        for field_name, ascending in self.clause.columns:
+            direction = 'DESC' if ascending is False else 'ASC'
+            columns.append('%s (%s)' % (field_name, direction))
 
-        # Clean out sort buffer.
-        lua.append(
-            "redis.call('DEL', 'order_null', 'order_boolean', 'order_number', 'order_string')"
-            "redis.call('DEL', 'order_boolean_sorted', 'order_number_sorted', 'order_string_sorted')"
-            "redis.call('DEL', 'order_result')"
-            "redis.call('DEL', 'order_boolean_hash', 'order_number_hash', 'order_string_hash')"
-        )
+        return ', '.join(columns)
 
-        lua.extend([
-            # This is for making values unique.
-            "local duplicate_number = 1",
-            "local duplicate_string = 1",
+    def lua_order_before(self):
+        """Generate the Lua function that tests if one row comes before another.
 
-            self.input_table.lua_iterate(),
+        Each row is a Lua table that contains the values to sort by (at the
+        indexes 1, 2, etc), `seq` which is the order it was read in and `row`.
 
-            # The first thing we need to do it get the value that we will be
-            # sorting by.
-            "    local value = row['%s']" % self.clause.field_name,
-
-            # For not ordering by an array or object is not supported.
-            "    if type(value) == 'table' then",
-            "       error('ORDER BY used on an array or object.')",
-
-            # When `value` is `nil` then there is no field, or if the field
-            # exists but has a value of `cjson.null` - this goes into first
-            # category.
-            "    elseif value == nil or value == cjson.null then",
-            "       redis.call('RPUSH', 'order_null', data)",
-
-            # The second category is for all booleans.
-            "    elseif type(value) == 'boolean' then",
-            "       if value then",
-            "          value = 't'",
-            "       else",
-            "          value = 'f'",
-            "       end",
-            "       value = value .. duplicate_number",
-            "       duplicate_number = duplicate_number + 1",
-            "       redis.call('HSET', 'order_boolean_hash', value, data)",
-            "       redis.call('RPUSH', 'order_boolean', value)",
-
-            # The third category is for all numbers.
-            "    elseif type(value) == 'number' then",
-            "       value = value .. '.00000' .. duplicate_number"
-            "       duplicate_number = duplicate_number + 1"
-            "       redis.call('HSET', 'order_number_hash', value, data)",
-            "       redis.call('RPUSH', 'order_number', value)",
-
-            # The last category is for strings and everything else.
-            "    else",
-            "       value = value .. ' ' .. duplicate_string"
-            "       duplicate_string = duplicate_string + 1"
-            "       redis.call('HSET', 'order_string_hash', value, data)",
-            "       redis.call('RPUSH', 'order_string', value)",
-            "    end",
-            self.input_table.lua_end_iterate(),
-        ])
+        Returns:
+          str Lua code that declares the `order_before` function.
+        """
+        lua = [
+            "local function order_before(a, b)",
+            "    local compare",
+        ]
 
-        desc = ", 'DESC'" if self.clause.ascending is False else ''
+        for i, (_, ascending) in enumerate(self.clause.columns):
+            lua.extend([
+                "    compare = order_compare(a[%d], b[%d])" % (i + 1, i + 1),
+                "    if compare ~= 0 then",
+                "        return compare %s 0" % ('>' if ascending is False else '<'),
+                "    end",
+            ])
 
-        # Sort the values.
         lua.extend([
-            "redis.call('SORT', 'order_boolean'%s, 'ALPHA', 'STORE', 'order_boolean_sorted')" % desc,
-            "redis.call('SORT', 'order_number'%s, 'STORE', 'order_number_sorted')" % desc,
-            "redis.call('SORT', 'order_string'%s, 'ALPHA', 'STORE', 'order_string_sorted')" % desc,
+            "    return a.seq < b.seq",
+            "end",
         ])
 
-        lua.extend([
-            "local rowid = 0",
-        ])
+        return '\n'.join(lua)
+
+    def lua_order_item(self):
+        """Generate the Lua that creates the item (see `lua_order_before()`)
+        for the current `row`. The item will be in the `item` variable and
+        `order_seq` must be incremented before each row.
 
-        # Now use the sorted data to construct the result.
-        reconstruct = [
-            # Start with booleans.
-            [
-                "local records = redis.call('LRANGE', 'order_boolean_sorted', '0', '-1')",
-                "for i, data in ipairs(records) do",
-                "    local record = cjson.decode(redis.call('HGET', 'order_boolean_hash', data))",
-                output_table.lua_add_lua_record('record'),
-                "    rowid = rowid + 1",
-                "end"
-            ],
-
-            # Now numbers.
-            [
-                "local records = redis.call('LRANGE', 'order_number_sorted', '0', '-1')",
-                "for i, data in ipairs(records) do",
-                "    local record = cjson.decode(redis.call('HGET', 'order_number_hash', data))",
-                output_table.lua_add_lua_record('record'),
-                "    rowid = rowid + 1",
-                "end"
-            ],
-
-            # Now strings.
-            [
-                "local records = redis.call('LRANGE', 'order_string_sorted', '0', '-1')",
-                "for i, data in ipairs(records) do",
-                "    local record = cjson.decode(redis.call('HGET', 'order_string_hash', data))",
-                output_table.lua_add_lua_record('record'),
-                "    rowid = rowid + 1",
-                "end"
-            ],
-
-            # `null`s are greater than any non-`null` value so we can append all
-            # the `null`s now.
-            [
-                "local records = redis.call('LRANGE', 'order_null', '0', '-1')",
-                "for i, data in ipairs(records) do",
-                "    local record = cjson.decode(data)",
-                output_table.lua_add_lua_record('record'),
-                "    rowid = rowid + 1",
-                "end"
-            ]
+        Returns:
+          str Lua code.
+        """
+        lua = ["local item = {seq = order_seq, row = row}"]
+
+        for i, (field_name, _) in enumerate(self.clause.columns):
+            # Arrays and objects cannot be sorted, even if they never need to
+            # be compared to anything.
+            lua.extend([
+                "item[%d] = row['%s']" % (i + 1, field_name),
+                "order_rank(item[%d])" % (i + 1),
+            ])
+
+        return '\n'.join(lua)
+
+    def compile_lua(self):
+        output_table = table.TransientTable(self.redis)
+        window_size = stage.StageManager.SCAN_WINDOW_SIZE
+
+        lua = [
+            self.lua_order_before(),
+            "local order_items = {}",
+            "local order_seq = 0",
+
+            self.input_table.lua_iterate(window_size),
+            "order_seq = order_seq + 1",
+            self.lua_order_item(),
+            "order_items[order_seq] = item",
+            self.input_table.lua_end_iterate(window_size),
+
+            "table.sort(order_items, order_before)",
+            "for _, item in ipairs(order_items) do",
+            "    local record = item.row",
+            output_table.lua_add_lua_record('record'),
+            "end",
         ]
 
-        # For reverse sort we need to flip all the groups of data backwards as
-        # well.
-        for sorter in (reversed(reconstruct)
-                       if self.clause.ascending is False
-                       else reconstruct):
-            lua.extend(sorter)
+        return (output_table, '\n'.join(lua), self.offset)
+
+
+class TopNStage(OrderStage):
+    """Sorts the input when only the first rows are needed (an `ORDER BY` with a
+    `LIMIT`). Instead of sorting every row only the first `limit + offset` rows
+    are kept in a heap in Lua memory as the input is read. The rows are ordered
+    exactly like `OrderStage` orders them.
+
+    The `LimitStage` that follows is still responsible for the offset.
+    """
+
+    def __init__(self, input_table, offset, redis_connection, clause, limit):
+        OrderStage.__init__(self, input_table, offset, redis_connection, clause)
+        assert isinstance(limit, ast.LimitClause)
+        assert limit.limit is not None
+        self.limit = limit
+
+    def explain(self):
+        size = self.limit.limit.value
+        if self.limit.offset is not None:
+            size += self.limit.offset.value
+
+        return {
+            'description': 'Sorting by %s keeping the first %d' % (
+                self.describe_columns(),
+                size
+            )
+        }
+
+    def compile_lua(self):
+        output_table = table.TransientTable(self.redis)
+        window_size = stage.StageManager.SCAN_WINDOW_SIZE
+
+        size = self.limit.limit.compile_lua(self.offset)[0]
+        if self.limit.offset is not None:
+            size += ' + %s' % self.limit.offset.compile_lua(self.offset)[0]
+
+        lua = [
+            self.lua_order_before(),
+            "local top_n_size = %s" % size,
+            "local top_n = {}",
+            "local order_seq = 0",
+
+            self.input_table.lua_iterate(window_size),
+            "order_seq = order_seq + 1",
+            self.lua_order_item(),
+            "heap_offer(top_n, order_before, top_n_size, item)",
+            self.input_table.lua_end_iterate(window_size),
+
+            # The heap only holds the rows we need, they still need to be put in
+            # order.
+            "table.sort(top_n, order_before)",
+            "for _, item in ipairs(top_n) do",
+            "    local record = item.row",
+            output_table.lua_add_lua_record('record'),
+            "end",
+        ]
 
         return (output_table, '\n'.join(lua), self.offset)
 
 
-class WhereStage(stage.Stage):
+class WhereStage(stage.PipelinedStage):
     def __init__(self, input_table, offset, redis, where):
         stage.Stage.__init__(self, input_table, offset, redis)
         assert where is None or isinstance(where, ast.Expression)
         self.where = where
-        self.output_table = table.TransientTable(redis)
 
     def explain(self):
         return {
             "description": "Filter: %s" % self.where
         }
 
-    def compile_lua(self):
-        lua = []
-
-        # Compile the WHERE into a Lua expression.
+    def __compile_where(self):
+        """Compile the WHERE into a Lua expression."""
         where_expression = self.where if self.where else ast.Value(True)
         where_clause, self.offset, new_args = where_expression.compile_lua(self.offset)
 
-        lua.extend([
+        return where_clause
+
+    def compile_pipelined_lua(self):
+        return (["if %s then" % self.__compile_where()], ["end"], self.offset)
+
+    def compile_lua(self):
+        """This is only used by subclasses that are not `pipelined` because
+        they act on the matching rows (see `action_on_match()`) rather than
+        produce them.
+        """
+        output_table = table.TransientTable(self.redis)
+        lua = [
             self.input_table.lua_iterate(),
-            "    if %s then" % where_clause,
+            "    if %s then" % self.__compile_where(),
             "        %s" % self.action_on_match(),
             "    end",
             self.input_table.lua_end_iterate(),
-        ])
+        ]
 
-        return (self.output_table, '\n'.join(lua), self.offset)
+        return (output_table, '\n'.join(lua), self.offset)
 
     def action_on_match(self):
         return self.output_table.lua_add_lua_record('row')
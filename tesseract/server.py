@@ -27,16 +27,19 @@ class Server(object):
 
     __next_connection_id = 0
 
-    def __init__(self, redis_host=None, port=3679):
+    def __init__(self, redis_host=None, port=3679, watch_lua=False):
         """Create the server.
 
         Arguments:
           redis_host (str): The host and optional port for the Redis server.
           port (int): The port number to run the server on.
+          watch_lua (bool): Reload the Lua library when the files change. This
+            is only useful when developing the Lua library.
         """
         assert redis_host is None or isinstance(redis_host, str)
         assert isinstance(port, int)
-        self.instance = instance.Instance(self, redis_host)
+        assert isinstance(watch_lua, bool)
+        self.instance = instance.Instance(self, redis_host, watch_lua)
         self.__port = port
         self.is_ready = False
 
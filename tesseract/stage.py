@@ -13,11 +13,28 @@ class StageManager(object):
     table and each of the stages must return a key that points to the location
     of another temporary table that will be fed into the subsequent stage.
 
+    Writing every intermediate result to a table is expensive (each row costs a
+    ZADD, an INCR and encoding the JSON, only for the next stage to read and
+    decode it again). So consecutive stages that work one row at a time (see
+    `Stage.pipelined`) are fused into a single loop over their input table and
+    only their final output is written to a table. Stages that need to see all
+    of the rows before producing any (like sorting or grouping) still read and
+    write whole tables.
+
+    The fused loop reads its input table in windows of `SCAN_WINDOW_SIZE`
+    records so that a stage can end the scan early (like a `LIMIT` that already
+    has all of its rows) without the rest of the table being read.
+
     Attributes:
+        SCAN_WINDOW_SIZE (int): The number of records a fused loop reads from
+            Redis at a time.
         stages (list of tesseract.engine.stage.stage.Stage): The stages to be
             run. This will be empty when you create a new `StageManager`.
 
     """
+
+    SCAN_WINDOW_SIZE = 1000
+
     def __init__(self, redis_connection):
         assert isinstance(redis_connection, redis.StrictRedis)
 
@@ -35,16 +52,55 @@ class StageManager(object):
 
     def compile_lua(self, offset, table_name):
         from tesseract import table
+        from tesseract import transaction
+
+        manager = transaction.TransactionManager.get_instance(self.redis)
+        lua = manager.lua_transaction_info() + "\n"
+
+        # Convert all the incoming parameters from JSON to native. The first
+        # `offset` arguments are not parameters and will always exist.
+        lua += "local args = {}\n"
+        lua += "for i = %d, #ARGV do\n" % (offset + 1)
+        lua += "    args[i] = cjson.decode(ARGV[i])\n"
+        lua += "end\n"
 
-        lua = ''
         input_table = table.PermanentTable(self.redis, str(table_name))
+        stages_lua = ''
         cleanup_tables = []
+        pipeline = []
         for stage_details in self.stages:
+            if not stage_details['class'].pipelined and pipeline:
+                input_table, stage_lua = self.__compile_pipeline(input_table,
+                                                                 pipeline)
+                stages_lua += stage_lua + "\n"
+                cleanup_tables.append(input_table)
+                pipeline = []
+
             stage = stage_details['class'](input_table, offset, self.redis, *stage_details['args'])
+            if stage.pipelined:
+                before, after, offset = stage.compile_pipelined_lua()
+                pipeline.append((stage, before, after))
+                continue
+
             input_table, stage_lua, offset = stage.compile_lua()
-            lua += stage_lua + "\n"
+            stages_lua += stage_lua + "\n"
+            cleanup_tables.append(input_table)
+
+        if pipeline:
+            input_table, stage_lua = self.__compile_pipeline(input_table,
+                                                             pipeline)
+            stages_lua += stage_lua + "\n"
             cleanup_tables.append(input_table)
 
+        # Transient table names are reused between statements in the same
+        # transaction so any tables left over from a previous statement (like
+        # the result) must be emptied before we start.
+        for cleanup_table in cleanup_tables:
+            if isinstance(cleanup_table, table.TransientTable):
+                lua += '%s\n' % cleanup_table.lua_drop()
+
+        lua += stages_lua
+
         # We cannot clean up the last table because it contains the result.
         cleanup_tables.pop()
 
@@ -52,9 +108,47 @@ class StageManager(object):
             assert isinstance(cleanup_table, table.TransientTable)
             lua += '%s\n' % cleanup_table.lua_drop()
 
-        lua += "return '%s'\n" % input_table.table_name
+        lua += "return %s\n" % input_table.lua_table_name()
         return lua
 
+    def __compile_pipeline(self, input_table, pipeline):
+        """Fuse pipelined stages into a single loop over the input table.
+
+        Arguments:
+          input_table (Table): The table to iterate.
+          pipeline (list of tuple): Each item contains the stage and the Lua
+            returned from its `compile_pipelined_lua()`.
+
+        Returns:
+          A tuple of the output table and the Lua code.
+        """
+        from tesseract import table
+
+        output_table = table.TransientTable(self.redis)
+        lua = [stage.lua_pipeline_setup() for stage, _, _ in pipeline
+               if stage.lua_pipeline_setup()]
+
+        # The first stage may provide its own rows instead of reading the input
+        # table (like an index lookup).
+        source = pipeline[0][0].lua_pipeline_source()
+        if source is None:
+            source = (
+                [input_table.lua_iterate(self.SCAN_WINDOW_SIZE)],
+                [input_table.lua_end_iterate(self.SCAN_WINDOW_SIZE)]
+            )
+
+        lua.extend(source[0])
+        for _, before, _ in pipeline:
+            lua.extend(before)
+
+        lua.append(output_table.lua_add_lua_record('row'))
+
+        for _, _, after in reversed(pipeline):
+            lua.extend(after)
+        lua.extend(source[1])
+
+        return (output_table, '\n'.join(lua))
+
     def explain(self, table_name):
         offset = 0
         steps = []
@@ -69,8 +163,36 @@ class StageManager(object):
         return steps
 
 
-class Stage(object):
-    __metaclass__ = abc.ABCMeta
+class StageMeta(abc.ABCMeta):
+    """Checks each stage class as it is defined so that a stage that claims to
+    be `pipelined` without being able to compile itself into a fused loop
+    fails when the module is imported rather than when a query uses it.
+    """
+
+    def __init__(cls, name, bases, attrs):
+        abc.ABCMeta.__init__(cls, name, bases, attrs)
+        if cls.pipelined and not hasattr(cls, 'compile_pipelined_lua'):
+            raise TypeError(
+                "%s is pipelined but is not a PipelinedStage." % name
+            )
+
+
+# This is the same as `__metaclass__ = StageMeta` but works with Python 2 and 3.
+_StageBase = StageMeta('_StageBase', (object,), {'pipelined': False})
+
+
+class Stage(_StageBase):
+    """A single step of the query plan.
+
+    Attributes:
+      pipelined (bool): When this is True the stage processes one row at a time
+        and can be fused with its neighbours (see
+        `PipelinedStage.compile_pipelined_lua()`) rather than reading and
+        writing whole tables with `compile_lua()`. Only a `PipelinedStage` may
+        be pipelined, although a subclass of one may turn it off.
+    """
+
+    pipelined = False
 
     def __init__(self, input_table, offset, r):
         from tesseract import table
@@ -86,6 +208,26 @@ class Stage(object):
     def explain(self):
         pass
 
+    def lua_pipeline_setup(self):
+        """Lua that must run before the fused loop is entered. This is where
+        any variables that live across rows should be declared.
+
+        Returns:
+          str Lua code.
+        """
+        return ''
+
+    def lua_pipeline_source(self):
+        """Lua that opens and closes the fused loop when this is the first stage
+        of it. The loop must provide `row` and declare `scan_complete` (see
+        `Table.lua_iterate()`).
+
+        Returns:
+          A tuple of the Lua lines that open the loop and the Lua lines that
+          close it, or None to iterate the input table.
+        """
+        return None
+
     def iterate_page(self, lua):
         """Iterate a page and run some lua against each record.
 
@@ -108,3 +250,27 @@ class Stage(object):
         self.lua.append(self.input_table.lua_iterate())
         self.lua.extend(lua)
         self.lua.append(self.input_table.lua_end_iterate())
+
+
+class PipelinedStage(Stage):
+    """A stage that processes one row at a time and can be fused with its
+    neighbours (see `StageManager`).
+    """
+
+    pipelined = True
+
+    @abc.abstractmethod
+    def compile_pipelined_lua(self):
+        """Generate the Lua for this stage as part of a fused loop.
+
+        The code runs inside the loop with the current row in the Lua variable
+        `row`. A stage may replace `row` or skip it by opening a block that
+        the remaining stages (and the output of the row) are nested in. A stage
+        can stop the loop by setting `scan_complete` to `true` and then using
+        `break` (see `Table.lua_iterate()`).
+
+        Returns:
+          A tuple of the Lua lines that run before the rest of the loop, the Lua
+          lines that close any blocks they opened and the new offset.
+        """
+        pass
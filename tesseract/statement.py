@@ -1,13 +1,44 @@
 import json
-import os
 import redis
 from tesseract import ast
 from tesseract import protocol
+from tesseract import script
 from tesseract import stage
 
 
 class Statement(object):
-    """Represents a SQL statement."""
+    """Represents a SQL statement.
+
+    Attributes:
+      compiled_lua (str): The complete Lua program for the statement. This is
+        set the first time the statement is compiled (see `compile()`) so that
+        a statement returned from the `plan.PlanCache` does not need to be
+        compiled again.
+    """
+
+    compiled_lua = None
+
+    def is_parameterized(self):
+        """Test if the statement can be run with any values for its
+        parameters (see `parser.fingerprint()`).
+
+        This is only true for statements that use their values exclusively
+        through the compiled Lua program. The plan cache will only share these
+        statements between SQL that have different values.
+
+        Returns:
+          True if the parameters can be bound to different values.
+        """
+        return False
+
+    def is_cacheable(self):
+        """Test if the plan for the statement should be kept in the
+        `plan.PlanCache`.
+
+        Returns:
+          True if the statement may be cached.
+        """
+        return True
 
     def run(self, redis_connection, table_name, warnings, lua, args, result,
             manager=None):
@@ -18,36 +49,83 @@ class Statement(object):
         assert isinstance(lua, str)
         assert isinstance(args, list)
 
-        lua = self.__load_lua_dependencies(result) + lua
+        # Arguments (the parameters) are always sent as JSON.
+        args = [json.dumps(arg) for arg in args]
 
         try:
-            run = redis_connection.eval(lua, 0, table_name, *args)
+            run = self.evaluate(redis_connection, table_name, lua, args)
         except Exception as e:
-            from tesseract import transaction
-            manager = transaction.TransactionManager.get_instance(redis_connection)
-            manager.rollback()
+            return self._lua_error(e)
 
-            return self.__lua_error(e)
-
-        records = self.__retrieve_records(manager, redis_connection, run)
+        records = Records(redis_connection, str(run.decode()))
         return protocol.Protocol.successful_response(records, warnings)
 
-    def __load_lua_dependency(self, operator):
-        here = os.path.dirname(os.path.realpath(__file__))
-        with open(here + '/../lua/%s.lua' % operator) as lua_script:
-            return ''.join(lua_script.read())
+    def evaluate(self, redis_connection, table_name, lua, args):
+        """Run the Lua program for the statement. If the program fails the
+        transaction is rolled back before the error is raised.
+
+        Arguments:
+          redis_connection (redis.StrictRedis): The Redis connection.
+          table_name (Identifier): The table is always the first argument.
+          lua (str): The Lua program.
+          args (list of str): The rest of the arguments. The transaction
+            information is put before these.
+
+        Returns:
+          Whatever the Lua program returns.
+        """
+        assert isinstance(redis_connection, redis.StrictRedis)
+        assert isinstance(table_name, ast.Identifier)
+        assert isinstance(lua, str)
+        assert isinstance(args, list)
+
+        # The transaction information is always the second argument. See
+        # TransactionManager.lua_transaction_info().
+        from tesseract import transaction
+        transactions = transaction.TransactionManager.get_instance(redis_connection)
+        transaction_info = transactions.transaction_info()
+
+        try:
+            scripts = script.ScriptManager.get_instance(redis_connection)
+            return scripts.evaluate(lua, table_name, transaction_info, *args)
+        except Exception:
+            transactions.rollback()
+            raise
+
+    def compile(self, result, compile_lua):
+        """Get the complete Lua program for the statement. The program is only
+        compiled the first time and is then kept on the statement so that it
+        can be reused by the `plan.PlanCache`.
+
+        Arguments:
+          result (ParseResult): The parsed statement.
+          compile_lua (callable): Compiles and returns the Lua for the statement
+            (without the Lua dependencies).
+
+        Returns:
+          str Lua code.
+        """
+        if self.compiled_lua is None:
+            self.compiled_lua = self.__load_lua_dependencies(result) + \
+                compile_lua()
+
+        return self.compiled_lua
 
     def __load_lua_dependencies(self, result):
         """Lua dependencies. It is important we load the base before anything
         else otherwise Lua will throw an error about base stuff missing.
+
+        The files are not read from disk here, see `script.LuaLibrary`.
         """
-        base_lua = self.__load_lua_dependency('base')
+        library = script.LuaLibrary.get_instance()
+
+        base_lua = library.get('base')
         for requirement in result.lua_requirements:
-            base_lua += self.__load_lua_dependency(requirement)
+            base_lua += library.get(requirement)
 
         return base_lua
 
-    def __lua_error(self, e):
+    def _lua_error(self, e):
         """The actual exception message from Lua contains stuff we don't need
         to report on like the SHA1 of the program, the line number of the error,
         etc. So we need to trim down to what the actual usable message is.
@@ -59,27 +137,88 @@ class Statement(object):
 
         return protocol.Protocol.failed_response(message)
 
-    def __retrieve_records(self, manager, redis, run):
+
+
+class Records(object):
+    """The records in the result of a statement. The records are not read from
+    Redis until they are needed and then they are read in chunks so the entire
+    result does not need to be held in memory when it is streamed to the client.
+
+    Each chunk is read by a small Lua program that also removes the special keys
+    (`:id`, `:xid` and `:xex`) from the records. The records in the result table
+    must keep their `:id` because it is what makes each member of the sorted
+    set unique.
+
+    Attributes:
+      CHUNK_SIZE (int): The maximum number of records read from Redis at a
+        time.
+      table_name (str): The table that contains the result.
+    """
+
+    CHUNK_SIZE = 1000
+
+    LUA_READ_CHUNK = """
+local records = redis.call('ZRANGE', ARGV[1], ARGV[2], ARGV[3])
+for i, data in ipairs(records) do
+    local row = cjson.decode(data)
+    row[':id'] = nil
+    row[':xid'] = nil
+    row[':xex'] = nil
+    records[i] = cjson.encode(row)
+end
+return records
+"""
+
+    def __init__(self, redis_connection, table_name):
+        assert isinstance(redis_connection, redis.StrictRedis)
+        assert isinstance(table_name, str)
+
+        self.table_name = table_name
+        self.__redis = redis_connection
+
+    def raw_chunks(self):
+        """Read the records one chunk at a time without decoding them.
+
+        Returns:
+          A generator that yields lists of JSON encoded records (bytes).
+        """
         from tesseract import table
 
-        the_table = table.PermanentTable(redis, str(run.decode()))
-        records = []
+        the_table = table.PermanentTable(self.__redis, self.table_name)
+        scripts = script.ScriptManager.get_instance(self.__redis)
+        start = 0
+
+        while True:
+            chunk = scripts.evaluate(self.LUA_READ_CHUNK,
+                                     the_table.redis_key(), start,
+                                     start + self.CHUNK_SIZE - 1)
+            if len(chunk) == 0:
+                return
+
+            yield chunk
 
-        for record in redis.zrange(the_table.redis_key(), 0, -1):
-            record = json.loads(record.decode())
+            if len(chunk) < self.CHUNK_SIZE:
+                return
 
-            # This should certainly be in here because all tables (permanent or
-            # transient) need to be unique and so they are all entered with a
-            # row ID. Even though this isn't actually used in almost all cases.
-            record.pop(':id', None)
+            start += self.CHUNK_SIZE
 
-            # These are some cases where the statement plan is so small that the
-            # transactional information makes it through. Rather than making the
-            # plan more complicated to add extra steps to rip it out lets just
-            # clean up these now.
-            record.pop(':xid', None)
-            record.pop(':xex', None)
+    def chunks(self):
+        """Read the records one chunk at a time.
 
-            records.append(record)
+        Returns:
+          A generator that yields lists of records.
+        """
+        for chunk in self.raw_chunks():
+            yield [json.loads(record.decode()) for record in chunk]
+
+    def all(self):
+        """Read all of the records.
+
+        Returns:
+          list of records.
+        """
+        records = []
+        for chunk in self.chunks():
+            records.extend(chunk)
 
         return records
@@ -34,14 +34,12 @@ stored:
 """
 
 import json
-import random
 import redis
 from tesseract import ast
 from tesseract import instance
 from tesseract import protocol
 from tesseract import stage
 from tesseract import statement
-from tesseract import transaction
 
 
 class Table(object):
@@ -85,26 +83,23 @@ class Table(object):
         """
         assert isinstance(lua, str)
 
-        manager = transaction.TransactionManager.get_instance(self.redis)
-
         lines = (
             self.lua_get_lua_record(lua),
             "local record_to_delete = cjson.decode(irecords[1])",
 
-            manager.lua_transaction_info(),
             "if row_is_locked(record_to_delete, xid, xids) then",
             "  error('Transaction failed. Will ROLLBACK.')",
             "end",
 
             "if row_is_visible(record_to_delete, xid, xids) then",
-            "  record_to_delete[':xex'] = %d" % self._xid(),
-            "  redis.call('ZREMRANGEBYSCORE', '%s', %s, %s)" % (
-                self.redis_key(),
+            "  record_to_delete[':xex'] = xid",
+            "  redis.call('ZREMRANGEBYSCORE', %s, %s, %s)" % (
+                self.lua_redis_key(),
                 lua,
                 lua,
             ),
-            "  redis.call('ZADD', '%s', tostring(%s), cjson.encode(record_to_delete))" % (
-                self.redis_key(),
+            "  redis.call('ZADD', %s, tostring(%s), cjson.encode(record_to_delete))" % (
+                self.lua_redis_key(),
                 lua,
             ),
             "end",
@@ -115,10 +110,10 @@ class Table(object):
     def lua_add_lua_record(self, lua_variable):
         return '\n'.join((
             "%s[':id'] = %s" % (lua_variable, self.lua_get_next_record_id()),
-            "%s[':xid'] = %d" % (lua_variable, self._xid()),
+            "%s[':xid'] = xid" % lua_variable,
             "%s[':xex'] = %d" % (lua_variable, 0),
-            "redis.call('ZADD', '%s', tostring(%s[':id']), cjson.encode(%s)) " % (
-                self.redis_key(),
+            "redis.call('ZADD', %s, tostring(%s[':id']), json_encode(%s)) " % (
+                self.lua_redis_key(),
                 lua_variable,
                 lua_variable
             )
@@ -149,8 +144,8 @@ class Table(object):
             "else"
             "  score = tostring(score)",
             "end",
-            "local irecords = redis.call('ZRANGEBYSCORE', '%s', score, score) " % (
-                self.redis_key(),
+            "local irecords = redis.call('ZRANGEBYSCORE', %s, score, score) " % (
+                self.lua_redis_key(),
             ),
         ))
 
@@ -170,8 +165,8 @@ class Table(object):
 
         self.__set_record_meta(record)
 
-        return "redis.call('ZADD', '%s', '%s', '%s') " % (
-            self.redis_key(),
+        return "redis.call('ZADD', %s, '%s', '%s') " % (
+            self.lua_redis_key(),
             record[':id'],
             json.dumps(record)
         )
@@ -188,7 +183,7 @@ class Table(object):
         record[':xid'] = self._xid()
         record[':xex'] = 0
 
-    def lua_iterate(self):
+    def lua_iterate(self, window_size=None):
         """Generate the Lua required to iterate the records in a table.
 
         For each record read from the page there will be several initialized Lua
@@ -198,21 +193,66 @@ class Table(object):
           * `row` - The decoded row (also containing special keys like ':id')
             only if `decode` is `True`.
 
+        When a `window_size` is provided the records are read from Redis that
+        many at a time instead of all at once. The Lua variable `scan_complete`
+        can be set to `true` (followed by a `break`) to stop reading more
+        records. Only use a `window_size` when the table is not modified during
+        the loop.
+
         Note:
-          This will open the loop. You must use lua_end_iterate() to close the
-          loop.
+          This will open the loop. You must use lua_end_iterate() with the same
+          `window_size` to close the loop.
+
+        Arguments:
+          window_size (int): The number of records to read at a time.
         """
-        zrange = "redis.call('ZRANGE', '%s', '0', '-1')" % self.redis_key()
+        assert window_size is None or isinstance(window_size, int)
+
+        if window_size is None:
+            zrange = "redis.call('ZRANGE', %s, '0', '-1')" % self.lua_redis_key()
+        else:
+            zrange = "window"
+
         lua = "for _, data in ipairs(%s) do " % zrange
         lua += "local row = cjson.decode(data) "
 
-        return lua
+        if window_size is None:
+            return lua
+
+        return '\n'.join((
+            "local scan_complete = false",
+            "local window_start = 0",
+            "while not scan_complete do",
+            "local window = redis.call('ZRANGE', %s, window_start, "
+            "window_start + %d)" % (self.lua_redis_key(), window_size - 1),
+            "scan_complete = #window < %d" % window_size,
+            "window_start = window_start + %d" % window_size,
+            lua,
+        ))
+
+    def lua_end_iterate(self, window_size=None):
+        if window_size is None:
+            return "end\n"
 
-    def lua_end_iterate(self):
-        return "end\n"
+        return "end\nend\n"
 
     def lua_get_next_record_id(self):
-        return "redis.call('INCR', '%s')" % self._redis_record_id_key()
+        return "redis.call('INCR', %s)" % self._lua_redis_record_id_key()
+
+    def lua_reserve_record_ids(self, lua_count):
+        """Generate the Lua to reserve several record IDs at once. The IDs are
+        the `lua_count` numbers up to and including the returned ID.
+
+        Arguments:
+          lua_count (str): A Lua expression for the number of IDs.
+
+        Returns:
+          str Lua expression.
+        """
+        return "redis.call('INCRBY', %s, %s)" % (
+            self._lua_redis_record_id_key(),
+            lua_count
+        )
 
     def get_next_record_id(self):
         return self.redis.incr(self._redis_record_id_key())
@@ -225,6 +265,23 @@ class Table(object):
         """
         return 'tesseract:table:%s' % self.table_name
 
+    def lua_table_name(self):
+        """Get the name of the table as a Lua expression.
+
+        Returns:
+          str Lua code.
+        """
+        return "'%s'" % self.table_name
+
+    def lua_redis_key(self):
+        """Get the name of the Redis key as a Lua expression. This must be used
+        instead of `redis_key()` when generating Lua.
+
+        Returns:
+          str Lua code.
+        """
+        return "'%s'" % self.redis_key()
+
     def drop(self):
         self.__drop_all_indexes()
         self.redis.delete(self.redis_key())
@@ -236,12 +293,14 @@ class Table(object):
         """
         return 'tesseract:table:%s:rowid' % self.table_name
 
+    def _lua_redis_record_id_key(self):
+        """The same as `_redis_record_id_key()` but as a Lua expression."""
+        return "'%s'" % self._redis_record_id_key()
+
     def __drop_all_indexes(self):
-        for index_name in self.redis.hkeys('indexes'):
-            prefix = '%s.' % self.table_name
-            if str(self.redis.hget('indexes', index_name).decode()).startswith(prefix):
-                self.redis.hdel('indexes', index_name)
-                self.redis.delete('tesseract:index:%s' % index_name)
+        from tesseract import index
+        manager = index.IndexManager.get_instance(self.redis)
+        manager.drop_indexes_for_table(self.table_name)
 
 
 class PermanentTable(Table):
@@ -263,9 +322,9 @@ class TransientTable(Table):
     2. They can only be used by a single thread (never shared) so there is no
        risk of race conditions.
 
-    3. The name of the table is not required because a random name will be
-       generated for the table. You will want to retrieve the table name (to
-       pass to future stages) with the `table_name` attribute.
+    3. The name of the table is not required because a name will be generated
+       for the table. You will want to retrieve the table name (to pass to
+       future stages) with the `table_name` attribute.
 
     Since these tables are effectively private for the process that's using them
     and their contents is to be thrown away the the record IDs they generate are
@@ -273,26 +332,39 @@ class TransientTable(Table):
     the next record ID. It is generated and maintained in this instance of the
     class.
 
+    The generated name contains the transaction ID (so the vacuum knows when the
+    table is no longer needed) and a number that restarts with each request to
+    the connection. The Lua generated for a transient table reads the
+    transaction ID at runtime. This means the same statement will always compile
+    to the same Lua which allows the program to be cached by Redis.
+
     Attributes:
-      next_record_id (int): The next record ID to be used. This will increment
-        automatically.
+      table_id (int): The number used to make the table name unique within the
+        transaction.
     """
 
     def __init__(self, redis_connection):
-        Table.__init__(self, redis_connection, self.__random_table_name())
+        from tesseract import connection
+        current_connection = connection.Connection.current_connection()
+        self.table_id = current_connection.next_transient_table_id()
 
-    def __random_table_name(self):
-        """Generate a random table name."""
-        return 'tmp_%s_%s' % (self._xid(), ''.join(
-            random.choice('abcdefghijklmnopqrstuvwxyz')
-            for _ in range(8)
-        ))
+        table_name = 'tmp_%s_%d' % (self._xid(), self.table_id)
+        Table.__init__(self, redis_connection, table_name)
+
+    def lua_table_name(self):
+        return "'tmp_' .. xid .. '_%d'" % self.table_id
+
+    def lua_redis_key(self):
+        return "'tesseract:table:' .. %s" % self.lua_table_name()
+
+    def _lua_redis_record_id_key(self):
+        return "%s .. ':rowid'" % self.lua_redis_key()
 
     def lua_add_lua_record(self, lua_variable):
         return '\n'.join((
             "%s[':id'] = %s" % (lua_variable, self.lua_get_next_record_id()),
-            "redis.call('ZADD', '%s', tostring(%s[':id']), cjson.encode(%s)) " % (
-                self.redis_key(),
+            "redis.call('ZADD', %s, tostring(%s[':id']), cjson.encode(%s)) " % (
+                self.lua_redis_key(),
                 lua_variable,
                 lua_variable
             )
@@ -300,11 +372,17 @@ class TransientTable(Table):
 
     def lua_drop(self):
         lua = (
-            "redis.call('DEL', '%s')" % self.redis_key(),
-            "redis.call('DEL', '%s')" % self._redis_record_id_key(),
+            "redis.call('DEL', %s)" % self.lua_redis_key(),
+            "redis.call('DEL', %s)" % self._lua_redis_record_id_key(),
         )
         return '\n'.join(lua)
 
+    def drop(self):
+        """Transient tables never have indexes so there is no need to look for
+        them like `Table.drop()` does.
+        """
+        self.redis.delete(self.redis_key(), self._redis_record_id_key())
+
 
 class DropTableStatement(statement.Statement):
     """`DROP TABLE` statement."""
@@ -327,30 +405,22 @@ class DropTableStatement(statement.Statement):
         return protocol.Protocol.successful_response()
 
 
-class FullTableScan(stage.Stage):
+class FullTableScan(stage.PipelinedStage):
     def __init__(self, input_table, offset, redis, table_name):
         stage.Stage.__init__(self, input_table, offset, redis)
         assert isinstance(table_name, ast.Identifier)
         self.table_name = table_name
-        self.output_table = TransientTable(redis)
 
     def explain(self):
         return {
             "description": "Full table scan of '%s'" % self.table_name
         }
 
-    def compile_lua(self):
-        manager = transaction.TransactionManager.get_instance(self.redis)
-
-        lua = [
-            self.input_table.lua_iterate(),
-            manager.lua_transaction_info(),
+    def compile_pipelined_lua(self):
+        before = [
             "if row_is_visible(row, xid, xids) then",
             "row[':xid'] = nil",
             "row[':xex'] = nil",
-            self.output_table.lua_add_lua_record('row'),
-            "end",
-            self.input_table.lua_end_iterate(),
         ]
 
-        return (self.output_table, '\n'.join(lua), self.offset)
+        return (before, ["end"], self.offset)
@@ -315,10 +315,15 @@ class YAMLTestCase(unittest.TestCase):
 
     def get_client(self, port):
         from tesseract import client
+        from tesseract import protocol
         from tesseract import server
 
+        # Tables are loaded with a single INSERT which may be larger than an
+        # unframed message.
+        framing = protocol.Protocol.FRAMING_LENGTH
+
         try:
-            return client.Client(port=port)
+            return client.Client(port=port, framing=framing)
         except:
             global s
             s = server.Server(port=port)
@@ -331,7 +336,7 @@ class YAMLTestCase(unittest.TestCase):
             while not s.is_ready:
                 time.sleep(0.01)
 
-            return client.Client(port=port)
+            return client.Client(port=port, framing=framing)
 
     def load_table(self, connection, table_name, records, randomize=False):
         connection.execute('DROP TABLE %s' % table_name)
@@ -339,8 +344,8 @@ class YAMLTestCase(unittest.TestCase):
         if randomize:
             random.shuffle(records)
 
-        for record in records:
-            sql = 'INSERT INTO %s %s' % (table_name, json.dumps(record))
+        if records:
+            sql = 'INSERT INTO %s %s' % (table_name, json.dumps(records))
             connection.execute(sql)
 
     def assert_result_unordered(self, expected):
@@ -70,6 +70,7 @@ be a legitimate concern.
 .. _deadlock: http://en.wikipedia.org/wiki/Deadlock
 """
 
+import json
 import redis
 from tesseract import protocol
 from tesseract import statement
@@ -87,12 +88,32 @@ class TransactionManager(object):
         assert isinstance(redis_connection, redis.StrictRedis)
         self.__next_transaction_id = 1
         self.__active_transactions = set()
+        self.__protected_transactions = set()
         self.__redis = redis_connection
         self.__rollback_actions = {}
 
     def active_transaction_ids(self):
         return self.__active_transactions
 
+    def protect_results(self):
+        """Stop the vacuum from removing the transient tables of the current
+        transaction ID, even if it is not in a transaction. This is needed
+        while a request is being processed because the result may be read
+        (and streamed to the client) in many steps.
+
+        This must be followed by release_results().
+        """
+        self.__protected_transactions.add(self.__transaction_id())
+
+    def release_results(self):
+        """Allow the vacuum to remove the transient tables of the current
+        transaction ID once it is no longer active. See protect_results().
+        """
+        self.__protected_transactions.discard(self.__transaction_id())
+
+    def protected_transaction_ids(self):
+        return self.__protected_transactions
+
     def start_transaction(self):
         self.__active_transactions.add(self.__transaction_id())
 
@@ -144,19 +165,41 @@ class TransactionManager(object):
         assert isinstance(TransactionManager.__instance, TransactionManager)
         return TransactionManager.__instance
 
-    def lua_transaction_info(self):
-        from tesseract import connection
+    def transaction_info(self):
+        """The transaction information for the current connection. This is
+        passed to the Lua program as the second argument (rather than being
+        compiled into it) so the same program can be reused by every
+        transaction.
 
-        xids = []
-        for xid in self.active_transaction_ids():
-            xids.append("[%d]=true" % xid)
+        Returns:
+          A JSON string.
+        """
+        return json.dumps({
+            'xid': self.__transaction_id(),
+            'xids': sorted(self.active_transaction_ids()),
+        })
 
-        xid = connection.Connection.current_connection().transaction_id
+    def lua_transaction_info(self):
+        """Generate the Lua that exposes the transaction information provided
+        by transaction_info(). This must be included once at the start of the
+        program.
 
-        lua = " local xids = {%s} " % ' ,'.join(xids)
-        lua += "local xid = %s " % xid
+        The following Lua variables will be available:
 
-        return lua
+          * `xid` - The transaction ID of the current connection.
+          * `xids` - A table where the keys are the active transaction IDs.
+
+        Returns:
+          A string containing Lua code.
+        """
+        return '\n'.join((
+            "local transaction_info = cjson.decode(ARGV[2])",
+            "local xid = transaction_info['xid']",
+            "local xids = {}",
+            "for _, active_xid in ipairs(transaction_info['xids']) do",
+            "    xids[active_xid] = true",
+            "end",
+        ))
 
     def __transaction_id(self):
         from tesseract import connection
@@ -1,4 +1,5 @@
 from tesseract import ast
+from tesseract import index
 from tesseract import instance
 from tesseract import select
 from tesseract import stage
@@ -30,6 +31,9 @@ class UpdateStatement(statement.Statement):
 
         return sql
 
+    def is_parameterized(self):
+        return True
+
     def execute(self, result, tesseract):
         assert isinstance(result.statement, UpdateStatement)
         assert isinstance(tesseract, instance.Instance)
@@ -38,12 +42,17 @@ class UpdateStatement(statement.Statement):
 
         stages = stage.StageManager(tesseract.redis)
         stages.add(UpdateStage, (statement.columns, statement.where))
-        lua = stages.compile_lua(2, statement.table_name)
+        lua = self.compile(
+            result,
+            lambda: stages.compile_lua(2, statement.table_name)
+        )
 
-        return self.run(tesseract.redis, statement.table_name, [], lua, [],
-                        result)
+        return self.run(tesseract.redis, statement.table_name, [], lua,
+                        result.params, result)
 
 class UpdateStage(select.WhereStage):
+    pipelined = False
+
     def __init__(self, input_page, offset, redis, columns, where):
         select.WhereStage.__init__(self, input_page, offset, redis, where)
         assert isinstance(columns, list)
@@ -54,7 +63,7 @@ class UpdateStage(select.WhereStage):
 
         for column in self.columns:
             lua.append(
-                "row['%s'] = %s" % (column[0], column[1].compile_lua(0)[0])
+                "row['%s'] = %s" % (column[0], column[1].compile_lua(self.offset)[0])
             )
 
         lua.extend((
@@ -62,4 +71,10 @@ class UpdateStage(select.WhereStage):
             self.input_table.lua_add_lua_record('row'),
         ))
 
+        # The new version of the record has a new ID so it must be added to the
+        # indexes. The entries for the old version are removed by the vacuum
+        # once no transaction can see it.
+        manager = index.IndexManager.get_instance(self.redis)
+        lua.extend(manager.lua_add_record(self.input_table.table_name, 'row'))
+
         return '\n'.join(lua)
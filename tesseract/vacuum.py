@@ -7,6 +7,10 @@ works for transactions means that rows are marked as expired but are not
 actually deleted at the time. The act of *vacuuming* to to sweep through the
 database and permanently delete (hence freeing up) the memory.
 
+When a row is deleted its entries are also removed from the indexes of the
+table. They cannot be removed any earlier because other transactions may still
+find the row through an index.
+
 The process of vacuuming is actually more broad as it uses this time to also
 clean up old cached and other items that keep the database in its' neatest form.
 
@@ -49,7 +53,8 @@ class Vacuum(object):
         except that the last stage transient table will have to remain after the
         query to provide the result to the server. Also if the server crashed.
         In any case if the transient table does not belong to an active
-        transaction it will be cleaned up now.
+        transaction (or a request that is still sending its result) it will be
+        cleaned up now.
 
         This is from when the server was launched, not just the previous vacuum
         sweep.
@@ -128,28 +133,48 @@ class Vacuum(object):
         active_xids = manager.active_transaction_ids()
 
         for key in keys:
+            key = key.decode()
+
             # Delete left over temp tables.
-            if re.match(r'^tesseract:table:tmp_\d+_[a-z]{8}$', key):
-                self.__vacuum_temp_table(active_xids, key)
+            if re.match(r'^tesseract:table:tmp_\d+_\d+$', key):
+                self.__vacuum_temp_table(manager, key)
 
             # Scan for rows to be deleted in transactional tables.
             elif re.match(r'^tesseract:table:[^:]+$', key):
                 self.__vacuum_real_table(active_xids, key)
 
     def __vacuum_real_table(self, active_xids, key):
+        from tesseract import index
+
+        table_name = key[len('tesseract:table:'):]
+        manager = index.IndexManager.get_instance(self.redis)
+
         scan = self.redis.zscan(key)
-        while scan[0] != 0:
+        while True:
+            deleted = []
             for row in scan[1]:
-                raw = json.loads(row[0])
+                raw = json.loads(row[0].decode())
                 if ':xex' in raw and raw[':xex'] != 0 \
                         and raw[':xex'] not in active_xids:
                     self.redis.zremrangebyscore(key, raw[':id'], raw[':id'])
+                    deleted.append(raw)
                     self.deleted_rows += 1
+
+            # The index entries are only removed with the record itself.
+            if deleted:
+                manager.remove_records(table_name, deleted)
+
+            if scan[0] == 0:
+                break
             scan = self.redis.zscan(key, cursor=scan[0])
 
-    def __vacuum_temp_table(self, active_xids, key):
+    def __vacuum_temp_table(self, manager, key):
+        # The active and protected transactions are checked for each table
+        # (rather than once for all of the keys) because a request may have
+        # started using the table since the keys were scanned.
         xid = int(key.split('_')[1])
-        if xid not in active_xids:
+        if xid not in manager.active_transaction_ids() and \
+                xid not in manager.protected_transaction_ids():
             self.redis.delete(key, '%s:rowid' % key)
             self.deleted_temp_tables += 1
 
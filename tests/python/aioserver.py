@@ -0,0 +1,97 @@
+import sys
+import threading
+import time
+from unittest import TestCase
+from tesseract.client import Client
+from tesseract.protocol import Protocol
+
+# The asyncio server needs Python 3.7+.
+if sys.version_info >= (3, 7):
+    from tesseract.aioserver import AsyncServer
+else:
+    AsyncServer = None
+
+try:
+    from unittest import SkipTest
+except ImportError:
+    from nose.plugins.skip import SkipTest
+
+
+server = None
+
+
+def setUpModule():
+    global server
+    if AsyncServer is None:
+        raise SkipTest('the asyncio server needs Python 3.7+')
+
+    server = AsyncServer(port=8203, workers=4)
+    server.instance.log = lambda _: 0
+
+    thread = threading.Thread(target=server.start)
+    thread.start()
+
+    while not server.is_ready:
+        time.sleep(0.01)
+
+
+def tearDownModule():
+    if server:
+        server.exit()
+
+
+class TestAsyncServer(TestCase):
+    def test_select(self):
+        client = Client(port=8203)
+        self.assertEqual(client.execute('SELECT 1 + 2'), [{'col1': 3}])
+        client.close()
+
+    def test_insert_and_select(self):
+        client = Client(port=8203, framing=Protocol.FRAMING_LENGTH)
+        client.execute('DROP TABLE aioserver')
+        for i in range(3):
+            client.execute('INSERT INTO aioserver {"a": %d}' % i)
+
+        result = client.execute('SELECT a FROM aioserver ORDER BY a')
+        self.assertEqual(result, [{'a': 0}, {'a': 1}, {'a': 2}])
+        client.close()
+
+    def test_pipelining_with_newline_framing(self):
+        client = Client(port=8203, framing=Protocol.FRAMING_NEWLINE)
+        statements = ['SELECT %d' % i for i in range(100)]
+
+        results = client.execute_many(statements)
+        self.assertEqual(results, [[{'col1': i}] for i in range(100)])
+        client.close()
+
+    def test_more_connections_than_workers(self):
+        clients = [Client(port=8203) for _ in range(20)]
+        for i, client in enumerate(clients):
+            self.assertEqual(client.execute('SELECT %d' % i), [{'col1': i}])
+
+        for client in clients:
+            client.close()
+
+    def test_concurrent_clients(self):
+        results = {}
+
+        def run(i):
+            client = Client(port=8203, framing=Protocol.FRAMING_LENGTH)
+            results[i] = [client.execute('SELECT %d' % j)[0]['col1']
+                          for j in range(i, i + 10)]
+            client.close()
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {i: list(range(i, i + 10))
+                                   for i in range(10)})
+
+    def test_stream_rows(self):
+        client = Client(port=8203, framing=Protocol.FRAMING_LENGTH)
+        rows = client.execute_iter('SELECT 1')
+        self.assertEqual(list(rows), [{'col1': 1}])
+        client.close()
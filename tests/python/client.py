@@ -0,0 +1,166 @@
+import threading
+import time
+from unittest import TestCase
+from tesseract.client import Client, ClientException
+from tesseract.protocol import Protocol
+from tesseract.server import Server
+
+
+server = None
+
+
+def setUpModule():
+    global server
+    server = Server(port=8202)
+    server.instance.log = lambda _: 0
+
+    thread = threading.Thread(target=server.start)
+    thread.start()
+
+    while not server.is_ready:
+        time.sleep(0.01)
+
+
+def tearDownModule():
+    server.exit()
+
+
+class TestPreparedStatements(TestCase):
+    def setUp(self):
+        self.client = Client(port=8202)
+        self.client.execute('DROP TABLE prepared')
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_insert_and_select_with_params(self):
+        insert = self.client.prepare('INSERT INTO prepared {"a": ?, "b": ?}')
+        for i in range(3):
+            self.client.execute_prepared(insert, [i, 'b%d' % i])
+
+        select = self.client.prepare(
+            'SELECT b FROM prepared WHERE a >= ? ORDER BY a'
+        )
+        self.assertEqual(self.client.execute_prepared(select, [1]),
+                         [{'b': 'b1'}, {'b': 'b2'}])
+        self.assertEqual(self.client.execute_prepared(select, [2]),
+                         [{'b': 'b2'}])
+
+    def test_wrong_number_of_params(self):
+        select = self.client.prepare('SELECT * FROM prepared WHERE a = ?')
+        try:
+            self.client.execute_prepared(select, [])
+            self.fail("Expected failure")
+        except ClientException as e:
+            self.assertEqual(str(e), 'Expected 1 parameters, but received 0.')
+
+    def test_handle_that_doesnt_exist(self):
+        try:
+            self.client.execute_prepared(123, [])
+            self.fail("Expected failure")
+        except ClientException as e:
+            self.assertEqual(str(e), 'No such prepared statement 123.')
+
+    def test_placeholder_outside_of_prepared_statement(self):
+        try:
+            self.client.execute('SELECT ?')
+            self.fail("Expected failure")
+        except ClientException as e:
+            self.assertEqual(
+                str(e),
+                'Placeholders can only be used in prepared statements.'
+            )
+
+    def test_question_mark_string_is_not_a_placeholder(self):
+        self.assertEqual(self.client.execute("SELECT '?'"), [{'col1': '?'}])
+
+        self.client.execute('INSERT INTO prepared {"q": "?"}')
+        self.assertEqual(
+            self.client.execute("SELECT q FROM prepared WHERE q = '?'"),
+            [{'q': '?'}]
+        )
+
+    def test_sign_string_is_not_an_operator(self):
+        self.assertEqual(self.client.execute("SELECT '-', '+'"),
+                         [{'col1': '-', 'col2': '+'}])
+
+
+class TestFraming(TestCase):
+    def test_large_insert_with_length_framing(self):
+        client = Client(port=8202, framing=Protocol.FRAMING_LENGTH)
+        client.execute('DROP TABLE framing')
+        client.execute('INSERT INTO framing {"a": "%s"}' % ('x' * 5000))
+
+        result = client.execute('SELECT * FROM framing')
+        self.assertEqual(result, [{'a': 'x' * 5000}])
+        client.close()
+
+    def test_pipelining_with_newline_framing(self):
+        client = Client(port=8202, framing=Protocol.FRAMING_NEWLINE)
+        statements = ['SELECT %d' % i for i in range(100)]
+
+        results = client.execute_many(statements)
+        self.assertEqual(results, [[{'col1': i}] for i in range(100)])
+        client.close()
+
+    def test_pipelining_more_than_the_socket_buffers(self):
+        client = Client(port=8202, framing=Protocol.FRAMING_LENGTH)
+        value = 'x' * 65536
+        statements = ['SELECT "%s"' % value for _ in range(200)]
+
+        results = client.execute_many(statements)
+        self.assertEqual(results, [[{'col1': value}]] * 200)
+        client.close()
+
+    def test_unknown_framing(self):
+        client = Client(port=8202)
+        response = client._send({"framing": "foo"})
+        self.assertEqual(response, {
+            "success": False,
+            "error": 'Unknown framing "foo".'
+        })
+        client.close()
+
+
+class TestStreaming(TestCase):
+    def setUp(self):
+        self.client = Client(port=8202, framing=Protocol.FRAMING_LENGTH)
+        self.client.execute('DROP TABLE streaming')
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_rows_are_streamed_in_chunks(self):
+        insert = self.client.prepare('INSERT INTO streaming {"a": ?}')
+        for i in range(2500):
+            self.client.execute_prepared(insert, [i])
+
+        rows = self.client.execute_iter('SELECT a FROM streaming')
+        self.assertEqual(sorted(row['a'] for row in rows), list(range(2500)))
+
+    def test_limit_stops_the_scan(self):
+        insert = self.client.prepare('INSERT INTO streaming {"a": ?}')
+        for i in range(2500):
+            self.client.execute_prepared(insert, [i])
+
+        result = self.client.execute(
+            'SELECT a FROM streaming WHERE a >= 1200 LIMIT 3 OFFSET 900'
+        )
+        self.assertEqual(result, [{'a': 2100}, {'a': 2101}, {'a': 2102}])
+
+    def test_stream_an_error(self):
+        rows = self.client.execute_iter('SELECT 1 + "a"')
+        try:
+            list(rows)
+            self.fail("Expected failure")
+        except ClientException as e:
+            self.assertEqual(str(e), 'No such operator number + string.')
+
+    def test_streaming_requires_framing(self):
+        client = Client(port=8202)
+        response = client._send({"sql": "SELECT 1", "stream": True})
+        self.assertEqual(response, {
+            "success": False,
+            "error": "Streaming requires framing."
+        })
+        client.close()
@@ -0,0 +1,104 @@
+import redis
+from unittest import TestCase
+from tesseract import index
+from tesseract import plan
+from tesseract import table
+
+
+class TestIndexCatalog(TestCase):
+    def setUp(self):
+        self.redis = redis.StrictRedis()
+        self.manager = index.IndexManager.get_instance(self.redis)
+        self.catalog = index.IndexCatalog.get_instance()
+        table.PermanentTable(self.redis, 'catalogued').drop()
+        self.redis.zadd('tesseract:table:catalogued', 1,
+                        '{":id":1,":xid":1,":xex":0,"x":1}')
+
+    def tearDown(self):
+        table.PermanentTable(self.redis, 'catalogued').drop()
+
+    def create_index_on_another_server(self, index_name, field):
+        self.redis.hset(index.IndexManager.INDEXES_KEY, index_name,
+                        'catalogued.%s' % field)
+        self.redis.incr(index.IndexCatalog.VERSION_KEY)
+
+    def defer_indexes_on_another_server(self):
+        self.redis.hincrby(index.IndexManager.DEFERRED_KEY, 'catalogued', 1)
+        self.redis.incr(index.IndexCatalog.VERSION_KEY)
+
+    def test_indexes_created_by_another_server(self):
+        self.manager.create_index('catalogued_x', 'catalogued', 'x')
+        self.assertEqual(
+            sorted(self.manager.get_indexes_for_table('catalogued')),
+            ['catalogued_x']
+        )
+
+        self.create_index_on_another_server('catalogued_y', 'y')
+        self.assertEqual(
+            sorted(self.manager.get_indexes_for_table('catalogued')),
+            ['catalogued_x', 'catalogued_y']
+        )
+        self.assertEqual(self.manager.get_index('catalogued_y').field_name,
+                         'y')
+
+    def test_plans_are_removed_when_another_server_changes_indexes(self):
+        plans = plan.PlanCache.get_instance()
+        sql = 'SELECT * FROM catalogued WHERE y = 1'
+        self.catalog.refresh(self.redis)
+        statement = plans.parse(sql).statement
+
+        self.catalog.refresh(self.redis)
+        self.assertIs(plans.parse(sql).statement, statement)
+
+        self.create_index_on_another_server('catalogued_y', 'y')
+        self.catalog.refresh(self.redis)
+        self.assertIsNot(plans.parse(sql).statement, statement)
+
+    def test_plans_are_removed_when_another_server_defers_indexes(self):
+        plans = plan.PlanCache.get_instance()
+        sql = 'SELECT * FROM catalogued WHERE x = 1'
+        self.manager.create_index('catalogued_x', 'catalogued', 'x')
+        self.catalog.refresh(self.redis)
+        statement = plans.parse(sql).statement
+
+        self.defer_indexes_on_another_server()
+        self.catalog.refresh(self.redis)
+        deferred_statement = plans.parse(sql).statement
+        self.assertIsNot(deferred_statement, statement)
+
+        # And again once the other server has rebuilt the indexes.
+        self.redis.hdel(index.IndexManager.DEFERRED_KEY, 'catalogued')
+        self.redis.incr(index.IndexCatalog.VERSION_KEY)
+        self.catalog.refresh(self.redis)
+        self.assertIsNot(plans.parse(sql).statement, deferred_statement)
+
+    def test_defer_and_rebuild_indexes_change_the_version(self):
+        self.manager.create_index('catalogued_x', 'catalogued', 'x')
+
+        version = int(self.redis.get(index.IndexCatalog.VERSION_KEY))
+        self.manager.defer_indexes('catalogued')
+        self.assertEqual(int(self.redis.get(index.IndexCatalog.VERSION_KEY)),
+                         version + 1)
+
+        # Deferring again changes nothing for the planner.
+        self.manager.defer_indexes('catalogued')
+        self.assertEqual(int(self.redis.get(index.IndexCatalog.VERSION_KEY)),
+                         version + 1)
+
+        self.manager.rebuild_indexes('catalogued')
+        self.assertEqual(int(self.redis.get(index.IndexCatalog.VERSION_KEY)),
+                         version + 2)
+
+    def test_drop_index(self):
+        self.manager.create_index('catalogued_x', 'catalogued', 'x')
+        self.manager.drop_index('catalogued_x')
+
+        self.assertEqual(self.manager.get_indexes_for_table('catalogued'), {})
+        self.assertFalse(self.manager.get_index('catalogued_x'))
+
+    def test_drop_table_removes_indexes(self):
+        self.manager.create_index('catalogued_x', 'catalogued', 'x')
+        table.PermanentTable(self.redis, 'catalogued').drop()
+
+        self.assertEqual(self.manager.get_indexes_for_table('catalogued'), {})
+        self.assertEqual(self.redis.keys('tesseract:index:catalogued:*'), [])
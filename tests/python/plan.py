@@ -0,0 +1,21 @@
+from unittest import TestCase
+from tesseract import plan
+
+
+class TestPlanCache(TestCase):
+    def setUp(self):
+        self.plans = plan.PlanCache.get_instance()
+        self.plans.clear()
+
+    def test_single_insert_is_cached(self):
+        self.plans.parse('INSERT INTO cached {"a": 1}')
+        self.plans.parse('INSERT INTO cached {"a": 2}')
+        self.assertEqual(len(self.plans), 1)
+
+    def test_array_inserts_are_not_cached(self):
+        for rows in range(1, 20):
+            records = ', '.join('{"a": %d, "b": "%d"}' % (i, i)
+                                for i in range(rows))
+            self.plans.parse('INSERT INTO cached [%s]' % records)
+
+        self.assertEqual(len(self.plans), 0)
@@ -0,0 +1,36 @@
+from unittest import TestCase
+from tesseract import stage
+
+
+class TestStage(TestCase):
+    def test_pipelined_stage_must_be_a_pipelined_stage(self):
+        def define():
+            class BadStage(stage.Stage):
+                pipelined = True
+
+                def explain(self):
+                    pass
+
+        self.assertRaises(TypeError, define)
+
+    def test_pipelined_stage_must_compile_pipelined_lua(self):
+        class IncompleteStage(stage.PipelinedStage):
+            def explain(self):
+                pass
+
+        self.assertEqual(
+            IncompleteStage.__abstractmethods__,
+            frozenset(['compile_pipelined_lua'])
+        )
+
+    def test_subclass_of_pipelined_stage_can_turn_it_off(self):
+        class WholeTableStage(stage.PipelinedStage):
+            pipelined = False
+
+            def explain(self):
+                pass
+
+            def compile_pipelined_lua(self):
+                pass
+
+        self.assertFalse(WholeTableStage.pipelined)
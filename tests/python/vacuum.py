@@ -0,0 +1,77 @@
+import json
+import threading
+import time
+from unittest import TestCase
+from tesseract import vacuum
+from tesseract.client import Client
+from tesseract.protocol import Protocol
+from tesseract.server import Server
+
+
+server = None
+
+
+def setUpModule():
+    global server
+    server = Server(port=8204)
+    server.instance.log = lambda _: 0
+
+    thread = threading.Thread(target=server.start)
+    thread.start()
+
+    while not server.is_ready:
+        time.sleep(0.01)
+
+
+def tearDownModule():
+    server.exit()
+
+
+class TestVacuum(TestCase):
+    def setUp(self):
+        self.client = Client(port=8204)
+        self.client.execute('DROP TABLE vacuumed')
+        self.client.execute('DROP INDEX vacuumed_x')
+
+    def tearDown(self):
+        self.client.close()
+
+    def index_entries(self):
+        redis = server.instance.redis
+        return sorted(
+            redis.zrange('tesseract:index:vacuumed:vacuumed_x:number', 0, -1) +
+            redis.zrange('tesseract:index:vacuumed:vacuumed_x:nonnumber', 0,
+                         -1)
+        )
+
+    def test_removes_index_entries_for_deleted_records(self):
+        for k, x in enumerate(('1', '2', '"a"')):
+            self.client.execute('INSERT INTO vacuumed {"k": %d, "x": %s}' %
+                                (k, x))
+        self.client.execute('CREATE INDEX vacuumed_x ON vacuumed (x)')
+        self.client.execute('DELETE FROM vacuumed WHERE k = 1')
+        self.client.execute('UPDATE vacuumed SET x = "b" WHERE k = 2')
+        self.assertEqual(len(self.index_entries()), 4)
+
+        vacuum.vacuum._run()
+
+        self.assertEqual(self.index_entries(), [b'1', b'Sb:4'])
+        self.assertEqual(
+            self.client.execute('SELECT * FROM vacuumed WHERE x = "b"'),
+            [{'k': 2, 'x': 'b'}]
+        )
+
+    def test_keeps_result_that_is_being_streamed(self):
+        client = Client(port=8204, framing=Protocol.FRAMING_LENGTH)
+        records = [{"k": k, "padding": ('%05d' % k) * 200}
+                   for k in range(20000)]
+        client.execute('INSERT INTO vacuumed %s' % json.dumps(records))
+
+        # The result is much larger than the socket buffers so the server is
+        # still reading it from the transient table during the vacuum.
+        rows = client.execute_iter('SELECT * FROM vacuumed WHERE k >= 0')
+        first = next(rows)
+        vacuum.vacuum._run()
+
+        self.assertEqual(len([first] + list(rows)), 20000)
+        client.close()